@@ -31,6 +31,7 @@ import sys
 from pathlib import Path
 
 import matplotlib
+import numpy as np
 from numpy import isin
 
 matplotlib.use("Agg")  # 不使用 GUI backend
@@ -38,7 +39,7 @@ from io import BytesIO
 
 import cv2
 import matplotlib.pyplot as plt
-from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtCore import QThread, Qt, QTimer, pyqtSignal
 from PyQt5.QtGui import QImage, QPixmap
 from PyQt5.QtWidgets import (
     QApplication,
@@ -53,6 +54,37 @@ from PyQt5.QtWidgets import (
     QWidget,
 )
 
+# 从项目根目录运行 python GUI/analysis_display.py 时 utils 不在 sys.path 上
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from utils.frame_cache import FrameCache
+
+
+class FrameCacheLoader(QThread):
+    """
+    在后台线程里打开并校验帧缓存（计算视频的 sha256 比较慢），
+    完成后通过 loaded 信号把 (视频路径, (memmap 的 RGB 帧, fps) 或 None) 发回 GUI 线程。
+    只用包含全部帧的缓存。
+    """
+
+    loaded = pyqtSignal(str, object)
+
+    def __init__(self, cache_dir: Path, path: str, parent=None):
+        super().__init__(parent)
+        self.cache_dir = cache_dir
+        self.path = path
+
+    def run(self):
+        cached = None
+        try:
+            # 原尺寸的缓存，全部帧在一个 part 里时是 memmap 的视图
+            cache = FrameCache(self.cache_dir, self.path)
+            if cache.covers(range(cache.frame_count)):
+                cached = (cache.get_batch(range(cache.frame_count)), cache.fps)
+        except OSError:
+            cached = None
+
+        self.loaded.emit(self.path, cached)
+
 
 class VideoPlayer(QWidget):
     def __init__(self):
@@ -219,6 +251,9 @@ class VideoPlayer(QWidget):
         self.timer.timeout.connect(self.next_frame)
 
         self.cap = None
+        # 有帧缓存时直接从 memmap 读帧，不用 VideoCapture 解码
+        self.frames = None
+        self._loading_path = None
         self.fps = 30
         self.current_frame = 0
         self.annotations = []
@@ -282,18 +317,37 @@ class VideoPlayer(QWidget):
 
             path = str(self.video_files[index])
 
-            # 用 singleShot 把真正的工作放到事件循环的下一拍执行
-            # 这样界面会先刷新出 loading 画面
-            # 这里控制延时 2 秒模拟处理时间
-            QTimer.singleShot(3000, lambda p=path: self._open_video(p))
+            # 帧缓存（utils/frame_cache.py 生成）在后台线程里打开和校验，
+            # 界面保持 loading 画面，完成后在 GUI 线程里调用 _on_frame_cache_loaded
+            self._loading_path = path
+            loader = FrameCacheLoader(
+                self.resource_path("assets") / "frame_cache", path, parent=self
+            )
+            loader.loaded.connect(self._on_frame_cache_loaded)
+            loader.finished.connect(loader.deleteLater)
+            loader.start()
 
-    def _open_video(self, path: str):
+    def _on_frame_cache_loaded(self, path: str, cached):
+        # 加载期间又选了别的视频，丢掉旧的结果
+        if path != self._loading_path:
+            return
+
+        self._open_video(path, cached)
+
+    def _open_video(self, path: str, cached=None):
         # 真正的“加载视频 + 初始化播放”的逻辑
         if self.cap:
             self.cap.release()
+            self.cap = None
 
-        self.cap = cv2.VideoCapture(path)
-        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
+        self.frames = None
+        self.current_frame = 0
+
+        if cached is not None:
+            self.frames, self.fps = cached
+        else:
+            self.cap = cv2.VideoCapture(path)
+            self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
 
         # （如果后面你有更重的预处理，比如读取所有帧、跑推理，
         #  可以在这里加入循环，同时适当手动更新一个百分比进度）
@@ -335,19 +389,29 @@ class VideoPlayer(QWidget):
         return source, temp
 
     def next_frame(self):
-        if not self.cap:
-            return
-        ret, frame = self.cap.read()
-        if not ret:
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-            self.analysis_res_draw = []  # 重置分析结果
-            return
+        if self.frames is not None:
+            if self.current_frame >= len(self.frames):
+                self.current_frame = 0
+                self.analysis_res_draw = []  # 重置分析结果
+                return
+            # QImage 需要连续的内存
+            rgb_image = np.ascontiguousarray(self.frames[self.current_frame])
+            self.current_frame += 1
+        else:
+            if not self.cap:
+                return
+            ret, frame = self.cap.read()
+            if not ret:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                self.analysis_res_draw = []  # 重置分析结果
+                return
+
+            self.current_frame = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+            rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
 
         # find max temp
         max_temp = max(self.temp) if self.temp else None
 
-        self.current_frame = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
-        rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         h, w, ch = rgb_image.shape
         bytes_per_line = ch * w
         qt_image = QImage(rgb_image.data, w, h, bytes_per_line, QImage.Format_RGB888)
@@ -424,6 +488,9 @@ class VideoPlayer(QWidget):
     def find_res_with_position(self, frame_idx):
         for info in self.annotations:
             if info.get("frame_idx") == frame_idx:
+                # 新的结果里已经有解析好的字段
+                if "source" in info and "proportion" in info:
+                    return info
                 return self.convert_str_dict(info.get("output_text"))
         return None
 
@@ -234,6 +234,9 @@ class VideoPlayer(QWidget):
     def find_res_with_position(self, frame_idx):
         for info in self.annotations:
             if info.get("frame_idx") == frame_idx:
+                # 新的结果里已经有解析好的字段
+                if "source" in info and "proportion" in info:
+                    return info
                 return self.convert_str_dict(info.get("output_text"))
         return None
 
@@ -129,6 +129,9 @@ class VideoPlayer(QWidget):
             info_output_text = one_info["output_text"]
 
             if info_frame_idx == frame_idx:
+                # 新的结果里已经有解析好的字段
+                if "source" in one_info and "proportion" in one_info:
+                    return one_info
                 preprocess_llm_res = self.convert_str_dict(info_output_text)
                 return preprocess_llm_res
 
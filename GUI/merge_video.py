@@ -15,25 +15,19 @@ import os
 import re
 from pathlib import Path
 import json
+import sys
+
+# python GUI/merge_video.py 运行时 utils 不在 sys.path 上
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from utils.decoders import open_decoder
+
+# 解码 backend，"auto" 在每个视频上选最快的一个
+DECODER = "decord"
+
 
 def get_video_frame_count(video_path: str) -> int:
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        raise RuntimeError(f"Cannot open video: {video_path}")
-    n = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    cap.release()
-
-    # 某些视频 CAP_PROP_FRAME_COUNT 可能为 0/不准，兜底逐帧统计
-    if n <= 0:
-        cap = cv2.VideoCapture(video_path)
-        n = 0
-        while True:
-            ret, _ = cap.read()
-            if not ret:
-                break
-            n += 1
-        cap.release()
-    return n
+    with open_decoder(video_path, DECODER) as decoder:
+        return decoder.frame_count
 
 
 def convert_str_dict(llm_res):
@@ -76,7 +70,11 @@ def merge_json_files_frameidx(json_paths, video_paths, merged_json_path):
             if "frame_idx" not in item:
                 raise ValueError(f"{json_path} 缺少 key: frame_idx")
 
-            _data = convert_str_dict(item["output_text"])
+            # 新的结果里已经有解析好的字段
+            if "source" in item and "proportion" in item:
+                _data = item
+            else:
+                _data = convert_str_dict(item["output_text"])
 
             new_item["second"] = item["second"]
             new_item["ms"] = item["ms"]
@@ -159,29 +157,21 @@ def merge_json_files_with_video_offsets(json_paths, video_paths, merged_json_pat
     print(f"Detected frame key = {frame_key}, total_offset = {frame_offset}")
 
 def merge_videos(video_paths, output_path):
-    caps = [cv2.VideoCapture(p) for p in video_paths]
-
-    width = int(caps[0].get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(caps[0].get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = caps[0].get(cv2.CAP_PROP_FPS)
+    with open_decoder(video_paths[0], DECODER) as decoder:
+        height, width = decoder.source_size
+        fps = decoder.fps
 
     fourcc = cv2.VideoWriter_fourcc(*"mp4v")
     os.makedirs(Path(output_path).parent, exist_ok=True)
     writer = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
 
-    for cap, path in zip(caps, video_paths):
-        if not cap.isOpened():
-            raise RuntimeError(f"Cannot open video: {path}")
-
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            if frame.shape[1] != width or frame.shape[0] != height:
-                frame = cv2.resize(frame, (width, height))
-            writer.write(frame)
-
-        cap.release()
+    for path in video_paths:
+        # OpenCV 写视频要 BGR，尺寸不同的视频在解码时直接缩放
+        with open_decoder(
+            path, DECODER, width=width, height=height, pixel_format="bgr"
+        ) as decoder:
+            for _, frame in decoder.iter_frames():
+                writer.write(frame)
 
     writer.release()
 
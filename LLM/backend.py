@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+File: /workspace/temp_feedback/Temp_Feedback/LLM/backend.py
+Project: /workspace/temp_feedback/Temp_Feedback/LLM
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+The common interface of the vision language backends.
+BLIP, Qwen2VL (huggingface and vllm) and DeepSeek all implement
+VisionBackend.infer(images, prompt), so the server can serve any of them,
+and they share the image loading and the layout of the frame records.
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 10:05:44 am
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+"""
+
+import logging
+from pathlib import Path
+from typing import Protocol, runtime_checkable
+
+import numpy as np
+from PIL import Image
+
+from utils.structured_output import parse_analysis
+
+logger = logging.getLogger(__name__)
+
+
+@runtime_checkable
+class VisionBackend(Protocol):
+    """a loaded vision language model.
+
+    name is the model version, infer runs the prompt on a batch of images
+    and returns one output text per image.
+    """
+
+    name: str
+
+    def infer(self, images: list, prompt: str = None) -> list:
+        ...
+
+
+def load_image(image, keep_array: bool = False):
+    """an RGB PIL image from a path, an RGB array, a PIL image or a frame_info dict.
+
+    Args:
+        image: the image.
+        keep_array (bool, optional): return an RGB array as it is, for the processors that take arrays. Defaults to False.
+    """
+
+    if isinstance(image, dict):
+        image = image["image"]
+
+    if isinstance(image, (str, Path)):
+        return Image.open(image).convert("RGB")
+    if isinstance(image, np.ndarray):
+        return image if keep_array else Image.fromarray(image)
+
+    return image.convert("RGB") if image.mode != "RGB" else image
+
+
+def build_record(frame_info: dict, output_text: str, **extra):
+    """the results record of one frame, the layout of the results store."""
+
+    return {
+        "video_path": str(frame_info["video_path"]),
+        "frame_idx": int(frame_info["frame_idx"]),
+        "second": int(frame_info["second"]),
+        "ms": int(frame_info["current_ms"]),
+        **extra,
+        "output_text": [output_text],
+        **parse_analysis(output_text),
+    }
@@ -23,23 +23,93 @@ Date      	By	Comments
 ----------	---	---------------------------------------------------------
 """
 
+import functools
 import logging
-import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
 import re
+import sys
 import cv2
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 
+# python LLM/draw_res_to_img.py 运行时 utils 不在 sys.path 上
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from utils.decoders import open_decoder
+from utils.frame_cache import FrameCache
+from utils.ledger import file_hash
+from utils.results_store import ResultsStore
+from utils.sharding import plan_shards, run_sharded
+from utils.structured_output import analysis_fields
+
 logger = logging.getLogger(__name__)
 
+FONT_PATH = "/workspace/code/LLM/TIMESBD.TTF"
+
+_FONT_LOCK = threading.Lock()
+
+
+@functools.lru_cache(maxsize=8)
+def load_font(font_path: str, font_size: int):
+    """the font, loaded once per (font_path, font_size).
+
+    Args:
+        font_path (str): 字体文件路径（.ttf/.ttc），None 时用 Pillow 的默认字体。
+        font_size (int): 字体大小。
+    """
+
+    if font_path is None:
+        return ImageFont.load_default(font_size)
+    return ImageFont.truetype(font_path, font_size)
+
+
+@functools.lru_cache(maxsize=1024)
+def render_text(text: str, font_path: str, font_size: int):
+    """the alpha mask of one line of text, rendered once per string.
+
+    Returns:
+        tuple: ((dx, dy) offset of the mask from the text position, (h, w) uint8 alpha mask)
+    """
+
+    font = load_font(font_path, font_size)
+    # 同一个 FreeType 字体不在多个线程里同时渲染
+    with _FONT_LOCK:
+        left, top, right, bottom = font.getbbox(text)
+        mask = Image.new("L", (max(1, right - left), max(1, bottom - top)), 0)
+        ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255)
+
+    mask = np.asarray(mask)
+    mask.flags.writeable = False
+
+    return (left, top), mask
+
+
+def blend_text(frame, mask, position, color_bgr):
+    """alpha-blend the color into the frame through the mask at position, in place.
+
+    Only the region under the mask is touched, the part outside the frame is clipped.
+    """
+
+    x, y = position
+    height, width = frame.shape[:2]
+
+    # 裁掉画面外的部分
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + mask.shape[1], width), min(y + mask.shape[0], height)
+    if x0 >= x1 or y0 >= y1:
+        return frame
+
+    alpha = mask[y0 - y : y1 - y, x0 - x : x1 - x, None].astype(np.uint16)
+    region = frame[y0:y1, x0:x1].astype(np.uint16)
+    color = np.asarray(color_bgr, dtype=np.uint16)
+
+    frame[y0:y1, x0:x1] = (region * (255 - alpha) + color * alpha + 127) // 255
 
-def convert_str_dict(llm_res):
-    match = re.search(r"\{.*?\}", llm_res[0], re.DOTALL)
-    if match:
-        return json.loads(match.group(0))
-    return {"source": "none", "proportion": "none", "location": "none"}
+    return frame
 
 
 def draw_text_with_font(
@@ -47,12 +117,14 @@ def draw_text_with_font(
 ):
     """
     在图像上用指定字体绘制多行文字。
+    字体只加载一次，每行文字的 alpha mask 按字符串缓存，只在文字区域内混合颜色，
+    不再整帧转换 BGR/RGB/PIL。
 
     Args:
-        frame (np.ndarray): 原始 OpenCV 图像 (BGR)。
+        frame (np.ndarray): 原始 OpenCV 图像 (BGR)，不会被修改。
         text_lines (List[str]): 要绘制的多行文字。
         positions (List[Tuple[int, int]]): 每行文字的位置。
-        font_path (str): 字体文件路径（.ttf/.ttc）。
+        font_path (str): 字体文件路径（.ttf/.ttc），None 时用 Pillow 的默认字体。
         font_size (int): 字体大小。
         font_color (Tuple[int, int, int]): 文字颜色 (RGB)。
 
@@ -60,107 +132,452 @@ def draw_text_with_font(
         np.ndarray: 绘制完文字后的图像（BGR）。
     """
 
-    # 转换 BGR 到 RGB，并转为 PIL 图像
-    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    image_pil = Image.fromarray(frame_rgb)
-    draw = ImageDraw.Draw(image_pil)
-
-    # 加载字体
-    font = ImageFont.truetype(font_path, font_size)
+    overlay = np.array(frame, dtype=np.uint8, order="C")
+    color_bgr = font_color[::-1]
 
     # 绘制每一行文字
-    for text, pos in zip(text_lines, positions):
-        draw.text(pos, text, font=font, fill=font_color)
+    for text, (x, y) in zip(text_lines, positions):
+        (dx, dy), mask = render_text(text, font_path, font_size)
+        blend_text(overlay, mask, (x + dx, y + dy), color_bgr)
+
+    return overlay
 
-    # 转回 OpenCV 格式（BGR）
-    return cv2.cvtColor(np.array(image_pil), cv2.COLOR_RGB2BGR)
 
 def extract_sort_key(file_path):
     # 提取文件名中的数字：frame_0_second_0_ms_123.jpg → [0, 0, 123]
     numbers = list(map(int, re.findall(r'\d+', file_path.name)))
     return numbers  # 例如：[0, 0, 123]
 
-def merge_res_to_img(info_path: Path, output_path: Path):
+def list_video_frames(video: Path, results_store: ResultsStore):
+    """the frames to render of one processed video, listed once.
 
-    for video in tqdm(info_path.iterdir(), desc="video file"):
+    Returns:
+        list: (frame_idx, saved frame path or None), the saved frames when there are, the frames with results otherwise.
+    """
 
-        logger.info(f"Processed video: {video.stem}")
+    _frames = video / "frames"
+    if _frames.exists():
+        # 排序文件夹中所有帧
+        frames_sorted = sorted(_frames.iterdir(), key=extract_sort_key)
+        if frames_sorted:
+            return [(extract_sort_key(f)[0], f) for f in frames_sorted]
 
-        _frames = video / "frames"
-        _image_info = video / "image_info"
+    return [(frame_idx, None) for frame_idx in results_store.frame_indices()]
 
-        overlay_res = []
 
-        # 排序两个文件夹中所有文件
-        frames_sorted = sorted(_frames.iterdir(), key=extract_sort_key)
-        info_sorted = sorted(_image_info.iterdir(), key=extract_sort_key)
-
-        for f, res in tqdm(
-            zip(frames_sorted, info_sorted),
-            desc="frame and image_info",
-            total=len(list(_frames.iterdir())),
-        ):
-
-            # load frame
-            frame = cv2.imread(f)
-            frame_height, frame_width = frame.shape[:2]
-
-            overlay = frame.copy()
-
-            # load image info
-            with open(res, "r") as f_info:
-                image_info = json.load(f_info)
-
-            _info_dict = convert_str_dict(image_info["output_text"])
-
-            if _info_dict:
-                source = _info_dict["source"].upper()
-                proportion = _info_dict["proportion"] * 100
-                location = _info_dict["location"]
-
-                line_spacing = 90  # 每行文字的垂直间距（可根据字体大小调整）
-                num_lines = 2
-
-                # FIXME: the position is err some times, need to be fixed
-                # 动态计算每一行的位置（从下往上）
-                positions = [
-                    (20, frame_height - line_spacing * (num_lines - i))  # 例如：(20, 580), (20, 650)
-                    for i in range(num_lines)
-                ]
-
-                overlay = draw_text_with_font(
-                    overlay,
-                    [
-                        f"TYPE: {source}",
-                        f"PROPORTION: {proportion}%",
-                    ],
-                    positions,
-                    font_path="/workspace/code/LLM/TIMESBD.TTF",
-                    font_size=80,
-                    font_color=(255, 255, 255),
-                )
+def iter_video_frames(
+    video: Path,
+    results_store: ResultsStore,
+    decoder: str = "decord",
+    frame_cache: Path = None,
+    frames: list = None,
+    video_hash: str = None,
+):
+    """(frame_idx, BGR frame) of the processed frames of one video.
+
+    The frames are read from the memory-mapped frame cache when it has all
+    of them, decoded from the source video in the results when it is still
+    there, which skips the jpg decoding and gives the full resolution, and
+    read from the saved frames otherwise.
+
+    Args:
+        frames (list, optional): (frame_idx, saved frame path) to read, e.g. one segment. Defaults to None, list_video_frames.
+        video_hash (str, optional): sha256 of the source video for the frame cache. Defaults to None, hashed by FrameCache.
+    """
 
-            overlay_res.append(overlay)
+    if frames is None:
+        frames = list_video_frames(video, results_store)
+    frame_indices = [frame_idx for frame_idx, _ in frames]
 
-        # 定义视频编码器和输出路径
-        fourcc = cv2.VideoWriter_fourcc(*"mp4v")  # 编码格式
-        _opt_path = output_path / "video_text_vis"
-        _opt_path.mkdir(parents=True, exist_ok=True)
+    video_paths = [Path(p) for p in results_store.videos]
 
-        out = cv2.VideoWriter(
-            f"{_opt_path}/{video.stem}_text.mp4",
-            fourcc,
-            30.0,
-            (frame_width, frame_height),
-        )
+    if frame_cache is not None and len(video_paths) == 1:
+        # 原尺寸的缓存，和解码原视频得到的帧一样
+        cache = FrameCache(frame_cache, video_paths[0], video_hash)
+        if cache.covers(frame_indices):
+            # 缓存是 RGB，翻转通道的视图就是 BGR
+            for frame_idx in frame_indices:
+                yield frame_idx, cache.get(frame_idx)[..., ::-1]
+            return
+
+    if len(video_paths) == 1 and video_paths[0].exists():
+        with open_decoder(video_paths[0], decoder, pixel_format="bgr") as vr:
+            yield from vr.iter_frames(frame_indices)
+        return
+
+    for frame_idx, f in frames:
+        if f is not None:
+            yield frame_idx, cv2.imread(f)
+
+
+def overlay_fps(
+    results_store: ResultsStore, frame_indices: list, decoder: str = "decord", default: float = 30.0
+):
+    """fps of the overlay video, so that it plays in real time.
+
+    The fps of the source video comes from the video itself when it is still
+    there, and from frame_idx and ms of the last result otherwise, and it is
+    divided by the sampling step of the rendered frames.
+
+    Returns:
+        float: the fps, default when the results have no timing.
+    """
+
+    source_fps = None
+    video_paths = results_store.videos
+
+    if len(video_paths) == 1 and Path(video_paths[0]).exists():
+        with open_decoder(video_paths[0], decoder) as vr:
+            source_fps = vr.fps
+    elif len(video_paths) == 1 and len(results_store):
+        record = results_store.get(results_store.frame_indices()[-1])
+        if record.get("ms"):
+            # ms = int(frame_idx * 1000 / fps)，最后一帧的误差最小
+            source_fps = record["frame_idx"] * 1000 / record["ms"]
+
+    if not source_fps:
+        logger.warning(f"No fps in the results of {results_store.path}, use {default}")
+        return default
 
-        for f in tqdm(overlay_res, desc="write video"):
-            # 将处理后的帧写入视频
-            out.write(f)
+    # 采样的帧按原来的时长播放
+    steps = np.diff(frame_indices)
+    step = float(np.median(steps)) if len(steps) else 1.0
 
+    return source_fps / max(step, 1.0)
+
+
+def draw_frame(frame, image_info: dict = None, font_path: str = FONT_PATH, font_size: int = 80):
+    """the frame with the analysis result of image_info drawn on it.
+
+    Args:
+        frame (np.ndarray): BGR frame, not modified.
+        image_info (dict, optional): the results record of the frame. Defaults to None, nothing to draw.
+        font_path (str, optional): font file, None means the default font of Pillow. Defaults to FONT_PATH.
+        font_size (int, optional): font size. Defaults to 80.
+
+    Returns:
+        np.ndarray: the BGR overlay, a contiguous array.
+    """
+
+    frame_height = frame.shape[0]
+
+    _info_dict = analysis_fields(image_info) if image_info is not None else None
+    if not _info_dict:
+        return np.ascontiguousarray(frame)
+
+    source = _info_dict["source"].upper()
+    proportion = _info_dict["proportion"] * 100
+
+    line_spacing = 90  # 每行文字的垂直间距（可根据字体大小调整）
+    num_lines = 2
+
+    # FIXME: the position is err some times, need to be fixed
+    # 动态计算每一行的位置（从下往上）
+    positions = [
+        (20, frame_height - line_spacing * (num_lines - i))  # 例如：(20, 580), (20, 650)
+        for i in range(num_lines)
+    ]
+
+    return draw_text_with_font(
+        np.ascontiguousarray(frame),
+        [
+            f"TYPE: {source}",
+            f"PROPORTION: {proportion}%",
+        ],
+        positions,
+        font_path=font_path,
+        font_size=font_size,
+        font_color=(255, 255, 255),
+    )
+
+
+def render_video(
+    video: Path,
+    output_file: Path,
+    fps: float = None,
+    decoder: str = "decord",
+    frame_cache: Path = None,
+    font_path: str = FONT_PATH,
+    num_workers: int = 4,
+    reorder_size: int = 16,
+    frames: list = None,
+    progress_fn=None,
+    video_hash: str = None,
+):
+    """draw the results of one processed video and write the overlay video.
+
+    The frames are drawn by a thread pool and written as soon as they are
+    ready, in frame order, through a reorder buffer of at most reorder_size
+    frames, so the memory does not grow with the length of the video.
+
+    Args:
+        video (Path): output directory of the video, with results.jsonl and frames/.
+        output_file (Path): the overlay .mp4.
+        fps (float, optional): fps of the overlay video. Defaults to None, overlay_fps.
+        decoder (str, optional): decoding backend of the source video. Defaults to "decord".
+        frame_cache (Path, optional): root directory of the frame caches. Defaults to None.
+        font_path (str, optional): font file. Defaults to FONT_PATH.
+        num_workers (int, optional): drawing threads. Defaults to 4.
+        reorder_size (int, optional): max frames drawn or being drawn but not written yet. Defaults to 16.
+        frames (list, optional): (frame_idx, saved frame path) to render, e.g. one segment. Defaults to None, all the frames.
+        progress_fn (callable, optional): called with the number of frames written since the last call. Defaults to None.
+        video_hash (str, optional): sha256 of the source video for the frame cache. Defaults to None, hashed by FrameCache.
+
+    Returns:
+        int: number of frames written.
+    """
+
+    results_store = ResultsStore(video / "results.jsonl")
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    if frames is None:
+        frames = list_video_frames(video, results_store)
+    if fps is None:
+        fps = overlay_fps(results_store, [frame_idx for frame_idx, _ in frames], decoder)
+
+    out = None
+    num_frames = 0
+    reported = 0
+    # 按提交顺序排队的 future，队头写完才写下一帧
+    pending = deque()
+
+    def _write(overlay):
+        nonlocal out, num_frames, reported
+        if out is None:
+            # 第一帧画完才知道尺寸
+            frame_height, frame_width = overlay.shape[:2]
+            out = cv2.VideoWriter(
+                str(output_file),
+                cv2.VideoWriter_fourcc(*"mp4v"),  # 编码格式
+                fps,
+                (frame_width, frame_height),
+            )
+        out.write(overlay)
+        num_frames += 1
+
+        if progress_fn is not None and num_frames - reported >= 32:
+            progress_fn(num_frames - reported)
+            reported = num_frames
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, num_workers)) as pool:
+            for frame_idx, frame in tqdm(
+                iter_video_frames(video, results_store, decoder, frame_cache, frames, video_hash),
+                desc=f"render {video.stem}",
+                leave=False,
+                # 有 progress_fn 时由调用方显示总的进度
+                disable=progress_fn is not None,
+            ):
+                # load image info by the frame_idx
+                image_info = results_store.get(frame_idx) if frame_idx in results_store else None
+                pending.append(pool.submit(draw_frame, frame, image_info, font_path))
+
+                while len(pending) >= max(1, reorder_size):
+                    _write(pending.popleft().result())
+
+            while pending:
+                _write(pending.popleft().result())
+    finally:
+        if out is not None:
+            out.release()
+
+    if progress_fn is not None and num_frames > reported:
+        progress_fn(num_frames - reported)
+
+    logger.info(f"Video saved: {output_file}, {num_frames} frames")
+
+    return num_frames
+
+
+def stitch_videos(part_files: list, output_file: Path):
+    """concatenate the segments of one overlay video, in order.
+
+    The packets are remuxed with PyAV, without encoding again, the segments
+    are decoded and encoded again by OpenCV when PyAV is not installed.
+    """
+
+    try:
+        import av
+    except ImportError:
+        av = None
+
+    if av is None:
+        out = None
+        for part_file in part_files:
+            with open_decoder(part_file, "opencv", pixel_format="bgr") as vr:
+                if out is None:
+                    height, width = vr.size
+                    out = cv2.VideoWriter(
+                        str(output_file), cv2.VideoWriter_fourcc(*"mp4v"), vr.fps, (width, height)
+                    )
+                for _, frame in vr.iter_frames():
+                    out.write(frame)
         out.release()
+        return
+
+    # 所有分段用同样的编码参数写出，时间基相同
+    with av.open(str(part_files[0])) as first:
+        output = av.open(str(output_file), "w")
+        out_stream = output.add_stream_from_template(first.streams.video[0])
+
+    offset = 0
+    try:
+        for part_file in part_files:
+            with av.open(str(part_file)) as part:
+                end = offset
+                for packet in part.demux(part.streams.video[0]):
+                    # demux 最后的空 packet 不写
+                    if packet.dts is None:
+                        continue
+                    packet.pts += offset
+                    packet.dts += offset
+                    end = max(end, packet.pts + (packet.duration or 0))
+                    packet.stream = out_stream
+                    output.mux(packet)
+                offset = end
+    finally:
+        output.close()
+
+
+def plan_render(
+    info_path: Path, segment_frames: int = None, decoder: str = "decord", frame_cache: Path = None
+):
+    """the videos to render and their segments.
+
+    The source videos are hashed here once for the frame cache, not by every
+    segment of them.
+
+    Returns:
+        tuple: (shards of utils.sharding, start and end are positions in the frame list,
+            {video dir: frame list}, {video dir: fps}, {video dir: sha256 of the source video or None})
+    """
+
+    frames, fps, video_hashes = {}, {}, {}
+    for video in sorted(info_path.iterdir()):
+        if not (video / "results.jsonl").exists():
+            continue
+
+        results_store = ResultsStore(video / "results.jsonl")
+        frames[str(video)] = list_video_frames(video, results_store)
+        fps[str(video)] = overlay_fps(
+            results_store, [frame_idx for frame_idx, _ in frames[str(video)]], decoder
+        )
+
+        video_paths = [Path(p) for p in results_store.videos]
+        video_hashes[str(video)] = (
+            file_hash(video_paths[0])
+            if frame_cache is not None and len(video_paths) == 1 and video_paths[0].exists()
+            else None
+        )
+
+    shards = plan_shards(
+        list(frames),
+        max_frames=segment_frames,
+        frame_counts={video: len(video_frames) for video, video_frames in frames.items()},
+    )
+
+    return shards, frames, fps, video_hashes
+
+
+def _part_file(output_dir: Path, shard: dict, single: bool):
+
+    stem = Path(shard["video_path"]).stem
+    if single:
+        return output_dir / f"{stem}_text.mp4"
+    return output_dir / f"{stem}_text.part{shard['start']:09d}.mp4"
+
+
+def _render_worker(
+    worker_id, shards, reporter, frames, fps, video_hashes, output_dir, segmented, render_kwargs
+):
+    """the worker process of the parallel rendering, renders its segments one by one."""
+
+    for shard in shards:
+        video = Path(shard["video_path"])
+        render_video(
+            video,
+            _part_file(output_dir, shard, shard["video_path"] not in segmented),
+            fps=fps[shard["video_path"]],
+            frames=frames[shard["video_path"]][shard["start"] : shard["end"]],
+            progress_fn=reporter.frames,
+            video_hash=video_hashes[shard["video_path"]],
+            **render_kwargs,
+        )
+        reporter.shard_done()
+
+
+def merge_res_to_img(
+    info_path: Path,
+    output_path: Path,
+    decoder: str = "decord",
+    frame_cache: Path = None,
+    font_path: str = FONT_PATH,
+    num_workers: int = 1,
+    segment_frames: int = None,
+    draw_threads: int = 4,
+):
+    """render the overlay video of every processed video in info_path.
+
+    Args:
+        info_path (Path): output directory of the run, one sub directory per video.
+        output_path (Path): the videos are saved into output_path/video_text_vis.
+        decoder (str, optional): decoding backend of the source videos. Defaults to "decord".
+        frame_cache (Path, optional): root directory of the frame caches. Defaults to None.
+        font_path (str, optional): font file. Defaults to FONT_PATH.
+        num_workers (int, optional): rendering processes, 1 renders in this process. Defaults to 1.
+        segment_frames (int, optional): split a longer video into segments rendered in parallel and stitched afterwards. Defaults to None, one segment per video.
+        draw_threads (int, optional): drawing threads of each process. Defaults to 4.
+    """
+
+    _opt_path = output_path / "video_text_vis"
+    _opt_path.mkdir(parents=True, exist_ok=True)
+
+    shards, frames, fps, video_hashes = plan_render(info_path, segment_frames, decoder, frame_cache)
+
+    num_segments = {}
+    for shard in shards:
+        num_segments[shard["video_path"]] = num_segments.get(shard["video_path"], 0) + 1
+    segmented = {video for video, n in num_segments.items() if n > 1}
+
+    render_kwargs = {
+        "decoder": decoder,
+        "frame_cache": frame_cache,
+        "font_path": font_path,
+        "num_workers": draw_threads,
+    }
+
+    if num_workers > 1:
+        run_sharded(
+            _render_worker,
+            shards,
+            num_workers,
+            worker_args=(frames, fps, video_hashes, _opt_path, segmented, render_kwargs),
+        )
+    else:
+        with tqdm(total=sum(s["num_frames"] for s in shards), desc="render frames") as bar:
+            for shard in shards:
+                logger.info(f"Processed video: {Path(shard['video_path']).stem}")
+                render_video(
+                    Path(shard["video_path"]),
+                    _part_file(_opt_path, shard, shard["video_path"] not in segmented),
+                    fps=fps[shard["video_path"]],
+                    frames=frames[shard["video_path"]][shard["start"] : shard["end"]],
+                    progress_fn=bar.update,
+                    video_hash=video_hashes[shard["video_path"]],
+                    **render_kwargs,
+                )
+
+    # 分段渲染的视频按顺序拼接
+    for video in sorted(segmented):
+        part_files = [
+            _part_file(_opt_path, shard, False) for shard in shards if shard["video_path"] == video
+        ]
+        output_file = _opt_path / f"{Path(video).stem}_text.mp4"
+        stitch_videos(part_files, output_file)
+        for part_file in part_files:
+            part_file.unlink()
 
-        logger.info(f"Video saved: {_opt_path}/{video.stem}_text.mp4")
+        logger.info(f"Video saved: {output_file}, {len(part_files)} segments")
 
     logger.info("All done!")
 
@@ -175,4 +592,7 @@ if __name__ == "__main__":
     merge_res_to_img(
         info_path=info_path,
         output_path=output_path,
+        num_workers=os.cpu_count(),
+        # 长视频按 10000 帧分段并行渲染
+        segment_frames=10000,
     )
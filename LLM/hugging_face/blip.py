@@ -22,18 +22,25 @@ Date      	By	Comments
 ----------	---	---------------------------------------------------------
 """
 
+import torch
 from PIL import Image, ImageDraw
+from torch.utils.data import DataLoader, Dataset
 from transformers import BlipProcessor, BlipForConditionalGeneration
+from tqdm import tqdm
 
 from pathlib import Path
+import argparse
 import json
 import logging
 import time
 from typing_extensions import deprecated
 
 from utils.get_device import get_device
+from utils.results_store import read_complete_lines
 from utils.timer import timer
 
+from LLM.backend import load_image
+
 
 def load_images(image_path: Path):
     """load images from the image_path.
@@ -42,7 +49,7 @@ def load_images(image_path: Path):
         image_path (Path): path to the image.
 
     Returns:
-        list: list of image paths.
+        tuple: lists of the cold, hot and normal image paths.
     """    
     cold_imgs = []
     hot_imgs = []
@@ -62,25 +69,209 @@ def load_images(image_path: Path):
     return cold_imgs, hot_imgs, normal_imgs
 
 
+class CaptionDataset(Dataset):
+    """the images of a dataset, decoded and resized in the DataLoader workers.
+
+    Args:
+        image_paths (list): paths to the images, the label is the name of the parent directory.
+        image_processor: the BLIP image processor, resize and normalize.
+    """
+
+    def __init__(self, image_paths: list, image_processor):
+
+        self.image_paths = [Path(p) for p in image_paths]
+        self.image_processor = image_processor
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, idx: int):
+
+        image_path = self.image_paths[idx]
+        image = Image.open(image_path).convert("RGB")
+
+        return {
+            "image_path": str(image_path),
+            "label": image_path.parent.name,
+            "pixel_values": self.image_processor(
+                images=image, return_tensors="pt"
+            ).pixel_values[0],
+        }
+
+
+def collate_captions(samples: list):
+
+    return {
+        "image_path": [s["image_path"] for s in samples],
+        "label": [s["label"] for s in samples],
+        "pixel_values": torch.stack([s["pixel_values"] for s in samples]),
+    }
+
+
+def read_done_images(output_file: Path):
+    """the image paths already captioned in the JSONL file.
+
+    A half written last line, left by an interrupted run, is cut off so
+    the next records start on a new line.
+    """
+
+    done = set()
+    if not output_file.exists():
+        return done
+
+    lines, _ = read_complete_lines(output_file, truncate=True)
+
+    for _, line in lines:
+        try:
+            done.add(json.loads(line)["image_path"])
+        except (json.JSONDecodeError, KeyError):
+            continue
+
+    return done
+
+
 class ImageToText:
 
-    def __init__(self, output_path: Path, device: str):
+    def __init__(
+        self,
+        output_path: Path,
+        device: str,
+        model=None,
+        processor=None,
+        max_new_tokens: int = None,
+    ):
         super().__init__()
 
         self.device = device
-        self.load_model(device)
+        self.version = "Salesforce/blip-image-captioning-large"
+        # None 使用模型自带的 generation config
+        self.max_new_tokens = max_new_tokens
+
+        # 可以传入已经加载好的模型，例如测试用的小模型
+        if model is not None and processor is not None:
+            self.model, self.processor = model.to(device), processor
+        else:
+            self.load_model(device)
 
         self.output_path = output_path
         self.image_info = []
 
     def load_model(self, device: str):
 
-        self.processor = BlipProcessor.from_pretrained(
-            "Salesforce/blip-image-captioning-large"
+        self.processor = BlipProcessor.from_pretrained(self.version)
+        self.model = BlipForConditionalGeneration.from_pretrained(self.version).to(
+            device
         )
-        self.model = BlipForConditionalGeneration.from_pretrained(
-            "Salesforce/blip-image-captioning-large"
-        ).to(device)
+
+    @property
+    def name(self):
+        return self.version
+
+    def infer(self, images: list, prompt: str = None):
+        """VisionBackend interface, one generate for the images.
+
+        Args:
+            images (list): PIL images, RGB arrays or paths.
+            prompt (str, optional): the text used for conditional captioning, None means unconditional. Defaults to None.
+
+        Returns:
+            list: the caption of each image.
+        """
+
+        return self.decode_captions(self.encode_images(images), prompt)
+
+    def encode_images(self, images: list):
+        """load and preprocess the images, and run the vision encoder once.
+
+        Args:
+            images (list): PIL images, RGB arrays or paths.
+
+        Returns:
+            torch.Tensor: the image embeddings, (batch, patches, hidden).
+        """
+
+        pixel_values = self.processor(
+            images=[load_image(image, keep_array=True) for image in images],
+            return_tensors="pt",
+        ).pixel_values
+
+        return self.encode_pixels(pixel_values)
+
+    def encode_pixels(self, pixel_values: torch.Tensor):
+        """run the vision encoder on the preprocessed images, e.g. from the DataLoader."""
+
+        pixel_values = pixel_values.to(self.device, self.model.dtype)
+
+        with torch.inference_mode():
+            return self.model.vision_model(pixel_values=pixel_values)[0]
+
+    def decode_captions(self, image_embeds: torch.Tensor, text: str = None):
+        """generate the captions from the image embeddings, the same as model.generate without the vision encoder.
+
+        Args:
+            image_embeds (torch.Tensor): from encode_images.
+            text (str, optional): the text used for conditional captioning, None means unconditional. Defaults to None.
+
+        Returns:
+            list: the caption of each image.
+        """
+
+        batch_size = image_embeds.shape[0]
+        text_config = self.model.config.text_config
+
+        if text is None:
+            input_ids = torch.full(
+                (batch_size, 1), text_config.bos_token_id, dtype=torch.long
+            )
+            attention_mask = None
+        else:
+            # 同一个 text 的长度相同，不需要 padding；去掉最后的 [SEP]，[CLS] 换成 bos
+            tokens = self.processor.tokenizer([text] * batch_size, return_tensors="pt")
+            input_ids = tokens.input_ids[:, :-1].clone()
+            input_ids[:, 0] = text_config.bos_token_id
+            attention_mask = tokens.attention_mask[:, :-1].to(self.device)
+
+        generate_kwargs = {}
+        if self.max_new_tokens is not None:
+            generate_kwargs["max_new_tokens"] = self.max_new_tokens
+
+        with torch.inference_mode():
+            out = self.model.text_decoder.generate(
+                input_ids=input_ids.to(self.device),
+                attention_mask=attention_mask,
+                eos_token_id=text_config.sep_token_id,
+                pad_token_id=text_config.pad_token_id,
+                encoder_hidden_states=image_embeds,
+                encoder_attention_mask=torch.ones(
+                    image_embeds.shape[:-1], dtype=torch.long, device=image_embeds.device
+                ),
+                **generate_kwargs,
+            )
+
+        return self.processor.batch_decode(out, skip_special_tokens=True)
+
+    @timer
+    def caption_pair(self, images: list, text: str = "a photography of"):
+        """conditional and unconditional captions of the images, sharing one vision encoding.
+
+        Args:
+            images (list): PIL images, RGB arrays or paths.
+            text (str, optional): the text used for conditional. Defaults to "a photography of".
+
+        Returns:
+            tuple: (conditional captions, unconditional captions)
+        """
+
+        image_embeds = self.encode_images(images)
+
+        return self.decode_captions(image_embeds, text), self.decode_captions(image_embeds)
+
+    def caption_pixels(self, pixel_values: torch.Tensor, text: str = "a photography of"):
+        """the same as caption_pair, on the preprocessed images."""
+
+        image_embeds = self.encode_pixels(pixel_values)
+
+        return self.decode_captions(image_embeds, text), self.decode_captions(image_embeds)
 
     @deprecated("instead of using this method, use image2text_con and image2text_uncon")
     def image_to_text(self, image_path: Path, text: str = "a photography of"):
@@ -121,14 +312,7 @@ class ImageToText:
             str: text generated from the image.
         """        
 
-        image = Image.open(image_path).convert("RGB")
-        print(image.size)
-        # conditional image captioning
-        inputs = self.processor(image, text, return_tensors="pt").to(self.device)
-
-        con_out = self.model.generate(**inputs)
-
-        return self.processor.decode(con_out[0], skip_special_tokens=True)
+        return self.infer([image_path], text)[0]
 
     @timer
     def image2text_uncon(self, image_path: Path):
@@ -141,15 +325,7 @@ class ImageToText:
             str: text generated from the image.
         """        
 
-        image = Image.open(image_path).convert("RGB")
-        print(image.size)
-
-        # unconditional image captioning
-        inputs = self.processor(image, return_tensors="pt").to(self.device)
-
-        uncon_out = self.model.generate(**inputs)
-
-        return self.processor.decode(uncon_out[0], skip_special_tokens=True)
+        return self.infer([image_path])[0]
 
     @deprecated("not used")
     def add_text_to_image(
@@ -206,19 +382,40 @@ class ImageToText:
         with open(json_file_path, "w", encoding="utf-8") as file:
             json.dump(image_info, file, ensure_ascii=False, indent=4)
 
-    def __call__(self, image_path: Path):
+    def batch_call(self, image_paths: list, text: str = "a photography of", batch_size: int = 8):
+        """both captions of the images, batch_size images share one vision encoding pass.
 
-        # con_out, uncon_out = self.image_to_text(image_path)
-        con_out = self.image2text_con(image_path)
-        uncon_out = self.image2text_uncon(image_path)
+        Args:
+            image_paths (list): paths to the images.
+            text (str, optional): the text used for conditional. Defaults to "a photography of".
+            batch_size (int, optional): images per batch. Defaults to 8.
 
-        # package the image info
-        image_info = {
-            "image_name": image_path.stem,
-            "image_path": str(image_path),
-            "con_text": con_out,
-            "uncon_text": uncon_out,
-        }
+        Returns:
+            list: image_info dicts, in the same order as the image_paths.
+        """
+
+        res_image_info = []
+
+        for start in range(0, len(image_paths), batch_size):
+            batch = [Path(p) for p in image_paths[start : start + batch_size]]
+            con_out, uncon_out = self.caption_pair(batch, text)
+
+            # package the image info
+            res_image_info += [
+                {
+                    "image_name": image_path.stem,
+                    "image_path": str(image_path),
+                    "con_text": con,
+                    "uncon_text": uncon,
+                }
+                for image_path, con, uncon in zip(batch, con_out, uncon_out)
+            ]
+
+        return res_image_info
+
+    def __call__(self, image_path: Path):
+
+        image_info = self.batch_call([image_path])[0]
 
         self.image_info.append(image_info)
 
@@ -228,27 +425,133 @@ class ImageToText:
         )
 
 
-if __name__ == "__main__":
+def caption_dataset(
+    image_to_text: ImageToText,
+    image_paths: list,
+    output_file: Path,
+    text: str = "a photography of",
+    batch_size: int = 16,
+    num_workers: int = 2,
+):
+    """caption a dataset of images, both captions of each image are appended to a JSONL file.
 
-    device = get_device()
+    The images are decoded and resized by the DataLoader workers while the
+    model captions the previous batch. The images already in output_file are
+    skipped, so an interrupted run continues where it stopped.
+
+    Args:
+        image_to_text (ImageToText): the BLIP model.
+        image_paths (list): paths to the images.
+        output_file (Path): the .jsonl file, one image_info per line.
+        text (str, optional): the text used for conditional. Defaults to "a photography of".
+        batch_size (int, optional): images per generate. Defaults to 16.
+        num_workers (int, optional): DataLoader worker processes, 0 loads in the main process. Defaults to 2.
 
-    output_path = Path("logs/blip_result")
+    Returns:
+        dict: images, skipped, seconds and images_per_second.
+    """
+
+    output_file = Path(output_file)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    done = read_done_images(output_file)
+    todo = [p for p in image_paths if str(p) not in done]
+
+    loader = DataLoader(
+        CaptionDataset(todo, image_to_text.processor.image_processor),
+        batch_size=batch_size,
+        num_workers=num_workers,
+        collate_fn=collate_captions,
+        pin_memory=torch.device(image_to_text.device).type == "cuda",
+    )
+
+    num_images = 0
+    start_time = time.perf_counter()
+
+    with open(output_file, "a", encoding="utf-8") as f, tqdm(
+        total=len(todo), desc="images", unit="img"
+    ) as bar:
+        for batch in loader:
+
+            con_out, uncon_out = image_to_text.caption_pixels(batch["pixel_values"], text)
+
+            for image_path, label, con, uncon in zip(
+                batch["image_path"], batch["label"], con_out, uncon_out
+            ):
+                image_info = {
+                    "image_name": Path(image_path).stem,
+                    "image_path": image_path,
+                    "label": label,
+                    "con_text": con,
+                    "uncon_text": uncon,
+                }
+                f.write(json.dumps(image_info, ensure_ascii=False) + "\n")
+            f.flush()
+
+            num_images += len(con_out)
+            bar.update(len(con_out))
+            bar.set_postfix(img_per_s=f"{num_images / (time.perf_counter() - start_time):.2f}")
+
+    seconds = time.perf_counter() - start_time
+    stats = {
+        "images": num_images,
+        "skipped": len(image_paths) - len(todo),
+        "seconds": seconds,
+        "images_per_second": num_images / seconds if seconds else 0.0,
+    }
+    logging.info(f"Captioned {num_images} images in {seconds:.1f}s, {stats['images_per_second']:.2f} images/s")
+
+    return stats
+
+
+def get_parameters():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--image_path",
+        type=str,
+        default="/workspace/data/temp_dataset",
+        help="Dataset path, image path/class/img.jpg",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default="logs/blip_result",
+        help="Directory of the image_info.jsonl",
+    )
+    parser.add_argument("--text", type=str, default="a photography of")
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--num_workers", type=int, default=2)
+    parser.add_argument("--max_new_tokens", type=int, default=None)
+
+    return parser.parse_known_args()
 
-    if device.type == "cuda":
-        logging.info("Using GPU")
 
-        image_path = Path("/workspace/data/temp_dataset")
+if __name__ == "__main__":
 
-        test_images = load_images(image_path)
+    logging.basicConfig(level=logging.INFO)
 
-    elif device.type == "cpu" or device.type == "mps":
-        logging.info("Using CPU")
+    opt, _ = get_parameters()
 
-        test_images = [Path("tests/data/sample.jpg"), Path("tests/data/fire.jpg")]
+    device = get_device()
+    logging.info(f"Using {device}")
 
-    # Initialize the ImageToText class
-    image_to_text = ImageToText(output_path, device)
+    output_path = Path(opt.output_path)
 
-    for img_path in test_images:
+    # load_images 返回三个类别的列表，展开成一个图片列表
+    test_images = [
+        image for images in load_images(Path(opt.image_path)) for image in images
+    ]
 
-        image_to_text(img_path)
+    # Initialize the ImageToText class
+    image_to_text = ImageToText(output_path, device, max_new_tokens=opt.max_new_tokens)
+
+    caption_dataset(
+        image_to_text,
+        test_images,
+        output_path / "image_info.jsonl",
+        text=opt.text,
+        batch_size=opt.batch_size,
+        num_workers=opt.num_workers,
+    )
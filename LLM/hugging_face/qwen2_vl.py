@@ -23,41 +23,69 @@ Date      	By	Comments
 ----------	---	---------------------------------------------------------
 """
 
+import contextlib
+import importlib.util
 import logging
+import itertools
 import json
+import threading
+import time
 import hydra
 import omegaconf
 import torch
-import shutil
 from pathlib import Path
 from tqdm import tqdm
 
 from transformers import Qwen2VLForConditionalGeneration, AutoTokenizer, AutoProcessor
 from transformers import Qwen2_5_VLForConditionalGeneration
+from transformers import BatchFeature
 
 from utils.timer import timer
 from utils.get_device import get_device
-from utils.video_loader import split_video_and_extract_frames_decord
+from utils.video_loader import iter_video_frames_decord
+from utils.results_store import ResultsStore
+from utils.ledger import CompletionLedger, file_hash
+from utils.response_cache import ResponseCache
+from utils.scene_select import SceneChangeSelector
+from utils.structured_output import JSONTemplateConstraint
+from utils.pipeline import Pipeline, Stage
+from utils.model_registry import ModelRegistry, get_registry
+from utils.sharding import merge_results_stores, plan_shards, run_sharded
+from utils.token_budget import (
+    analysis_agreement,
+    decode_size,
+    pixel_bounds,
+    select_budget,
+    visual_tokens,
+)
+
+from LLM.backend import build_record, load_image
 
 logger = logging.getLogger(__name__)
 
+# (conversation, model version) -> chat template text, shared by all the instances
+_TEMPLATE_CACHE = {}
+
+
+def is_oom_error(error: Exception):
+    """check whether the error is an out of memory error (cuda or mps)."""
 
-def save_image_info_to_json(image_info: dict, json_file_path: Path):
+    if isinstance(error, torch.cuda.OutOfMemoryError):
+        return True
+    return isinstance(error, RuntimeError) and "out of memory" in str(error).lower()
 
-    # save_image_info = {
-    #     "video_path": str(image_info["video_path"]),
-    #     "frame_idx": int(image_info["frame_idx"]),
-    #     "second": int(image_info["second"]),
-    #     "ms": int(image_info["ms"]),
-    #     "conversation": image_info["conversation"],
-    #     "output_text": image_info["output_text"],
-    # }
 
-    if json_file_path.parent.exists() is False:
-        json_file_path.parent.mkdir(parents=True, exist_ok=True)
+def iter_batches(iterable, batch_size: int):
+    """group the items of the iterable into lists of batch_size."""
 
-    with open(json_file_path, "w") as f:
-        json.dump(image_info, f, indent=4)
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
 class Qwen2VL:
@@ -67,16 +95,151 @@ class Qwen2VL:
         prompt: dict,
         version: str = "Qwen/Qwen2.5-VL-7B-Instruct",
         cache_dir: str = "",
+        batch_size: int = 1,
+        max_new_tokens: int = 2048,
+        model=None,
+        processor=None,
+        results_store: ResultsStore = None,
+        response_cache: ResponseCache = None,
+        structured: bool = False,
+        lazy: bool = False,
+        registry: ModelRegistry = None,
+        min_pixels: int = 256 * 28 * 28,
+        max_pixels: int = 1280 * 28 * 28,
     ):
 
         self.device_name = get_device()
-        self.output_path = Path(output_path)
         self.prompt = prompt
+        self.version = version
+        self.cache_dir = cache_dir
+
+        # (chat template text, image grid) -> token ids of one sample
+        self._token_cache = {}
+        self._token_lock = threading.Lock()
+
+        # 所有帧的结果追加到同一个 results.jsonl
+        self.bind(output_path, results_store)
+
+        # 相同或近似的帧直接复用缓存的回答
+        self.response_cache = response_cache
+
+        # batch_call 的批大小，OOM 时会自动减半
+        self.batch_size = max(1, batch_size)
+        self.max_new_tokens = max_new_tokens
+
+        # 只允许生成 {source, proportion, location}，在右括号处结束
+        self.structured = structured
+        self._constraint = None
+
+        # 视觉 token 预算，和 vllm 版一样默认 256 ~ 1280 个 token，None 使用 processor 自带的上下限
+        self.set_pixel_bounds(min_pixels, max_pixels)
+
+        # processor 不放进 registry，空闲回收只卸载模型，
+        # frame_size / preprocess 在线程里用 processor 时不会把模型重新加载回来
+        self._processor = None
+        self._processor_lock = threading.Lock()
+
+        # 可以传入已经加载好的模型（例如测试用的小模型），
+        # 否则从 registry 里取，同一个进程里只加载一次
+        if model is not None and processor is not None:
+            self._registry = None
+            self._model = model
+            self._processor = self._prepare_processor(processor)
+        else:
+            self._registry = registry if registry is not None else get_registry()
+            self._model_key = ("qwen2_vl", version, cache_dir, self.device_name)
+            if not lazy:
+                self._get_model()
+                self.processor
+
+    @property
+    def cache_key(self):
+        """the response cache key, the prompt and every setting that changes the answers."""
+
+        return {
+            "version": self.version,
+            "prompt": self.prompt,
+            "structured": self.structured,
+            "max_new_tokens": self.max_new_tokens,
+            "min_pixels": self.min_pixels,
+            "max_pixels": self.max_pixels,
+        }
+
+    def bind(self, output_path, results_store: ResultsStore = None):
+        """rebind the output path and the results store, e.g. for the next video."""
 
-        self.model, self.processor = self.load_model(
-            version, self.device_name, cache_dir
+        self.output_path = Path(output_path)
+        self.results_store = (
+            results_store
+            if results_store is not None
+            else ResultsStore(self.output_path / "results.jsonl")
         )
 
+    def set_pixel_bounds(self, min_pixels: int = None, max_pixels: int = None):
+        """the [min_pixels, max_pixels] the frames are resized into, one visual token per 28x28 pixels."""
+
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+
+        self._size_kwargs = {}
+        if min_pixels is not None and max_pixels is not None:
+            self._size_kwargs["size"] = {"shortest_edge": min_pixels, "longest_edge": max_pixels}
+
+    def frame_size(self, height: int, width: int):
+        """(height, width) a frame is resized to by the processor, the frames can be decoded at this size."""
+
+        if self._size_kwargs:
+            size = self._size_kwargs["size"]
+        else:
+            size = self.processor.image_processor.size
+
+        return decode_size(height, width, size["shortest_edge"], size["longest_edge"])
+
+    @staticmethod
+    def _prepare_processor(processor):
+
+        # 批量生成时 decoder-only 模型需要左侧 padding
+        processor.tokenizer.padding_side = "left"
+
+        return processor
+
+    def _load(self):
+        return self.load_model(self.version, self.device_name, self.cache_dir)
+
+    def _get_model(self):
+
+        if self._registry is None:
+            return self._model
+
+        return self._registry.get(self._model_key, self._load)
+
+    @contextlib.contextmanager
+    def lease(self):
+        """hold the loaded model, the registry does not evict it as idle meanwhile."""
+
+        if self._registry is None:
+            yield self._model
+            return
+
+        with self._registry.lease(self._model_key, self._load) as model:
+            yield model
+
+    @property
+    def model(self):
+        return self._get_model()
+
+    @property
+    def processor(self):
+
+        if self._processor is None:
+            with self._processor_lock:
+                if self._processor is None:
+                    self._processor = self._prepare_processor(
+                        self.load_processor(self.version)
+                    )
+
+        return self._processor
+
     @staticmethod
     def load_model(version: str, device_name: str, cache_dir: str = ""):
 
@@ -85,53 +248,149 @@ class Qwen2VL:
             Path(cache_dir).mkdir(parents=True, exist_ok=True)
 
         if "Qwen2.5" in version:
-            model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
-                version, torch_dtype="auto", cache_dir=cache_dir
-            ).to(device_name)
+            model_class = Qwen2_5_VLForConditionalGeneration
         elif "Qwen2" in version:
-            model = Qwen2VLForConditionalGeneration.from_pretrained(
-                version, torch_dtype="auto", cache_dir=cache_dir
-            ).to(device_name)
+            model_class = Qwen2VLForConditionalGeneration
         else:
             raise ValueError(
                 f"Unsupported model version: {version}. Please use Qwen2 or Qwen2.5."
             )
 
-        min_pixels = 256 * 28 * 28
-        max_pexels = 1280 * 28 * 28
+        # safetensors 的权重是 mmap 读入的
+        load_kwargs = dict(torch_dtype="auto", cache_dir=cache_dir, use_safetensors=True)
 
-        processor = AutoProcessor.from_pretrained(
-            version,
-            min_pixels=min_pixels,
-            max_pixels=max_pexels,
-        )
+        if importlib.util.find_spec("accelerate") is not None:
+            # 不先在 CPU 上初始化一份随机权重，直接加载到目标设备
+            load_kwargs.update(low_cpu_mem_usage=True, device_map=device_name)
+            model = model_class.from_pretrained(version, **load_kwargs)
+        else:
+            model = model_class.from_pretrained(version, **load_kwargs).to(device_name)
 
-        return model, processor
+        return model
+
+    @staticmethod
+    def load_processor(version: str):
+
+        # 图片的分辨率上下限由 set_pixel_bounds 在每次 preprocess 时传入
+        return AutoProcessor.from_pretrained(version)
 
     def get_conversation(self, role: str, content: dict):
         conversation = [{"role": role, "content": content}]
         return conversation
 
-    def preprocess(self, converstaion, image, device_name):
-        # Preprocess the inputs
-        text_prompt = self.processor.apply_chat_template(
-            converstaion, add_generation_prompt=True
-        )
+    def build_conversation(self, prompt=None):
+
+        prompt = self.prompt if prompt is None else prompt
+
+        if isinstance(prompt, str):
+            conversation = [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image",
+                        },
+                        {"type": "text", "text": prompt},
+                    ],
+                }
+            ]
+        else:
+            # TODO: 这里的逻辑还可以修改一下
+            conversation = self.get_conversation("user", prompt)
+
+        return conversation
+
+    def get_text_prompt(self, converstaion):
+        """apply the chat template once per (conversation, model version)."""
+
+        key = (json.dumps(converstaion, sort_keys=True, ensure_ascii=False), self.version)
+
+        if key not in _TEMPLATE_CACHE:
+            _TEMPLATE_CACHE[key] = self.processor.apply_chat_template(
+                converstaion, add_generation_prompt=True
+            )
         # Excepted output: '<|im_start|>system\nYou are a helpful assistant.<|im_end|>\n<|im_start|>user\n<|vision_start|><|image_pad|><|vision_end|>Describe this image.<|im_end|>\n<|im_start|>assistant\n'
 
-        inputs = self.processor(
-            text=[text_prompt], images=[image], padding=True, return_tensors="pt"
+        return _TEMPLATE_CACHE[key]
+
+    def _pad_left(self, text_inputs: list):
+        """left pad the cached token ids of each sample into one batch."""
+
+        max_len = max(len(t["input_ids"]) for t in text_inputs)
+        pad_token_id = self.processor.tokenizer.pad_token_id
+
+        batch = {}
+        for key in text_inputs[0]:
+            pad_value = pad_token_id if key == "input_ids" else 0
+            batch[key] = torch.stack(
+                [
+                    torch.nn.functional.pad(t[key], (max_len - len(t[key]), 0), value=pad_value)
+                    for t in text_inputs
+                ]
+            )
+
+        return batch
+
+    def preprocess(self, converstaion, images, device_name):
+        # Preprocess the inputs
+        text_prompt = self.get_text_prompt(converstaion)
+
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+
+        image_inputs = self.processor.image_processor(
+            images=list(images), return_tensors="pt", **self._size_kwargs
         )
+
+        # token ids 只由 prompt 和图片的 grid 决定，同一视频的帧分辨率相同，
+        # 所以只在第一次遇到某个 grid 时调用完整的 processor 做分词
+        text_inputs = []
+        for image, grid in zip(images, image_inputs["image_grid_thw"]):
+            key = (text_prompt, tuple(grid.tolist()))
+
+            # 流水线里可能有多个 preprocess 线程
+            with self._token_lock:
+                if key not in self._token_cache:
+                    encoded = self.processor(
+                        text=[text_prompt],
+                        images=[image],
+                        return_tensors="pt",
+                        **self._size_kwargs,
+                    )
+                    self._token_cache[key] = {
+                        k: v[0] for k, v in encoded.items() if k not in image_inputs
+                    }
+
+            text_inputs.append(self._token_cache[key])
+
+        inputs = BatchFeature({**self._pad_left(text_inputs), **image_inputs})
         inputs = inputs.to(device_name)
 
         return inputs
 
+    @property
+    def constraint(self):
+
+        if self._constraint is None:
+            self._constraint = JSONTemplateConstraint(self.processor.tokenizer)
+
+        return self._constraint
+
     @timer
     def generate(self, inputs):
 
+        generate_kwargs = {}
+        if self.structured:
+            # 左侧 padding 之后所有样本的 prompt 长度相同
+            generate_kwargs["prefix_allowed_tokens_fn"] = (
+                self.constraint.prefix_allowed_tokens_fn(inputs.input_ids.shape[1])
+            )
+
         with torch.inference_mode():
             # Inference: Generation of the output
-            output_ids = self.model.generate(**inputs, max_new_tokens=2048)
+            output_ids = self.model.generate(
+                **inputs, max_new_tokens=self.max_new_tokens, **generate_kwargs
+            )
             generated_ids = [
                 output_ids[len(input_ids) :]
                 for input_ids, output_ids in zip(inputs.input_ids, output_ids)
@@ -145,105 +404,680 @@ class Qwen2VL:
 
         return output_text
 
+    def _generate_batch(self, conversation, frame_infos: list, inputs=None):
+        """run one padded processor call and one generate call for the frames.
+
+        The batch is split in half and retried when it runs out of memory,
+        and the smaller batch size is kept for the following calls.
+        The inputs already preprocessed on the cpu can be passed in.
+        """
+
+        try:
+            if inputs is None:
+                inputs = self.preprocess(
+                    conversation,
+                    [frame_info["image"] for frame_info in frame_infos],
+                    self.device_name,
+                )
+            else:
+                inputs = inputs.to(self.device_name)
+            return self.generate(inputs)
+
+        except Exception as e:
+            if not is_oom_error(e) or len(frame_infos) == 1:
+                raise
+
+            self.batch_size = max(1, min(self.batch_size, len(frame_infos) // 2))
+            logger.warning(f"Out of memory, shrink the batch size to {self.batch_size}")
+
+            del e
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+            return self._generate_frames(conversation, frame_infos)
+
+    def _generate_frames(self, conversation, frame_infos: list):
+        """generate the frames in batches of the current batch_size.
+
+        batch_size is read again before each slice, so when an earlier batch
+        shrinks it on OOM, the rest of the frames run at the smaller size.
+        """
+
+        output_text = []
+        start = 0
+        while start < len(frame_infos):
+            sub_batch = frame_infos[start : start + self.batch_size]
+            output_text += self._generate_batch(conversation, sub_batch)
+            start += len(sub_batch)
+
+        return output_text
+
+    def prepare(self, frame_infos: list, prompt=None):
+        """cpu side of the inference, the response cache lookup and the preprocessing.
+
+        Args:
+            frame_infos (list): frame_info dicts, at most batch_size of them.
+            prompt (optional): the prompt of this call. Defaults to None, self.prompt.
+
+        Returns:
+            dict: the state passed to run_prepared and build_records.
+        """
+
+        conversation = self.build_conversation(prompt)
+        cache_key = self.cache_key
+        if prompt is not None:
+            cache_key = {**cache_key, "prompt": prompt}
+
+        lookup = None
+        missed = frame_infos
+        if self.response_cache is not None:
+            lookup = self.response_cache.lookup(
+                frame_infos,
+                cache_key,
+                image_fn=lambda frame_info: frame_info["image"],
+            )
+            missed = [frame_infos[i] for i in lookup["pending"]]
+
+        inputs = None
+        if missed and len(missed) <= self.batch_size:
+            inputs = self.preprocess(
+                conversation, [frame_info["image"] for frame_info in missed], "cpu"
+            )
+
+        return {
+            "frame_infos": frame_infos,
+            "conversation": conversation,
+            "lookup": lookup,
+            "missed": missed,
+            "inputs": inputs,
+        }
+
+    def run_prepared(self, prepared: dict):
+        """model side of the inference, generate the frames missed by the cache.
+
+        Returns:
+            list: output text of each frame in prepared["frame_infos"].
+        """
+
+        conversation, missed = prepared["conversation"], prepared["missed"]
+
+        # 生成期间持有模型，空闲回收不会把它卸载
+        with self.lease():
+            # OOM 之后 batch_size 可能变小了，按新的大小重新切分
+            if prepared["inputs"] is not None and len(missed) <= self.batch_size:
+                output_texts = self._generate_batch(conversation, missed, prepared["inputs"])
+            else:
+                output_texts = self._generate_frames(conversation, missed)
+
+        if prepared["lookup"] is not None:
+            output_texts = self.response_cache.complete(prepared["lookup"], output_texts)
+
+        return output_texts
+
+    def build_records(self, frame_infos: list, output_texts: list, conversation):
+        """package the image info of each frame."""
+
+        return [
+            build_record(frame_info, output_text, conversation=conversation)
+            for frame_info, output_text in zip(frame_infos, output_texts)
+        ]
+
+    @property
+    def name(self):
+        return self.version
+
+    def infer(self, images: list, prompt: str = None):
+        """VisionBackend interface, one padded generate for the images.
+
+        Args:
+            images (list): PIL images, RGB arrays or paths.
+            prompt (str, optional): the prompt of this call. Defaults to None, self.prompt.
+
+        Returns:
+            list: output text of each image.
+        """
+
+        return self.run_prepared(
+            self.prepare(
+                [{"image": load_image(i, keep_array=True)} for i in images], prompt
+            )
+        )
+
+    def batch_call(self, frame_infos: list):
+        """run the inference on several frames with batched generation.
+
+        Args:
+            frame_infos (list): frame_info dicts from the video loader.
+
+        Returns:
+            list: image_info dicts, in the same order as the frame_infos.
+        """
+
+        res_image_info = []
+
+        for batch in iter_batches(frame_infos, self.batch_size):
+
+            logger.info(
+                f"Processing frames {[f['frame_idx'] for f in batch]} at {batch[0]['video_path']}"
+            )
+
+            prepared = self.prepare(batch)
+            records = self.build_records(
+                batch, self.run_prepared(prepared), prepared["conversation"]
+            )
+
+            self.results_store.extend(records)
+            res_image_info += records
+
+        return res_image_info
+
     def __call__(self, frame_info: dict):
 
-        video_path = frame_info["video_path"]
-        frame_idx = frame_info["frame_idx"]
-        current_ms = frame_info["current_ms"]
-        second = frame_info["second"]
-        image = frame_info["image"]
+        return self.batch_call([frame_info])[0]
+
+
+def run_video_pipeline(
+    image_to_text,
+    frame_groups,
+    ledger: CompletionLedger,
+    video_hash: str,
+    selector: SceneChangeSelector = None,
+    preprocess_workers: int = 1,
+    queue_size: int = 4,
+    on_progress=None,
+):
+    """run the frame groups of one video through preprocess -> generate -> persist.
+
+    The frame groups are decoded in the background, each stage runs in its
+    own threads, so the model does not wait for the decoding, the processor
+    or the disk.
+
+    Args:
+        image_to_text (Qwen2VL): the model, with prepare, run_prepared and build_records.
+        frame_groups (iterable): (frame_infos, selected flags) of each group.
+        ledger (CompletionLedger): the finished frames are marked after they are persisted.
+        video_hash (str): content hash of the video.
+        selector (SceneChangeSelector, optional): fill the records of the frames not selected. Defaults to None.
+        preprocess_workers (int, optional): number of preprocess threads. Defaults to 1.
+        queue_size (int, optional): max groups waiting between two stages. Defaults to 4.
+        on_progress (callable, optional): called with the number of frames of each persisted group. Defaults to None.
+
+    Returns:
+        int: number of frames persisted.
+    """
+
+    results_store = image_to_text.results_store
+
+    def preprocess(group):
+        frame_batch, flags = group
+        selected = [f for f, flag in zip(frame_batch, flags) if flag]
+        return frame_batch, flags, image_to_text.prepare(selected)
+
+    def generate(item):
+        frame_batch, flags, prepared = item
+        return frame_batch, flags, prepared, image_to_text.run_prepared(prepared)
+
+    def persist(item):
+        frame_batch, flags, prepared, output_texts = item
+
+        records = image_to_text.build_records(
+            prepared["frame_infos"], output_texts, prepared["conversation"]
+        )
+        results_store.extend(records)
+
+        if selector is not None:
+            results_store.extend(selector.fill(frame_batch, flags, records))
+
+        # 结果落盘之后再记到 ledger 里
+        results_store.flush()
+        ledger.mark_frames(video_hash, [f["frame_idx"] for f in frame_batch])
+
+        return len(frame_batch)
+
+    pipeline = Pipeline(
+        [
+            Stage("preprocess", preprocess, workers=preprocess_workers),
+            # 只有一个模型，generate 和 persist 都是单线程
+            Stage("generate", generate),
+            Stage("persist", persist),
+        ],
+        queue_size=queue_size,
+    )
+
+    num_frames = 0
+    for n in tqdm(pipeline.run(frame_groups), desc="Processing frames"):
+        num_frames += n
+        if on_progress is not None:
+            on_progress(n)
+
+    return num_frames
+
+
+def build_response_cache(cfg: omegaconf.DictConfig):
+
+    if not cfg.cache.enable:
+        return None
+
+    return ResponseCache(
+        max_size=cfg.cache.max_size,
+        threshold=cfg.cache.threshold,
+        path=cfg.cache.path,
+    )
+
+
+def build_model(
+    cfg: omegaconf.DictConfig,
+    output_path: Path,
+    response_cache: ResponseCache = None,
+    model=None,
+    processor=None,
+):
+    """the Qwen2VL of the config, the weights are loaded once per process."""
+
+    min_pixels, max_pixels = budget_pixel_bounds(cfg)
+
+    return Qwen2VL(
+        output_path=output_path,
+        prompt=cfg.prompt_en,
+        version=cfg.version.model,
+        cache_dir=cfg.cache_path,
+        batch_size=cfg.infer.batch_size,
+        max_new_tokens=cfg.infer.max_new_tokens,
+        model=model,
+        processor=processor,
+        response_cache=response_cache,
+        structured=cfg.infer.structured,
+        lazy=cfg.model.lazy,
+        registry=get_registry(cfg.model.idle_timeout),
+        min_pixels=min_pixels,
+        max_pixels=max_pixels,
+    )
+
+
+def budget_pixel_bounds(cfg: omegaconf.DictConfig, max_visual_tokens: int = None):
+    """(min_pixels, max_pixels) of cfg.model under the visual token budget."""
+
+    if max_visual_tokens is None:
+        max_visual_tokens = cfg.budget.max_visual_tokens
+
+    return pixel_bounds(cfg.model.min_pixels, cfg.model.max_pixels, max_visual_tokens)
+
+
+def measure_budget(
+    image_to_text: Qwen2VL,
+    clip_path: Path,
+    cfg: omegaconf.DictConfig,
+    max_visual_tokens: int,
+    num_frames: int,
+):
+    """run the first num_frames sampled frames of the clip under the token budget.
+
+    The response cache is not used, every frame is generated.
+
+    Returns:
+        dict: max_visual_tokens, visual_tokens, height, width, frames, seconds, seconds_per_frame and outputs.
+    """
+
+    min_pixels, max_pixels = budget_pixel_bounds(cfg, max_visual_tokens)
+    image_to_text.set_pixel_bounds(min_pixels, max_pixels)
+
+    # 记下原视频的尺寸，visual_tokens 按 processor 的缩放规则从它算
+    source_size = []
+
+    def size_fn(height, width):
+        source_size[:] = [height, width]
+        return image_to_text.frame_size(height, width)
+
+    frames = list(
+        itertools.islice(
+            iter_video_frames_decord(
+                clip_path,
+                fps=cfg.video.fps,
+                stride=cfg.video.stride,
+                size_fn=size_fn,
+                decoder=cfg.video.decoder,
+                num_threads=cfg.video.decode_threads,
+            ),
+            num_frames,
+        )
+    )
+    images = [frame_info["image"] for frame_info in frames]
+
+    response_cache, image_to_text.response_cache = image_to_text.response_cache, None
+    try:
+        # 预热一次，不计入时间
+        image_to_text.infer(images[:1])
+
+        start = time.perf_counter()
+        outputs = []
+        for batch in iter_batches(images, image_to_text.batch_size):
+            outputs += image_to_text.infer(batch)
+        seconds = time.perf_counter() - start
+    finally:
+        image_to_text.response_cache = response_cache
+
+    height, width = images[0].shape[:2]
+
+    return {
+        "max_visual_tokens": max_visual_tokens,
+        "visual_tokens": visual_tokens(*source_size, min_pixels, max_pixels),
+        "height": height,
+        "width": width,
+        "frames": len(images),
+        "seconds": seconds,
+        "seconds_per_frame": seconds / len(images),
+        "outputs": outputs,
+    }
+
+
+def budget_clip(cfg: omegaconf.DictConfig):
+    """the fixed clip of the budget selection and the benchmark."""
+
+    if cfg.budget.clip is not None:
+        return Path(cfg.budget.clip)
+
+    return sorted(Path(cfg.video_path).iterdir())[0]
+
+
+def select_token_budget(image_to_text: Qwen2VL, cfg: omegaconf.DictConfig):
+    """pick the largest budget of cfg.budget.candidates that meets the target latency or throughput.
+
+    Returns:
+        int: the selected max_visual_tokens, also set on image_to_text.
+    """
+
+    clip_path = budget_clip(cfg)
+
+    selected, _ = select_budget(
+        lambda tokens: measure_budget(
+            image_to_text, clip_path, cfg, tokens, cfg.budget.probe_frames
+        )["seconds_per_frame"],
+        list(cfg.budget.candidates),
+        target_seconds=cfg.budget.target_seconds,
+        target_fps=cfg.budget.target_fps,
+    )
+    image_to_text.set_pixel_bounds(*budget_pixel_bounds(cfg, selected))
+
+    return selected
+
+
+def run_budget_benchmark(image_to_text: Qwen2VL, cfg: omegaconf.DictConfig):
+    """accuracy vs visual tokens vs seconds of each candidate budget on the same clip.
+
+    The accuracy is the agreement with the answers of the largest budget.
+    The table is written to output_path/budget_benchmark.json.
+
+    Returns:
+        list: one row per budget, from the smallest.
+    """
+
+    clip_path = budget_clip(cfg)
+    candidates = sorted(cfg.budget.candidates)
+
+    runs = [
+        measure_budget(image_to_text, clip_path, cfg, tokens, cfg.budget.probe_frames)
+        for tokens in candidates
+    ]
+    reference = runs[-1]["outputs"]
+
+    rows = []
+    for run in runs:
+        row = {k: v for k, v in run.items() if k != "outputs"}
+        row.update(analysis_agreement(run["outputs"], reference))
+        rows.append(row)
 
         logger.info(
-            f"Processing frame {frame_idx} at {video_path} - second: {second}, ms: {current_ms}"
+            f"{row['max_visual_tokens']} tokens budget ({row['visual_tokens']} used, "
+            f"{row['width']}x{row['height']}): {row['seconds_per_frame']:.3f}s per frame, "
+            f"source accuracy {row['source_accuracy']:.2f}, proportion MAE {row['proportion_mae']:.3f}"
         )
 
-        if isinstance(self.prompt, str):
-            conversation = [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                        },
-                        {"type": "text", "text": self.prompt},
-                    ],
-                }
-            ]
-        else:
-            # TODO: 这里的逻辑还可以修改一下
-            conversation = self.get_conversation("user", self.prompt)
+    output_file = Path(cfg.output_path) / "budget_benchmark.json"
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump({"clip": str(clip_path), "rows": rows}, f, ensure_ascii=False, indent=4)
 
-        inputs = self.preprocess(conversation, image, self.device_name)
+    logger.info(f"Budget benchmark saved to {output_file}")
 
-        # package the image info
-        image_info = {
-            "video_path": str(video_path),
-            "frame_idx": int(frame_idx),
-            "second": int(second),
-            "ms": int(current_ms),
-            "conversation": conversation,
-            "output_text": self.generate(inputs),
-        }
+    return rows
+
+
+def process_video(
+    image_to_text: Qwen2VL,
+    pth: Path,
+    cfg: omegaconf.DictConfig,
+    ledger: CompletionLedger,
+    frame_range: tuple = None,
+    on_progress=None,
+):
+    """run the inference on the frames of one video (or one frame range of it).
+
+    The results go to image_to_text.results_store, which is closed at the end.
+
+    Returns:
+        int: number of frames persisted.
+    """
+
+    _output_path = image_to_text.output_path
+
+    video_hash = file_hash(pth)
+    done_frames = ledger.done_frames(video_hash)
+    if done_frames:
+        logger.info(f"Resume video {pth.stem}, {len(done_frames)} frames already done")
+
+    # 边解码边推理，内存中只保留预取队列里的帧
+    frame_stream = iter_video_frames_decord(
+        pth,
+        _output_path / "frames" if cfg.video.save_frames else None,
+        fps=cfg.video.fps,
+        stride=cfg.video.stride,
+        frame_format=cfg.video.frame_format,
+        quality=cfg.video.quality,
+        skip_indices=done_frames,
+        frame_range=frame_range,
+        # 直接按模型的分辨率解码，processor 不再缩放
+        size_fn=image_to_text.frame_size if cfg.budget.decode_resize else None,
+        decoder=cfg.video.decoder,
+        num_threads=cfg.video.decode_threads,
+        frame_cache=cfg.video.frame_cache,
+    )
 
-        # logger.info(f"Saving image info to JSON at {_output_path / 'image_info.json'}")
-        save_image_info_to_json(
-            image_info,
-            self.output_path
-            / f"frame_{frame_idx}_second_{second}_ms_{current_ms}.json",
+    if cfg.scene.enable:
+        # 只对画面变化的帧做推理，其余的帧沿用上一次的结果
+        selector = SceneChangeSelector(
+            threshold=cfg.scene.threshold, keep_alive=cfg.scene.keep_alive
+        )
+        frame_groups = selector.iter_batches(frame_stream, cfg.infer.batch_size)
+    else:
+        selector = None
+        frame_groups = (
+            (batch, [True] * len(batch))
+            for batch in iter_batches(frame_stream, cfg.infer.batch_size)
         )
 
-        return image_info
+    num_frames = run_video_pipeline(
+        image_to_text,
+        frame_groups,
+        ledger,
+        video_hash,
+        selector=selector,
+        preprocess_workers=cfg.pipeline.preprocess_workers,
+        queue_size=cfg.pipeline.queue_size,
+        on_progress=on_progress,
+    )
 
+    if selector is not None:
+        logger.info(
+            f"Scene change: {selector.selected_count} of {selector.total_count} frames selected"
+        )
 
-@hydra.main(config_path="../../configs", config_name="qwen2")
-def load_config(cfg: omegaconf.DictConfig):
+    image_to_text.results_store.close()
+    logger.info(f"Results saved to {image_to_text.results_store.path}")
+
+    return num_frames
+
+
+def run_shard_worker(worker_id: int, shards: list, progress, cfg: dict, model=None, processor=None):
+    """the worker process of the sharded run, with its own model, ledger and results stores.
 
+    Args:
+        worker_id (int): index of the worker.
+        shards (list): the shards of this worker.
+        progress (ProgressReporter): reports the frames and the finished shards.
+        cfg (dict): the resolved config.
+        model (optional): a loaded model, e.g. a tiny test model. Defaults to None.
+        processor (optional): the processor of the model. Defaults to None.
+
+    Returns:
+        list: paths of the results stores written by this worker.
+    """
+
+    cfg = omegaconf.OmegaConf.create(cfg)
     output_path = Path(cfg.output_path)
-    video_path = Path(cfg.video_path)
-    assets_path = Path(cfg.assets_path)
 
-    for pth in tqdm(video_path.iterdir(), desc="video file"):
+    # 分配是确定的，重跑时同一个 worker 拿到同样的 shard，用自己的 ledger 续跑
+    ledger = CompletionLedger(
+        output_path / f"ledger.worker{worker_id}.jsonl", cfg.version.model, cfg.prompt_en
+    )
+
+    # 每个进程有自己的缓存，不写回 cache.path，避免多个进程同时写一个文件
+    image_to_text = build_model(
+        cfg, output_path, build_response_cache(cfg), model=model, processor=processor
+    )
 
-        res_imgae_info = []
+    store_paths = []
+    for shard in shards:
 
+        pth = Path(shard["video_path"])
         _output_path = output_path / pth.stem
 
-        total_frame_list = split_video_and_extract_frames_decord(
-            pth, _output_path / "frames"
+        image_to_text.bind(
+            _output_path,
+            ResultsStore(_output_path / f"results.worker{worker_id}.jsonl"),
         )
-
-        image_to_text = Qwen2VL(
-            output_path=_output_path / "image_info",
-            prompt=cfg.prompt_en,
-            version=cfg.version.model,
-            cache_dir=cfg.cache_path,
+        process_video(
+            image_to_text,
+            pth,
+            cfg,
+            ledger,
+            frame_range=(shard["start"], shard["end"]),
+            on_progress=progress.frames,
         )
+        progress.shard_done()
+
+        if str(image_to_text.results_store.path) not in store_paths:
+            store_paths.append(str(image_to_text.results_store.path))
 
-        for frame_info in tqdm(total_frame_list, desc="Processing frames"):
+    return store_paths
 
-            _img_info = image_to_text(frame_info=frame_info)
-            res_imgae_info.append(_img_info)
 
-        # Save the results to a JSON file
-        logger.info(f"Results saved to {_output_path / f'{_output_path.stem}.json'}")
+def run_sharded_videos(cfg: omegaconf.DictConfig, model=None, processor=None):
+    """shard the videos over cfg.shard.num_workers processes and merge their results.
 
-        save_image_info_to_json(
-            res_imgae_info,
-            _output_path / f"{_output_path.stem}.json",
+    Returns:
+        list: paths of the merged results.jsonl of each video.
+    """
+
+    output_path = Path(cfg.output_path)
+    assets_path = Path(cfg.assets_path)
+    videos = sorted(Path(cfg.video_path).iterdir())
+
+    shards = plan_shards(videos, max_frames=cfg.shard.max_frames)
+    logger.info(f"{len(videos)} videos, {len(shards)} shards, {cfg.shard.num_workers} workers")
+
+    worker_stores = run_sharded(
+        run_shard_worker,
+        shards,
+        cfg.shard.num_workers,
+        worker_args=(
+            omegaconf.OmegaConf.to_container(cfg, resolve=True),
+            model,
+            processor,
+        ),
+        devices=cfg.shard.devices,
+    )
+
+    merged_paths = []
+    for pth in videos:
+
+        _output_path = output_path / pth.stem
+        parts = sorted(
+            p for paths in worker_stores for p in paths if Path(p).parent == _output_path
         )
 
-        # copy the video file to the assets path 
-        if not (_output_path).exists():
-            _output_path.mkdir(parents=True, exist_ok=True)
-        
-        shutil.copy(_output_path / f"{_output_path.stem}.json", f"{assets_path / _output_path.stem}.json")
+        merged = merge_results_stores(parts, _output_path / "results.jsonl")
+        merged.export_gui_json(assets_path / f"{pth.stem}.json")
+        merged_paths.append(merged.path)
+
+        logger.info(f"Merged {len(parts)} worker results of {pth.stem}")
+
+    return merged_paths
+
+
+@hydra.main(config_path="../../configs", config_name="qwen2")
+def load_config(cfg: omegaconf.DictConfig):
+
+    if cfg.budget.benchmark:
+        run_budget_benchmark(build_model(cfg, Path(cfg.output_path)), cfg)
+        return
+
+    image_to_text = None
+    if cfg.budget.target_seconds is not None or cfg.budget.target_fps is not None:
+        # 选好的预算写回 cfg，分片的 worker 进程也用同一个预算
+        image_to_text = build_model(cfg, Path(cfg.output_path))
+        cfg.budget.max_visual_tokens = select_token_budget(image_to_text, cfg)
+
+    if cfg.shard.num_workers > 1:
+        # worker 进程各自加载模型，这里的先释放
+        if image_to_text is not None and image_to_text._registry is not None:
+            image_to_text._registry.clear()
+        image_to_text = None
+
+        run_sharded_videos(cfg)
+        logger.info("All done!")
+        return
+
+    output_path = Path(cfg.output_path)
+    video_path = Path(cfg.video_path)
+    assets_path = Path(cfg.assets_path)
+
+    # 重跑时把 output_path 设为上次的输出目录，已完成的视频和帧会被跳过
+    ledger = CompletionLedger(
+        output_path / "ledger.jsonl", cfg.version.model, cfg.prompt_en
+    )
+
+    response_cache = build_response_cache(cfg)
+
+    # 模型在整个进程里只加载一次，每个视频只换输出路径
+    if image_to_text is None:
+        image_to_text = build_model(cfg, output_path, response_cache)
+    else:
+        image_to_text.response_cache = response_cache
+
+    for pth in tqdm(video_path.iterdir(), desc="video file"):
+
+        _output_path = output_path / pth.stem
+
+        video_hash = file_hash(pth)
+        if ledger.is_video_done(video_hash):
+            logger.info(f"Skip finished video: {pth.stem}")
+            continue
+
+        image_to_text.bind(_output_path)
+        process_video(image_to_text, pth, cfg, ledger)
+
+        # export the GUI layout into the assets path
+        image_to_text.results_store.export_gui_json(
+            assets_path / f"{_output_path.stem}.json"
+        )
+        ledger.mark_video(video_hash)
 
         logger.info(f"Processed video: {pth.stem}")
 
-        # Clean up        
-        del image_to_text
-        del res_imgae_info
-        torch.cuda.empty_cache()
+    if response_cache is not None:
+        logger.info(f"Response cache: {response_cache.stats}")
+        if response_cache.path is not None:
+            response_cache.save()
 
     logger.info("All done!")
 
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+File: /workspace/temp_feedback/Temp_Feedback/LLM/server.py
+Project: /workspace/temp_feedback/Temp_Feedback/LLM
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+A local OpenAI-compatible inference server.
+One loaded backend (Qwen2VL with huggingface or vllm, or DeepSeek) is shared
+by all the clients, e.g. the batch runner, the GUI and the benchmark, over a
+/v1/chat/completions endpoint. The requests are handled with asyncio, and a
+dynamic batcher collects them for up to max_wait_ms or max_batch_size
+requests before one batched inference call.
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 11:32:08 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+"""
+
+import asyncio
+import base64
+import io
+import json
+import logging
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import hydra
+import numpy as np
+import omegaconf
+from PIL import Image, UnidentifiedImageError
+
+from utils.structured_output import parse_analysis
+
+logger = logging.getLogger(__name__)
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+
+class BadRequest(ValueError):
+    """the request can not be parsed, answered with 400."""
+
+
+class DynamicBatcher:
+    """collect the requests into batches for the blocking infer_fn.
+
+    A batch is closed after max_wait_ms from its first request, or when it
+    has max_batch_size requests. The requests with different prompts in one
+    batch are run as separate calls. The inference runs in one worker
+    thread, the requests arriving meanwhile make up the next batch.
+
+    Args:
+        infer_fn (callable): (images, prompt) -> output texts.
+        max_batch_size (int, optional): max requests per batch. Defaults to 8.
+        max_wait_ms (float, optional): max wait for more requests. Defaults to 10.
+    """
+
+    def __init__(self, infer_fn, max_batch_size: int = 8, max_wait_ms: float = 10.0):
+
+        self.infer_fn = infer_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+
+        # size of each inference call
+        self.batch_sizes = []
+
+    async def start(self):
+
+        self._queue = asyncio.Queue()
+        # 只有一个模型，推理在一个线程里串行执行
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, image, prompt: str):
+        """queue one request and wait for its output text."""
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, prompt, future))
+        return await future
+
+    async def _collect(self):
+
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _loop(self):
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = await self._collect()
+
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+
+            for prompt, items in groups.items():
+                self.batch_sizes.append(len(items))
+                try:
+                    outputs = await loop.run_in_executor(
+                        self._executor, self.infer_fn, [i[0] for i in items], prompt
+                    )
+                except Exception as e:
+                    logger.error(f"Inference failed: {e}")
+                    for _, _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                for (_, _, future), output in zip(items, outputs):
+                    if not future.done():
+                        future.set_result(output)
+
+
+def decode_image(url: str, image_dir: Path = None):
+    """an image from a data url, or a file:// url or a local path under image_dir.
+
+    Args:
+        url (str): the image url of the request.
+        image_dir (Path, optional): the local paths are only allowed under it. Defaults to None, data urls only.
+
+    Returns:
+        Image: the RGB image.
+    """
+
+    if url.startswith("data:"):
+        try:
+            data = base64.b64decode(url.split(",", 1)[1])
+            return Image.open(io.BytesIO(data)).convert("RGB")
+        except Exception as e:
+            raise BadRequest(f"Can not decode the image data url: {e}")
+
+    if image_dir is None:
+        raise BadRequest("Only data: image urls are accepted.")
+
+    # 解析符号链接和 .. 之后再检查，目录外的路径和不存在的路径给同样的回答
+    image_dir = Path(image_dir).resolve()
+    path = Path(url[len("file://") :] if url.startswith("file://") else url)
+    path = (image_dir / path).resolve()
+    if not path.is_relative_to(image_dir) or not path.is_file():
+        raise BadRequest(f"Image not found under the image directory: {url}")
+
+    try:
+        return Image.open(path).convert("RGB")
+    except (UnidentifiedImageError, OSError) as e:
+        raise BadRequest(f"Can not decode the image {url}: {e}")
+
+
+def parse_chat_request(body: dict, default_prompt: str, image_dir: Path = None):
+    """the image and the prompt of a chat completion request.
+
+    The last user message must have one image_url part, its text parts are
+    the prompt, the default prompt is used when there is no text. The image
+    is decoded by decode_image with the image_dir.
+    """
+
+    messages = [m for m in body.get("messages", []) if m.get("role") == "user"]
+    if not messages:
+        raise BadRequest("The request has no user message.")
+
+    content = messages[-1].get("content")
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+
+    texts, images = [], []
+    for part in content or []:
+        if part.get("type") == "text":
+            texts.append(part["text"])
+        elif part.get("type") == "image_url":
+            image_url = part["image_url"]
+            images.append(image_url["url"] if isinstance(image_url, dict) else image_url)
+
+    if len(images) != 1:
+        raise BadRequest(f"One image is needed per request, got {len(images)}.")
+
+    prompt = "\n".join(texts) if texts else default_prompt
+    if not prompt:
+        raise BadRequest("The request has no text and the server has no default prompt.")
+
+    return decode_image(images[0], image_dir), prompt
+
+
+class InferenceServer:
+    """asyncio HTTP server with an OpenAI-compatible chat completion endpoint.
+
+    Endpoints: POST /v1/chat/completions, GET /v1/models and GET /health.
+
+    Args:
+        infer_fn (callable): (images, prompt) -> output texts, e.g. VisionBackend.infer.
+        model_name (str, optional): the model id reported to the clients. Defaults to "qwen2-vl".
+        default_prompt (str, optional): prompt of the requests without text. Defaults to None.
+        host (str, optional): Defaults to "127.0.0.1".
+        port (int, optional): 0 means a free port. Defaults to 8000.
+        max_batch_size (int, optional): max requests per inference call. Defaults to 8.
+        max_wait_ms (float, optional): max wait to fill a batch. Defaults to 10.
+        image_dir (Path, optional): directory of the local images the requests may name. Defaults to None, data urls only.
+    """
+
+    def __init__(
+        self,
+        infer_fn,
+        model_name: str = "qwen2-vl",
+        default_prompt: str = None,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        image_dir: Path = None,
+    ):
+
+        self.model_name = model_name
+        self.default_prompt = default_prompt
+        self.image_dir = image_dir
+        self.host = host
+        self.port = port
+
+        self.batcher = DynamicBatcher(infer_fn, max_batch_size, max_wait_ms)
+
+    async def start(self):
+
+        await self.batcher.start()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        # port 0 时拿到实际的端口
+        self.port = self._server.sockets[0].getsockname()[1]
+
+        logger.info(f"Serving {self.model_name} at http://{self.host}:{self.port}")
+
+    async def stop(self):
+
+        self._server.close()
+        await self._server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            raise BadRequest("Empty request.")
+        method, path, _ = request_line.split(" ", 2)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, value = line.decode("latin-1").split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+        return method, path.split("?", 1)[0], body
+
+    async def _route(self, method: str, path: str, body: bytes):
+
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+
+        if method == "GET" and path == "/v1/models":
+            return 200, {
+                "object": "list",
+                "data": [{"id": self.model_name, "object": "model", "owned_by": "local"}],
+            }
+
+        if method == "POST" and path == "/v1/chat/completions":
+            try:
+                request = json.loads(body or b"{}")
+            except json.JSONDecodeError as e:
+                raise BadRequest(f"Invalid JSON body: {e}")
+
+            image, prompt = parse_chat_request(request, self.default_prompt, self.image_dir)
+            output_text = await self.batcher.submit(image, prompt)
+
+            return 200, self._completion(output_text)
+
+        return 404, {"error": {"message": f"{method} {path} not found", "type": "not_found"}}
+
+    def _completion(self, output_text: str):
+
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": self.model_name,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": output_text},
+                    "finish_reason": "stop",
+                }
+            ],
+            # 解析好的 {source, proportion, location}，客户端不用再解析
+            "analysis": parse_analysis(output_text),
+        }
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+
+        try:
+            method, path, body = await self._read_request(reader)
+            status, payload = await self._route(method, path, body)
+        except BadRequest as e:
+            status, payload = 400, {"error": {"message": str(e), "type": "invalid_request"}}
+        except Exception as e:
+            logger.error(f"Request failed: {e}")
+            status, payload = 500, {"error": {"message": str(e), "type": "server_error"}}
+
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode("latin-1")
+            + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+def encode_image(image, quality: int = 95):
+    """a jpeg data url of a PIL image, an RGB array or an image path."""
+
+    if isinstance(image, (str, Path)):
+        image = Image.open(image)
+    elif isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=quality)
+
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def chat_completion(base_url: str, image, prompt: str = None, timeout: float = 600):
+    """send one image to the server, the client side for the GUI or the scripts.
+
+    Args:
+        base_url (str): e.g. http://127.0.0.1:8000
+        image: PIL image, RGB array or image path.
+        prompt (str, optional): None means the default prompt of the server. Defaults to None.
+        timeout (float, optional): seconds. Defaults to 600.
+
+    Returns:
+        dict: the chat completion response.
+    """
+
+    content = [{"type": "image_url", "image_url": {"url": encode_image(image)}}]
+    if prompt:
+        content.append({"type": "text", "text": prompt})
+
+    request = urllib.request.Request(
+        f"{base_url.rstrip('/')}/v1/chat/completions",
+        data=json.dumps({"messages": [{"role": "user", "content": content}]}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def load_backend(cfg: omegaconf.DictConfig):
+    """load the VisionBackend of cfg.server.backend, hf, vllm, deepseek or blip."""
+
+    output_path = Path(cfg.output_path)
+
+    if cfg.server.backend == "hf":
+        from LLM.hugging_face.qwen2_vl import build_model, build_response_cache
+
+        return build_model(cfg, output_path, build_response_cache(cfg))
+
+    if cfg.server.backend == "vllm":
+        from LLM.vllm.qwen2_vl import Qwen2VL
+        from utils.token_budget import pixel_bounds
+
+        min_pixels, max_pixels = pixel_bounds(
+            cfg.model.min_pixels, cfg.model.max_pixels, cfg.budget.max_visual_tokens
+        )
+
+        return Qwen2VL(
+            output_path=output_path,
+            prompt=cfg.prompt_en,
+            version=cfg.version.model,
+            max_new_tokens=cfg.infer.max_new_tokens,
+            structured=cfg.infer.structured,
+            min_pixels=min_pixels,
+            max_pixels=max_pixels,
+        )
+
+    if cfg.server.backend == "deepseek":
+        from LLM.hugging_face.deepseek_vl2 import DeepSeek
+
+        return DeepSeek(
+            output_path=output_path, prompt=cfg.prompt_en, version=cfg.server.deepseek_model
+        )
+
+    if cfg.server.backend == "blip":
+        from LLM.hugging_face.blip import ImageToText
+        from utils.get_device import get_device
+
+        return ImageToText(output_path, get_device())
+
+    raise ValueError(
+        f"Unsupported backend: {cfg.server.backend}. Please use hf, vllm, deepseek or blip."
+    )
+
+
+@hydra.main(config_path="../configs", config_name="qwen2")
+def main(cfg: omegaconf.DictConfig):
+
+    backend = load_backend(cfg)
+
+    server = InferenceServer(
+        backend.infer,
+        model_name=backend.name,
+        default_prompt=cfg.prompt_en,
+        host=cfg.server.host,
+        port=cfg.server.port,
+        max_batch_size=cfg.server.max_batch_size,
+        max_wait_ms=cfg.server.max_wait_ms,
+        image_dir=cfg.server.image_dir,
+    )
+
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == "__main__":
+
+    main()
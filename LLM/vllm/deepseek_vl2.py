@@ -27,7 +27,6 @@ Date      	By	Comments
 """
 
 import logging
-import json
 from PIL import Image
 import hydra
 import omegaconf
@@ -45,6 +44,9 @@ from vllm import LLM
 from utils.timer import timer
 from utils.get_device import get_device
 from utils.video_loader import split_video_and_extract_frames_decord
+from utils.results_store import ResultsStore
+
+from LLM.backend import build_record, load_image
 
 
 class DeepSeek:
@@ -58,10 +60,12 @@ class DeepSeek:
         self.device_name = get_device()
         self.output_path = Path(output_path)
         self.prompt = prompt
+        self.version = version
 
         self.model, self.processor = self.load_model(version)
 
-        self.image_info = []
+        # 帧的结果追加写入 results.jsonl，不再每帧重写整个列表
+        self.results_store = ResultsStore(self.output_path / "results.jsonl")
 
     @staticmethod
     def load_model(version: str):
@@ -114,31 +118,23 @@ class DeepSeek:
 
         return output_text
 
-    def save_image_info_to_json(self, image_info: dict, json_file_path: Path):
-
-        full_path = json_file_path
-
-        if full_path.parent.exists() is False:
-            full_path.parent.mkdir(parents=True, exist_ok=True)
+    def answer(self, image: Image.Image, prompt: str = None):
+        """run the prompt on one image.
 
-        with open(full_path, "w") as f:
-            json.dump(image_info, f, indent=4)
+        Args:
+            image (Image.Image): the image.
+            prompt (str, optional): the question. Defaults to None, self.prompt.
 
-    def __call__(self, image_path: Path, text: str = "Describe this image."):
+        Returns:
+            tuple: (conversation, answer text)
+        """
 
-        if isinstance(image_path, str):
-            image = Image.open(image_path).convert("RGB")
-            logging.info(image.size)
-        elif isinstance(image_path, dict):
-            video_path = image_path["video_path"]
-            frame_idx = image_path["frame_idx"]
-            second = image_path["second"]
-            image = image_path["image"]
+        prompt = self.prompt if prompt is None else prompt
 
         conversation = [
             {
                 "role": "<|User|>",
-                "content": f"<image>\n<|ref|>{self.prompt}<|/ref|>.",
+                "content": f"<image>\n<|ref|>{prompt}<|/ref|>.",
                 # "images": ["./images/visual_grounding_1.jpeg"],
             },
             {"role": "<|Assistant|>", "content": ""},
@@ -169,6 +165,31 @@ class DeepSeek:
 
         answer = tokenizer.decode(outputs[0].cpu().tolist(), skip_special_tokens=False)
 
+        return conversation, answer
+
+    @property
+    def name(self):
+        return self.version
+
+    def infer(self, images: list, prompt: str = None):
+        """VisionBackend interface, the images are answered one by one.
+
+        Args:
+            images (list): PIL images, RGB arrays or paths.
+            prompt (str, optional): the question of this call. Defaults to None, self.prompt.
+
+        Returns:
+            list: output text of each image.
+        """
+
+        return [self.answer(load_image(image), prompt)[1] for image in images]
+
+    def __call__(self, image_path: Path, text: str = "Describe this image."):
+
+        image = load_image(image_path)
+
+        conversation, answer = self.answer(image)
+
         # package the image info
         if isinstance(image_path, str):
             image_info = {
@@ -178,19 +199,10 @@ class DeepSeek:
                 "output_text": answer,
             }
         elif isinstance(image_path, dict):
-            image_info = {
-                "video_path": video_path,
-                "frame_idx": frame_idx,
-                "second": second,
-                "conversation": conversation,
-                "output_text": answer,
-            }
+            image_info = build_record(image_path, answer, conversation=conversation)
+            self.results_store.append(image_info)
 
-        self.image_info.append(image_info)
-
-        self.save_image_info_to_json(
-            self.image_info, self.output_path / "image_info.json"
-        )
+        return image_info
 
 
 @hydra.main(config_path="../configs", config_name="deepseek")
@@ -217,6 +229,8 @@ def load_config(cfg: omegaconf.DictConfig):
 
         image_to_text(image_path=frame_info)
 
+    image_to_text.results_store.close()
+
     logging.info("All done!")
 
 
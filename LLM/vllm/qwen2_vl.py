@@ -24,175 +24,365 @@ Date      	By	Comments
 """
 
 import logging
-import json
-from PIL import Image
+import functools
 import hydra
 import omegaconf
-# import torch
 from pathlib import Path
 from typing import Dict
 from tqdm import tqdm
 
-from vllm import LLM
-
 from utils.timer import timer
-from utils.get_device import get_device
-from utils.video_loader import split_video_and_extract_frames_decord
+from utils.video_loader import iter_video_frames_decord
+from utils.results_store import ResultsStore
+from utils.response_cache import ResponseCache
+from utils.structured_output import ANALYSIS_SCHEMA
+from utils.token_budget import decode_size, pixel_bounds
+
+from LLM.backend import build_record, load_image
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=32)
+def build_prompt(question: str, modality: str = "image", text_first: bool = False):
+    """build the Qwen2.5-VL chat prompt, same as vision_language.run_qwen2_5_vl.
+
+    With text_first, the instruction is put before the vision placeholder, so
+    the whole fixed instruction is a shared prefix of all the requests and can
+    be reused by the vllm prefix caching.
+
+    Args:
+        question (str): the text prompt.
+        modality (str, optional): "image" or "video". Defaults to "image".
+        text_first (bool, optional): put the question before the image. Defaults to False.
+
+    Returns:
+        str: the prompt with the vision placeholder.
+    """
+
+    if modality == "image":
+        placeholder = "<|image_pad|>"
+    elif modality == "video":
+        placeholder = "<|video_pad|>"
+    else:
+        raise ValueError(f"Modality {modality} is not supported.")
+
+    vision = f"<|vision_start|>{placeholder}<|vision_end|>"
+    content = f"{question}{vision}" if text_first else f"{vision}{question}"
+
+    return (
+        "<|im_start|>system\nYou are a helpful assistant.<|im_end|>\n"
+        f"<|im_start|>user\n{content}<|im_end|>\n"
+        "<|im_start|>assistant\n"
+    )
 
 
 class Qwen2VL:
+    """offline batch engine with vllm.
+
+    All the frames passed to batch_call are submitted with one llm.generate
+    call, and vllm schedules them with continuous batching.
+
+    Args:
+        output_path (str): directory to save the results.
+        prompt (str): the text prompt.
+        version (str, optional): model name. Defaults to "Qwen/Qwen2.5-VL-7B-Instruct".
+        max_new_tokens (int, optional): max generated tokens per frame. Defaults to 2048.
+        llm (optional): an engine with the vllm.LLM generate interface, None means load the model.
+        sampling_params (optional): sampling params passed to generate, None means greedy decoding.
+        results_store (ResultsStore, optional): store of the frame results, None means output_path/results.jsonl.
+        response_cache (ResponseCache, optional): reuse the answers of the same or near-duplicate frames. Defaults to None.
+        structured (bool, optional): guided decoding of the ANALYSIS_SCHEMA JSON object. Defaults to False.
+        min_pixels (int, optional): lower bound of the resized frame. Defaults to 256 * 28 * 28.
+        max_pixels (int, optional): upper bound of the resized frame, one visual token per 28 * 28 pixels. Defaults to 1280 * 28 * 28.
+    """
+
     def __init__(
         self,
         output_path: str,
-        prompt: dict,
+        prompt: str,
         version: str = "Qwen/Qwen2.5-VL-7B-Instruct",
+        max_new_tokens: int = 2048,
+        llm=None,
+        sampling_params=None,
+        results_store: ResultsStore = None,
+        response_cache: ResponseCache = None,
+        structured: bool = False,
+        min_pixels: int = 256 * 28 * 28,
+        max_pixels: int = 1280 * 28 * 28,
     ):
 
-        self.device_name = get_device()
         self.output_path = Path(output_path)
         self.prompt = prompt
+        self.version = version
+        self.structured = structured
+        self.max_new_tokens = max_new_tokens
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+
+        self.model = (
+            llm if llm is not None else self.load_model(version, min_pixels, max_pixels)
+        )
+        self.sampling_params = (
+            sampling_params
+            if sampling_params is not None
+            else self.build_sampling_params(max_new_tokens, structured)
+        )
+
+        self.results_store = (
+            results_store
+            if results_store is not None
+            else ResultsStore(self.output_path / "results.jsonl")
+        )
+        self.response_cache = response_cache
+
+    @property
+    def cache_key(self):
+        """the response cache key, the prompt and every setting that changes the answers."""
+
+        return {
+            "version": self.version,
+            "prompt": self.prompt,
+            "structured": self.structured,
+            "max_new_tokens": self.max_new_tokens,
+            "min_pixels": self.min_pixels,
+            "max_pixels": self.max_pixels,
+        }
+
+    @staticmethod
+    def load_model(version: str, min_pixels: int, max_pixels: int):
+
+        from vllm import LLM
+
+        # 参数参考 vision_language.run_qwen2_5_vl
+        return LLM(
+            model=version,
+            max_model_len=4096,
+            max_num_seqs=16,
+            mm_processor_kwargs={
+                "min_pixels": min_pixels,
+                "max_pixels": max_pixels,
+            },
+            limit_mm_per_prompt={"image": 1},
+            # 所有帧共享同一段指令前缀，开启前缀缓存复用它的 KV cache
+            enable_prefix_caching=True,
+        )
+
+    @staticmethod
+    def build_sampling_params(max_new_tokens: int, structured: bool = False):
+
+        from vllm import SamplingParams
 
-        self.model = LLM(model=version)
-        self.image_info = []
+        if not structured:
+            return SamplingParams(temperature=0.0, max_tokens=max_new_tokens)
+
+        # 按 schema 约束解码，生成到 JSON 的右括号就结束
+        try:
+            from vllm.sampling_params import StructuredOutputsParams
+
+            return SamplingParams(
+                temperature=0.0,
+                max_tokens=max_new_tokens,
+                structured_outputs=StructuredOutputsParams(json=ANALYSIS_SCHEMA),
+            )
+        except ImportError:
+            # older vllm
+            from vllm.sampling_params import GuidedDecodingParams
+
+            return SamplingParams(
+                temperature=0.0,
+                max_tokens=max_new_tokens,
+                guided_decoding=GuidedDecodingParams(json=ANALYSIS_SCHEMA),
+            )
 
     def get_conversation(self, role: str, content: Dict):
         conversation = [{"role": role, "content": content}]
         return conversation
 
-    def preprocess(self, converstaion, image, device_name):
-        # Preprocess the inputs
-        text_prompt = self.processor.apply_chat_template(
-            converstaion, add_generation_prompt=True
-        )
-        # Excepted output: '<|im_start|>system\nYou are a helpful assistant.<|im_end|>\n<|im_start|>user\n<|vision_start|><|image_pad|><|vision_end|>Describe this image.<|im_end|>\n<|im_start|>assistant\n'
+    def build_conversation(self, prompt: str = None):
 
-        inputs = self.processor(
-            text=[text_prompt], images=[image], padding=True, return_tensors="pt"
-        )
-        inputs = inputs.to(device_name)
-
-        return inputs
-
-    # @timer
-    # def generate(self, inputs):
-
-    #     with torch.inference_mode():
-    #         # Inference: Generation of the output
-    #         output_ids = self.model.generate(**inputs, max_new_tokens=2048)
-    #         generated_ids = [
-    #             output_ids[len(input_ids) :]
-    #             for input_ids, output_ids in zip(inputs.input_ids, output_ids)
-    #         ]
-    #         output_text = self.processor.batch_decode(
-    #             generated_ids,
-    #             skip_special_tokens=True,
-    #             clean_up_tokenization_spaces=True,
-    #         )
-    #         logging.info(output_text)
-
-    #     return output_text
-
-    def save_image_info_to_json(self, image_info: dict, json_file_path: Path):
-
-        full_path = json_file_path
-
-        if full_path.parent.exists() is False:
-            full_path.parent.mkdir(parents=True, exist_ok=True)
-
-        with open(full_path, "w") as f:
-            json.dump(image_info, f, indent=4)
-
-    def __call__(self, image_path: Path, text: str = "Describe this image."):
-
-        if isinstance(image_path, str):
-            image = Image.open(image_path).convert("RGB")
-            logging.info(image.size)
-        elif isinstance(image_path, dict):
-            video_path = image_path["video_path"]
-            frame_idx = image_path["frame_idx"]
-            second = image_path["second"]
-            image = image_path["image"]
-
-        whole_output_text = {}
-
-        if isinstance(self.prompt, str):
-            conversation = [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                        },
-                        {"type": "text", "text": self.prompt},
-                    ],
-                }
-            ]
-        else:
-            # TODO: 这里的逻辑还可以修改一下
-            conversation = self.get_conversation("user", self.prompt)
+        conversation = [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": self.prompt if prompt is None else prompt},
+                    {
+                        "type": "image",
+                    },
+                ],
+            }
+        ]
+        return conversation
+
+    def build_inputs(self, frame_infos: list, prompt: str = None):
+        """build the vllm requests, one per frame, prompt defaults to self.prompt."""
 
-        # inputs = self.preprocess(conversation, image, self.device_name)
+        prompt = build_prompt(self.prompt if prompt is None else prompt, text_first=True)
 
-        outputs = self.model.generate(
+        return [
             {
-                "prompt": conversation,
-                "multi_modal_inputs": {
-                    "images": [image],
-                },
-            }
-        )
-        whole_output_text[0] = self.generate(inputs)
-
-        # package the image info
-        # TODO: 这里的组装方式还可以修改一下
-        if isinstance(image_path, str):
-            image_info = {
-                "image_name": image_path.split("/")[-1],
-                "image_path": image_path,
-                "conversation": conversation,
-                "output_text": whole_output_text,
-            }
-        elif isinstance(image_path, dict):
-            image_info = {
-                "video_path": video_path,
-                "frame_idx": frame_idx,
-                "second": second,
-                "conversation": conversation,
-                "output_text": whole_output_text,
+                "prompt": prompt,
+                # vllm 的图片输入是 PIL.Image
+                "multi_modal_data": {"image": load_image(frame_info)},
             }
+            for frame_info in frame_infos
+        ]
 
-        self.image_info.append(image_info)
+    @timer
+    def generate(self, inputs: list):
 
-        self.save_image_info_to_json(
-            self.image_info, self.output_path / "image_info.json"
-        )
+        outputs = self.model.generate(inputs, sampling_params=self.sampling_params)
 
+        # vllm 按请求的顺序返回结果
+        return [output.outputs[0].text for output in outputs]
 
-@hydra.main(config_path="../configs", config_name="qwen2")
-def load_config(cfg: omegaconf.DictConfig):
+    @property
+    def name(self):
+        return self.version
+
+    def infer(self, images: list, prompt: str = None):
+        """VisionBackend interface, all the images in one generate call.
+
+        Args:
+            images (list): PIL images, RGB arrays or paths.
+            prompt (str, optional): the prompt of this call. Defaults to None, self.prompt.
+
+        Returns:
+            list: output text of each image.
+        """
+
+        return self.generate(self.build_inputs([{"image": i} for i in images], prompt))
+
+    def batch_call(self, frame_infos: list):
+        """run the inference on all the frames with one generate call.
+
+        Args:
+            frame_infos (list): frame_info dicts from the video loader, may come from several videos.
+
+        Returns:
+            list: image_info dicts, in the same order as the frame_infos.
+        """
+
+        if not frame_infos:
+            return []
+
+        conversation = self.build_conversation()
+
+        if self.response_cache is not None:
+            # 只有没命中缓存的帧提交给 vllm
+            output_texts = self.response_cache.resolve(
+                frame_infos,
+                self.cache_key,
+                lambda missed: self.generate(self.build_inputs(missed)),
+                image_fn=lambda frame_info: frame_info["image"],
+            )
+        else:
+            output_texts = self.generate(self.build_inputs(frame_infos))
+
+        res_image_info = [
+            build_record(frame_info, output_text, conversation=conversation)
+            for frame_info, output_text in zip(frame_infos, output_texts)
+        ]
+
+        self.results_store.extend(res_image_info)
 
-    output_path = cfg.output_path
+        return res_image_info
 
-    # test image path
-    # images_path = [Path("tests/data/sample.jpg"), Path("tests/data/fire.jpg")]
-    # for image_path in images_path:
-    #     image_to_text(image_path)
+    def __call__(self, image_path):
 
-    video_path = "tests/data/downloaded_video.mp4"
+        if isinstance(image_path, dict):
+            return self.batch_call([image_path])[0]
 
-    total_frame_list = split_video_and_extract_frames_decord(
-        video_path, output_path + "/frames", fps=2
+        output_text = self.infer([image_path])
+
+        image_info = {
+            "image_name": Path(image_path).name,
+            "image_path": str(image_path),
+            "conversation": self.build_conversation(),
+            "output_text": output_text,
+        }
+
+        return image_info
+
+
+@hydra.main(config_path="../../configs", config_name="qwen2")
+def load_config(cfg: omegaconf.DictConfig):
+
+    output_path = Path(cfg.output_path)
+    video_path = Path(cfg.video_path)
+    assets_path = Path(cfg.assets_path)
+
+    response_cache = (
+        ResponseCache(
+            max_size=cfg.cache.max_size,
+            threshold=cfg.cache.threshold,
+            path=cfg.cache.path,
+        )
+        if cfg.cache.enable
+        else None
+    )
+
+    min_pixels, max_pixels = pixel_bounds(
+        cfg.model.min_pixels, cfg.model.max_pixels, cfg.budget.max_visual_tokens
     )
 
     image_to_text = Qwen2VL(
-        output_path=output_path, prompt=cfg.prompt_en, version=cfg.version.model
+        output_path=output_path,
+        prompt=cfg.prompt_en,
+        version=cfg.version.model,
+        max_new_tokens=cfg.infer.max_new_tokens,
+        response_cache=response_cache,
+        structured=cfg.infer.structured,
+        min_pixels=min_pixels,
+        max_pixels=max_pixels,
     )
 
-    for frame_info in tqdm(total_frame_list, desc="Processing frames"):
+    for pth in tqdm(sorted(video_path.iterdir()), desc="video file"):
+
+        _output_path = output_path / pth.stem
+
+        frame_infos = list(
+            iter_video_frames_decord(
+                pth,
+                _output_path / "frames" if cfg.video.save_frames else None,
+                fps=cfg.video.fps,
+                stride=cfg.video.stride,
+                frame_format=cfg.video.frame_format,
+                quality=cfg.video.quality,
+                # 直接按模型的分辨率解码，vllm 的 processor 不再缩放
+                size_fn=(
+                    functools.partial(
+                        decode_size, min_pixels=min_pixels, max_pixels=max_pixels
+                    )
+                    if cfg.budget.decode_resize
+                    else None
+                ),
+                decoder=cfg.video.decoder,
+                num_threads=cfg.video.decode_threads,
+                frame_cache=cfg.video.frame_cache,
+            )
+        )
+
+        # 一个视频的结果写入它自己的 results.jsonl
+        image_to_text.results_store.close()
+        image_to_text.results_store = ResultsStore(_output_path / "results.jsonl")
+
+        # 一个视频的所有采样帧一次性提交给 vllm
+        image_to_text.batch_call(frame_infos)
+
+        image_to_text.results_store.close()
+        image_to_text.results_store.export_gui_json(
+            assets_path / f"{_output_path.stem}.json"
+        )
+
+        logger.info(f"Processed video: {pth.stem}")
 
-        image_to_text(image_path=frame_info)
+    if response_cache is not None:
+        logger.info(f"Response cache: {response_cache.stats}")
+        if response_cache.path is not None:
+            response_cache.save()
 
-    logging.info("All done!")
+    logger.info("All done!")
 
 
 if __name__ == "__main__":
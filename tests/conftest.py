@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/conftest.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+Shared fixtures, tiny randomly initialised Qwen2-VL and BLIP models and processors,
+so the inference paths can run on CPU without downloading any weights.
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 1:05:33 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import cv2
+import numpy as np
+import pytest
+import torch
+
+SPECIAL_TOKENS = [
+    "<|endoftext|>",
+    "<|im_start|>",
+    "<|im_end|>",
+    "<|vision_start|>",
+    "<|vision_end|>",
+    "<|image_pad|>",
+    "<|video_pad|>",
+]
+
+CHAT_TEMPLATE = (
+    "{% for m in messages %}<|im_start|>{{ m['role'] }}\n"
+    "{% for c in m['content'] %}"
+    "{% if c['type'] == 'image' %}<|vision_start|><|image_pad|><|vision_end|>"
+    "{% else %}{{ c['text'] }}{% endif %}"
+    "{% endfor %}<|im_end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+
+
+def build_tiny_qwen2_vl():
+    """build a tiny random Qwen2-VL model and a matching processor."""
+
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import (
+        PreTrainedTokenizerFast,
+        Qwen2VLConfig,
+        Qwen2VLForConditionalGeneration,
+        Qwen2VLImageProcessor,
+        Qwen2VLProcessor,
+        Qwen2VLVideoProcessor,
+    )
+
+    # byte level tokenizer without merges, one token per byte like Qwen's base alphabet
+    alphabet = sorted(pre_tokenizers.ByteLevel.alphabet())
+    vocab = {t: i for i, t in enumerate(SPECIAL_TOKENS + alphabet)}
+    backend = Tokenizer(models.BPE(vocab=vocab, merges=[]))
+    backend.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    backend.decoder = decoders.ByteLevel()
+
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend,
+        pad_token="<|endoftext|>",
+        eos_token="<|im_end|>",
+        additional_special_tokens=SPECIAL_TOKENS,
+    )
+
+    processor = Qwen2VLProcessor(
+        image_processor=Qwen2VLImageProcessor(
+            min_pixels=4 * 28 * 28, max_pixels=16 * 28 * 28
+        ),
+        tokenizer=tokenizer,
+        video_processor=Qwen2VLVideoProcessor(),
+        chat_template=CHAT_TEMPLATE,
+    )
+
+    config = Qwen2VLConfig(
+        text_config=dict(
+            vocab_size=len(vocab),
+            hidden_size=32,
+            intermediate_size=64,
+            num_hidden_layers=1,
+            num_attention_heads=2,
+            num_key_value_heads=1,
+            max_position_embeddings=512,
+            rope_scaling={"type": "mrope", "mrope_section": [2, 2, 4]},
+            bos_token_id=vocab["<|im_start|>"],
+            eos_token_id=vocab["<|im_end|>"],
+            pad_token_id=vocab["<|endoftext|>"],
+        ),
+        vision_config=dict(
+            depth=1,
+            embed_dim=32,
+            hidden_size=32,
+            num_heads=2,
+            mlp_ratio=2,
+            patch_size=14,
+            spatial_merge_size=2,
+            temporal_patch_size=2,
+        ),
+        image_token_id=vocab["<|image_pad|>"],
+        video_token_id=vocab["<|video_pad|>"],
+        vision_start_token_id=vocab["<|vision_start|>"],
+        vision_end_token_id=vocab["<|vision_end|>"],
+    )
+
+    torch.manual_seed(0)
+    model = Qwen2VLForConditionalGeneration(config).eval()
+    model.generation_config.pad_token_id = vocab["<|endoftext|>"]
+    model.generation_config.eos_token_id = vocab["<|im_end|>"]
+    model.generation_config.do_sample = False
+
+    return model, processor
+
+
+@pytest.fixture(scope="session")
+def tiny_qwen2_vl():
+    return build_tiny_qwen2_vl()
+
+
+BLIP_WORDS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "[DEC]", "a", "photography", "of", "cat", "dog", "the"]
+
+
+def build_tiny_blip(vocab_dir):
+    """build a tiny random BLIP captioning model and a matching processor."""
+
+    from transformers import (
+        BertTokenizerFast,
+        BlipConfig,
+        BlipForConditionalGeneration,
+        BlipImageProcessor,
+        BlipProcessor,
+    )
+
+    vocab_file = vocab_dir / "vocab.txt"
+    vocab_file.write_text("\n".join(BLIP_WORDS) + "\n")
+
+    processor = BlipProcessor(
+        BlipImageProcessor(size={"height": 32, "width": 32}),
+        BertTokenizerFast(str(vocab_file), bos_token="[DEC]"),
+    )
+
+    config = BlipConfig(
+        text_config=dict(
+            vocab_size=len(BLIP_WORDS),
+            hidden_size=32,
+            intermediate_size=37,
+            num_hidden_layers=1,
+            num_attention_heads=2,
+            max_position_embeddings=64,
+            bos_token_id=BLIP_WORDS.index("[DEC]"),
+            pad_token_id=BLIP_WORDS.index("[PAD]"),
+            sep_token_id=BLIP_WORDS.index("[SEP]"),
+            eos_token_id=BLIP_WORDS.index("[SEP]"),
+        ),
+        vision_config=dict(
+            hidden_size=32,
+            intermediate_size=37,
+            num_hidden_layers=1,
+            num_attention_heads=2,
+            image_size=32,
+            patch_size=8,
+        ),
+        projection_dim=32,
+    )
+
+    torch.manual_seed(0)
+    model = BlipForConditionalGeneration(config).eval()
+
+    return model, processor
+
+
+@pytest.fixture(scope="session")
+def tiny_blip(tmp_path_factory):
+    return build_tiny_blip(tmp_path_factory.mktemp("blip"))
+
+
+def make_frame_info(frame_idx: int, size=(56, 84), video_path="sample.mp4"):
+    """a frame_info dict as yielded by the video loader."""
+
+    from PIL import Image
+
+    rng = np.random.default_rng(frame_idx)
+    frame = rng.integers(0, 255, (*size, 3), dtype=np.uint8)
+
+    return {
+        "video_path": video_path,
+        "frame_idx": frame_idx,
+        "current_ms": frame_idx * 100,
+        "second": frame_idx // 10,
+        "image": Image.fromarray(frame),
+    }
+
+
+@pytest.fixture
+def sample_video(tmp_path):
+    # 25 frames, 10 fps, the gray level encodes the frame index
+    video_path = tmp_path / "sample.mp4"
+    writer = cv2.VideoWriter(
+        str(video_path), cv2.VideoWriter_fourcc(*"mp4v"), 10.0, (64, 48)
+    )
+    for i in range(25):
+        writer.write(np.full((48, 64, 3), i * 10, dtype=np.uint8))
+    writer.release()
+    return video_path
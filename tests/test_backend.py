@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_backend.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 10:41:02 am
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import pytest
+
+from LLM.backend import VisionBackend, build_record, load_image
+from tests.conftest import make_frame_info
+
+
+class StubBackend:
+    def __init__(self, name="stub"):
+        self.name = name
+        self.calls = []
+
+    def infer(self, images, prompt=None):
+        self.calls.append(len(images))
+        return [
+            f'{{"source": "cold", "proportion": 0.25, "location": "{prompt} {image.size[0]}"}}'
+            for image in images
+        ]
+
+
+def test_stub_is_vision_backend():
+    assert isinstance(StubBackend(), VisionBackend)
+    assert not isinstance(object(), VisionBackend)
+
+
+def test_build_record():
+    frame_info = make_frame_info(3)
+    output_text = StubBackend().infer([load_image(frame_info)], "left")[0]
+
+    record = build_record(frame_info, output_text, model="stub")
+
+    assert record["frame_idx"] == 3 and record["ms"] == 300
+    assert record["model"] == "stub" and record["output_text"] == [output_text]
+    assert record["source"] == "cold" and record["location"] == "left 84"
+
+
+def test_hf_qwen2_vl_infer(tiny_qwen2_vl, tmp_path):
+    from LLM.hugging_face.qwen2_vl import Qwen2VL
+
+    model, processor = tiny_qwen2_vl
+    qwen2_vl = Qwen2VL(
+        tmp_path,
+        "describe this image",
+        batch_size=2,
+        max_new_tokens=2,
+        model=model,
+        processor=processor,
+    )
+    assert isinstance(qwen2_vl, VisionBackend)
+
+    frame_infos = [make_frame_info(i) for i in range(3)]
+    outputs = qwen2_vl.infer([f["image"] for f in frame_infos], "describe this image")
+
+    assert outputs == [r["output_text"][0] for r in qwen2_vl.batch_call(frame_infos)]
+
+
+def test_hf_qwen2_vl_infer_keeps_prompt(tiny_qwen2_vl, tmp_path):
+    from LLM.hugging_face.qwen2_vl import Qwen2VL
+    from utils.response_cache import ResponseCache
+
+    model, processor = tiny_qwen2_vl
+    qwen2_vl = Qwen2VL(
+        tmp_path,
+        "describe this image",
+        max_new_tokens=2,
+        model=model,
+        processor=processor,
+        response_cache=ResponseCache(),
+    )
+
+    image = make_frame_info(0)["image"]
+    qwen2_vl.infer([image], "another question")
+
+    assert qwen2_vl.prompt == "describe this image"
+    assert qwen2_vl.cache_key["prompt"] == "describe this image"
+    # 另一个 prompt 的答案不会被当前 prompt 命中
+    qwen2_vl.batch_call([make_frame_info(0)])
+    assert qwen2_vl.response_cache.stats["hits"] == 0
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_blip.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 1:12:27 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import json
+
+import pytest
+
+from LLM.backend import VisionBackend
+from tests.conftest import make_frame_info
+
+
+@pytest.fixture
+def blip(tiny_blip, tmp_path):
+    from LLM.hugging_face.blip import ImageToText
+
+    model, processor = tiny_blip
+    return ImageToText(tmp_path, "cpu", model=model, processor=processor, max_new_tokens=5)
+
+
+def reference_captions(model, processor, images, text=None):
+    """captions of model.generate, which runs the vision encoder on each call."""
+
+    if text is None:
+        inputs = processor(images=images, return_tensors="pt")
+    else:
+        inputs = processor(images=images, text=[text] * len(images), return_tensors="pt")
+
+    return processor.batch_decode(
+        model.generate(**inputs, max_new_tokens=5), skip_special_tokens=True
+    )
+
+
+def test_caption_pair_matches_generate(blip, tiny_blip):
+    model, processor = tiny_blip
+    images = [make_frame_info(i)["image"] for i in range(3)]
+
+    con, uncon = blip.caption_pair(images, "a photography of")
+
+    assert con == reference_captions(model, processor, images, "a photography of")
+    assert uncon == reference_captions(model, processor, images)
+    assert isinstance(blip, VisionBackend)
+
+
+def test_caption_pair_encodes_once(blip):
+    calls = []
+    handle = blip.model.vision_model.register_forward_hook(
+        lambda module, args, kwargs, output: calls.append(kwargs["pixel_values"].shape[0]),
+        with_kwargs=True,
+    )
+
+    try:
+        blip.caption_pair([make_frame_info(i)["image"] for i in range(4)])
+    finally:
+        handle.remove()
+
+    assert calls == [4]
+
+
+def test_batch_call(blip, tmp_path):
+    image_paths = []
+    for i in range(3):
+        image_paths.append(tmp_path / f"{i}.png")
+        make_frame_info(i)["image"].save(image_paths[-1])
+
+    res = blip.batch_call(image_paths, batch_size=2)
+
+    assert [r["image_name"] for r in res] == ["0", "1", "2"]
+    assert res[2]["con_text"] == blip.image2text_con(image_paths[2])
+    assert res[2]["uncon_text"] == blip.image2text_uncon(image_paths[2])
+
+
+def make_dataset(root, num_images=5):
+    image_paths = []
+    for i in range(num_images):
+        label = ("cold", "hot", "normal")[i % 3]
+        (root / label).mkdir(parents=True, exist_ok=True)
+        image_paths.append(root / label / f"{i}.jpg")
+        make_frame_info(i)["image"].save(image_paths[-1])
+
+    return image_paths
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_caption_dataset(blip, tmp_path, num_workers):
+    from LLM.hugging_face.blip import caption_dataset, load_images
+
+    make_dataset(tmp_path / "dataset")
+    image_paths = sorted(
+        image for images in load_images(tmp_path / "dataset") for image in images
+    )
+    output_file = tmp_path / "out" / "image_info.jsonl"
+
+    stats = caption_dataset(
+        blip, image_paths, output_file, batch_size=2, num_workers=num_workers
+    )
+
+    assert stats["images"] == 5 and stats["skipped"] == 0
+    assert stats["images_per_second"] > 0
+
+    lines = [json.loads(line) for line in output_file.read_text().splitlines()]
+    assert [l["image_path"] for l in lines] == [str(p) for p in image_paths]
+    assert lines[0]["label"] == image_paths[0].parent.name
+
+    expected = blip.batch_call(image_paths[:1])[0]
+    assert lines[0]["con_text"] == expected["con_text"]
+    assert lines[0]["uncon_text"] == expected["uncon_text"]
+
+
+def test_caption_dataset_resumes(blip, tmp_path):
+    from LLM.hugging_face.blip import caption_dataset
+
+    image_paths = make_dataset(tmp_path / "dataset")
+    output_file = tmp_path / "image_info.jsonl"
+
+    caption_dataset(blip, image_paths[:3], output_file, batch_size=2, num_workers=0)
+    # 中断时写了一半的一行
+    with open(output_file, "a") as f:
+        f.write('{"image_path": ')
+
+    stats = caption_dataset(blip, image_paths, output_file, batch_size=2, num_workers=0)
+
+    assert stats["images"] == 2 and stats["skipped"] == 3
+
+    lines = [json.loads(line) for line in output_file.read_text().splitlines()]
+    assert [l["image_path"] for l in lines] == [str(p) for p in image_paths]
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_decoders.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 11:02:18 am
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import cv2
+import numpy as np
+import pytest
+
+from utils.decoders import (
+    available_decoders,
+    benchmark_decoders,
+    fastest_decoder,
+    open_decoder,
+)
+from utils.results_store import ResultsStore
+from utils.video_loader import iter_video_frames_decord
+
+BACKENDS = available_decoders()
+
+
+def gray_level(frame):
+    # 灰度值编码了帧号
+    return int(round(frame.mean() / 10))
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_decoder_metadata(sample_video, backend):
+    with open_decoder(sample_video, backend) as decoder:
+        assert decoder.name == backend
+        assert decoder.frame_count == len(decoder) == 25
+        assert decoder.fps == pytest.approx(10.0)
+        assert decoder.source_size == decoder.size == (48, 64)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_random_access_is_frame_accurate(sample_video, backend):
+    indices = [20, 3, 4, 17, 0, 24, 3]
+
+    with open_decoder(sample_video, backend) as decoder:
+        frames = decoder.get_batch(indices)
+        assert frames.shape == (len(indices), 48, 64, 3) and frames.dtype == np.uint8
+        assert [gray_level(f) for f in frames] == indices
+
+        assert gray_level(decoder.get_frame(-1)[1]) == 24
+        assert [i for i, _ in decoder.iter_frames([5, 6, 7], batch_size=2)] == [5, 6, 7]
+
+        with pytest.raises(IndexError):
+            decoder.get_frame(25)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backends_agree(sample_video, backend):
+    with open_decoder(sample_video, "decord") as reference, open_decoder(
+        sample_video, backend
+    ) as decoder:
+        assert np.array_equal(decoder.get_batch(range(25)), reference.get_batch(range(25)))
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_keyframe_only(sample_video, backend):
+    with open_decoder(sample_video, backend) as decoder:
+        keyframes = decoder.keyframe_indices()
+        index, frame = decoder.get_frame(13, keyframe_only=True)
+
+    if keyframes is None:
+        # OpenCV 拿不到关键帧，退回逐帧精确的 seek
+        assert index == 13
+    else:
+        assert keyframes[0] == 0
+        assert index == max(k for k in keyframes if k <= 13)
+    assert gray_level(frame) == index
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_size_and_pixel_format(tmp_path, backend):
+    video_path = tmp_path / "red.mp4"
+    writer = cv2.VideoWriter(str(video_path), cv2.VideoWriter_fourcc(*"mp4v"), 10.0, (64, 48))
+    for _ in range(3):
+        # BGR 的红色
+        writer.write(np.full((48, 64, 3), (0, 0, 255), dtype=np.uint8))
+    writer.release()
+
+    with open_decoder(video_path, backend, width=32, height=24) as decoder:
+        rgb = decoder.get_frame(1)[1]
+    with open_decoder(video_path, backend, pixel_format="bgr") as decoder:
+        decoder.set_size(24, 32)
+        bgr = decoder.get_frame(1)[1]
+
+    assert rgb.shape == bgr.shape == (24, 32, 3)
+    assert rgb[..., 0].mean() > 200 and rgb[..., 2].mean() < 50
+    # swscale 的 rgb24 和 bgr24 在边缘有 ±2 的舍入差
+    assert np.abs(rgb.astype(int) - bgr[..., ::-1]).max() <= 2
+
+
+def test_open_decoder_errors(sample_video, tmp_path):
+    with pytest.raises(ValueError):
+        open_decoder(sample_video, "ffmpeg")
+    with pytest.raises(ValueError):
+        open_decoder(sample_video, pixel_format="yuv")
+    with pytest.raises(FileNotFoundError):
+        open_decoder(tmp_path / "missing.mp4")
+
+
+def test_benchmark_picks_fastest(sample_video, monkeypatch):
+    res = benchmark_decoders(sample_video, num_frames=5)
+
+    assert set(res) == set(BACKENDS)
+    assert all(r["sequential_fps"] > 0 and r["random_fps"] > 0 for r in res.values())
+
+    calls = []
+
+    def fake_benchmark(video_path, **kwargs):
+        calls.append(video_path)
+        return {
+            "decord": {"sequential_fps": 10.0, "random_fps": 30.0},
+            "opencv": {"sequential_fps": 20.0, "random_fps": 5.0},
+        }
+
+    monkeypatch.setattr("utils.decoders.benchmark_decoders", fake_benchmark)
+
+    assert fastest_decoder(sample_video) == "opencv"
+    assert fastest_decoder(sample_video, access="random") == "decord"
+    # 同一个文件只测一次
+    assert fastest_decoder(sample_video) == "opencv"
+    assert len(calls) == 2
+
+    with open_decoder(sample_video, "auto") as decoder:
+        assert decoder.name == "opencv"
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_loader_decoder(sample_video, backend):
+    frames = list(
+        iter_video_frames_decord(sample_video, stride=4, decoder=backend, width=32)
+    )
+
+    assert [f["frame_idx"] for f in frames] == list(range(0, 25, 4))
+    assert [gray_level(f["image"]) for f in frames] == list(range(0, 25, 4))
+    assert frames[0]["image"].shape == (24, 32, 3)
+
+
+def test_overlay_frames_from_source(sample_video, tmp_path):
+    from LLM.draw_res_to_img import iter_video_frames
+
+    video = tmp_path / "out" / "sample"
+    video.mkdir(parents=True)
+    with ResultsStore(video / "results.jsonl") as store:
+        for frame_idx in (2, 5):
+            store.append(
+                {"video_path": str(sample_video), "frame_idx": frame_idx, "output_text": [""]}
+            )
+    results_store = ResultsStore(video / "results.jsonl")
+
+    frames = list(iter_video_frames(video, results_store))
+    assert [i for i, _ in frames] == [2, 5]
+    assert [gray_level(f) for _, f in frames] == [2, 5]
+
+    # 原视频不在时读保存的帧
+    (video / "frames").mkdir()
+    cv2.imwrite(str(video / "frames" / "frame_7_second_0_ms_700.jpg"), frames[0][1])
+    sample_video.unlink()
+
+    assert [i for i, _ in iter_video_frames(video, results_store)] == [7]
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_draw_res_to_img.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 10:08:51 am
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from LLM.draw_res_to_img import (
+    draw_frame,
+    draw_text_with_font,
+    load_font,
+    merge_res_to_img,
+    overlay_fps,
+    render_text,
+    render_video,
+    stitch_videos,
+)
+from utils.decoders import open_decoder
+from utils.results_store import ResultsStore
+
+
+def make_results(video, video_path, frame_indices):
+    video.mkdir(parents=True, exist_ok=True)
+    with ResultsStore(video / "results.jsonl") as store:
+        for frame_idx in frame_indices:
+            store.append(
+                {
+                    "video_path": str(video_path),
+                    "frame_idx": frame_idx,
+                    # sample_video 是 10 fps
+                    "ms": int(frame_idx * 1000 / 10.0),
+                    "output_text": [
+                        '{"source": "heat", "proportion": 0.5, "location": "left"}'
+                    ],
+                }
+            )
+    return video
+
+
+def test_draw_frame():
+    frame = np.zeros((200, 320, 3), dtype=np.uint8)
+    record = {"output_text": ['{"source": "cold", "proportion": 0.25, "location": "left"}']}
+
+    overlay = draw_frame(frame, record, font_path=None, font_size=20)
+
+    assert overlay.shape == frame.shape and overlay.any()
+    assert not frame.any()
+    # 没有结果的帧原样返回
+    assert np.array_equal(draw_frame(frame[..., ::-1], None), frame)
+
+
+def draw_with_pil(frame, text_lines, positions, font_size, font_color):
+    """the whole-frame PIL drawing, the reference of the cached text layers."""
+
+    image_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    draw = ImageDraw.Draw(image_pil)
+    for text, pos in zip(text_lines, positions):
+        draw.text(pos, text, font=ImageFont.load_default(font_size), fill=font_color)
+    return cv2.cvtColor(np.array(image_pil), cv2.COLOR_RGB2BGR)
+
+
+@pytest.mark.parametrize("font_color", [(255, 255, 255), (255, 64, 0)])
+@pytest.mark.parametrize("positions", [[(20, 110), (20, 150)], [(280, 180), (-15, -10)]])
+def test_text_layer_matches_pil(font_color, positions):
+    frame = np.random.default_rng(0).integers(0, 256, (200, 320, 3), dtype=np.uint8)
+    text_lines = ["TYPE: HEAT", "PROPORTION: 57.89%"]
+
+    overlay = draw_text_with_font(frame, text_lines, positions, None, 30, font_color)
+
+    assert np.array_equal(overlay, draw_with_pil(frame, text_lines, positions, 30, font_color))
+
+
+def test_text_layer_is_cached():
+    load_font.cache_clear()
+    render_text.cache_clear()
+    frame = np.zeros((120, 200, 3), dtype=np.uint8)
+
+    for _ in range(5):
+        overlay = draw_text_with_font(
+            frame, ["TYPE: COLD", "TYPE: HEAT"], [(5, 10), (5, 60)], None, 20
+        )
+
+    assert load_font.cache_info().misses == 1
+    assert render_text.cache_info().misses == 2 and render_text.cache_info().hits == 8
+
+    # 只有文字区域被修改
+    (dx, dy), mask = render_text("TYPE: COLD", None, 20)
+    changed = np.argwhere(overlay[:50].any(axis=2))
+    assert np.all(changed.min(axis=0) >= [10 + dy, 5 + dx])
+    assert np.all(changed.max(axis=0) < [10 + dy + mask.shape[0], 5 + dx + mask.shape[1]])
+
+
+@pytest.mark.parametrize("reorder_size", [1, 3, 64])
+def test_render_video_streams_in_order(sample_video, tmp_path, reorder_size):
+    video = make_results(tmp_path / "out" / "sample", sample_video, range(0, 25, 2))
+    output_file = tmp_path / "vis" / "sample_text.mp4"
+
+    num_frames = render_video(
+        video,
+        output_file,
+        fps=10.0,
+        font_path=None,
+        num_workers=3,
+        reorder_size=reorder_size,
+    )
+
+    assert num_frames == 13
+    with open_decoder(output_file) as vr:
+        assert vr.frame_count == 13 and vr.fps == pytest.approx(10.0)
+        # 帧按顺序写入：灰度随帧号增加
+        levels = [vr.get_frame(i)[1][:20].mean() for i in range(13)]
+    assert levels == sorted(levels)
+
+
+def test_render_video_bounded_buffer(sample_video, tmp_path, monkeypatch):
+    import LLM.draw_res_to_img as draw_res_to_img
+
+    video = make_results(tmp_path / "out" / "sample", sample_video, range(25))
+
+    # 统计同时存在的、画完但还没写出的帧
+    alive = []
+    max_alive = [0]
+    original = draw_res_to_img.draw_frame
+
+    def tracked(*args, **kwargs):
+        alive.append(1)
+        max_alive[0] = max(max_alive[0], len(alive))
+        return original(*args, **kwargs)
+
+    class Writer:
+        def __init__(self, *args):
+            pass
+
+        def write(self, frame):
+            alive.pop()
+
+        def release(self):
+            pass
+
+    monkeypatch.setattr(draw_res_to_img, "draw_frame", tracked)
+    monkeypatch.setattr(draw_res_to_img.cv2, "VideoWriter", Writer)
+
+    assert render_video(video, tmp_path / "x.mp4", font_path=None, reorder_size=4) == 25
+    assert max_alive[0] <= 4
+
+
+def test_merge_res_to_img(sample_video, tmp_path):
+    make_results(tmp_path / "out" / "a", sample_video, [0, 1, 2])
+    make_results(tmp_path / "out" / "b", sample_video, [3, 4])
+    (tmp_path / "out" / "ledger.jsonl").write_text("")
+
+    merge_res_to_img(tmp_path / "out", tmp_path / "logs", font_path=None)
+
+    outputs = sorted((tmp_path / "logs" / "video_text_vis").iterdir())
+    assert [p.name for p in outputs] == ["a_text.mp4", "b_text.mp4"]
+    with open_decoder(outputs[1]) as vr:
+        assert vr.frame_count == 2
+
+
+def test_overlay_fps(sample_video, tmp_path):
+    video = make_results(tmp_path / "out" / "sample", sample_video, range(0, 25, 5))
+    results_store = ResultsStore(video / "results.jsonl")
+
+    assert overlay_fps(results_store, list(range(25))) == pytest.approx(10.0)
+    # 每 5 帧采样一帧，按原来的时长播放
+    assert overlay_fps(results_store, list(range(0, 25, 5))) == pytest.approx(2.0)
+
+    # 原视频不在时用结果里的 frame_idx 和 ms
+    sample_video.unlink()
+    assert overlay_fps(results_store, list(range(25))) == pytest.approx(10.0)
+
+    empty = ResultsStore(tmp_path / "empty.jsonl")
+    assert overlay_fps(empty, [], default=25.0) == 25.0
+
+
+def test_stitch_videos(sample_video, tmp_path):
+    video = make_results(tmp_path / "out" / "sample", sample_video, range(25))
+    frames = [(i, None) for i in range(25)]
+
+    part_files = []
+    for start in (0, 10, 20):
+        part_files.append(tmp_path / f"part{start}.mp4")
+        render_video(
+            video, part_files[-1], fps=10.0, font_path=None, frames=frames[start : start + 10]
+        )
+
+    stitch_videos(part_files, tmp_path / "joined.mp4")
+
+    with open_decoder(tmp_path / "joined.mp4") as vr:
+        assert vr.frame_count == 25 and vr.fps == pytest.approx(10.0)
+        # 拼接后帧的顺序不变
+        levels = [vr.get_frame(i)[1][:20].mean() for i in range(25)]
+    assert levels == sorted(levels)
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_merge_res_to_img_segments(sample_video, tmp_path, num_workers):
+    make_results(tmp_path / "out" / "a", sample_video, range(25))
+    make_results(tmp_path / "out" / "b", sample_video, range(0, 25, 5))
+
+    merge_res_to_img(
+        tmp_path / "out",
+        tmp_path / "logs",
+        font_path=None,
+        num_workers=num_workers,
+        segment_frames=10,
+    )
+
+    outputs = sorted((tmp_path / "logs" / "video_text_vis").iterdir())
+    # 分段的临时文件已经删掉
+    assert [p.name for p in outputs] == ["a_text.mp4", "b_text.mp4"]
+
+    with open_decoder(outputs[0]) as vr:
+        assert vr.frame_count == 25 and vr.fps == pytest.approx(10.0)
+    with open_decoder(outputs[1]) as vr:
+        assert vr.frame_count == 5 and vr.fps == pytest.approx(2.0)
+
+
+def test_merge_res_to_img_hashes_once(sample_video, tmp_path, monkeypatch):
+    import LLM.draw_res_to_img as draw_res_to_img
+    from utils.frame_cache import build_frame_cache
+    from utils.ledger import file_hash
+
+    make_results(tmp_path / "out" / "a", sample_video, range(25))
+    build_frame_cache(tmp_path / "cache", sample_video)
+
+    calls = []
+
+    def counting_hash(path):
+        calls.append(path)
+        return file_hash(path)
+
+    monkeypatch.setattr(draw_res_to_img, "file_hash", counting_hash)
+    monkeypatch.setattr("utils.frame_cache.file_hash", counting_hash)
+
+    merge_res_to_img(
+        tmp_path / "out",
+        tmp_path / "logs",
+        frame_cache=tmp_path / "cache",
+        font_path=None,
+        segment_frames=10,
+    )
+
+    # 三段共用 plan_render 算好的哈希
+    assert calls == [sample_video]
+    with open_decoder(tmp_path / "logs" / "video_text_vis" / "a_text.mp4") as vr:
+        assert vr.frame_count == 25
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_frame_cache.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 4:25:33 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import cv2
+import numpy as np
+
+from utils.decoders import open_decoder
+from utils.frame_cache import FrameCache, build_frame_cache
+from utils.results_store import ResultsStore
+from utils.video_loader import iter_video_frames_decord
+
+
+def test_build_and_read(sample_video, tmp_path):
+    cache = build_frame_cache(tmp_path / "cache", sample_video, frame_indices=[0, 4, 8, 9])
+
+    assert cache.valid and len(cache) == 4
+    assert cache.fps == 10.0 and cache.frame_count == 25
+    assert cache.size == cache.source_size == (48, 64)
+    assert 4 in cache and 5 not in cache
+
+    with open_decoder(sample_video) as vr:
+        assert np.array_equal(cache.get(8), vr.get_frame(8)[1])
+
+    # 零拷贝：帧是 memmap 的视图
+    reopened = FrameCache(tmp_path / "cache", sample_video)
+    assert reopened.covers([0, 8]) and not reopened.covers([0, 5])
+    assert np.shares_memory(reopened.get_batch([8, 9]), reopened.get_batch([0, 4, 8, 9]))
+    assert np.array_equal(reopened.get_batch([9, 0])[1], cache.get(0))
+
+    # 已经缓存的帧不再解码
+    frames_path = cache.parts[0]["index"]["path"]
+    mtime = frames_path.stat().st_mtime_ns
+    build_frame_cache(tmp_path / "cache", sample_video, frame_indices=[4, 8])
+    assert frames_path.stat().st_mtime_ns == mtime
+
+
+def test_invalidated_by_video_hash(sample_video, tmp_path):
+    build_frame_cache(tmp_path / "cache", sample_video)
+    assert FrameCache(tmp_path / "cache", sample_video).covers(range(25))
+
+    # 同名但内容不同的视频
+    writer = cv2.VideoWriter(str(sample_video), cv2.VideoWriter_fourcc(*"mp4v"), 10.0, (64, 48))
+    for i in range(5):
+        writer.write(np.full((48, 64, 3), 200, dtype=np.uint8))
+    writer.release()
+
+    assert not FrameCache(tmp_path / "cache", sample_video).valid
+    assert len(build_frame_cache(tmp_path / "cache", sample_video)) == 5
+
+
+def test_interrupted_build_is_invalid(sample_video, tmp_path):
+    cache = FrameCache(tmp_path / "cache", sample_video)
+    cache.create([0, 1], (48, 64), 10.0, 25, (48, 64))
+    cache.write([0], np.zeros((1, 48, 64, 3), dtype=np.uint8))
+    cache.close()
+
+    assert not FrameCache(tmp_path / "cache", sample_video).valid
+
+
+def test_loader_writes_and_reads_cache(sample_video, tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+
+    first = list(iter_video_frames_decord(sample_video, stride=3, width=32, frame_cache=cache_dir))
+
+    cache = FrameCache(cache_dir, sample_video, size=(24, 32))
+    assert cache.frame_indices == list(range(0, 25, 3)) and cache.size == (24, 32)
+
+    # 第二次不打开视频，全部从缓存读
+    def no_decoder(*args, **kwargs):
+        raise AssertionError("decoded again")
+
+    monkeypatch.setattr("utils.video_loader.open_decoder", no_decoder)
+    second = list(
+        iter_video_frames_decord(
+            sample_video, stride=3, width=32, frame_cache=cache_dir, skip_indices={0}
+        )
+    )
+
+    assert [f["frame_idx"] for f in second] == list(range(3, 25, 3))
+    assert all(np.array_equal(a["image"], b["image"]) for a, b in zip(first[1:], second))
+    assert not second[0]["image"].flags.writeable
+
+
+def test_overlay_reads_cache(sample_video, tmp_path):
+    from LLM.draw_res_to_img import iter_video_frames
+
+    video = tmp_path / "out" / "sample"
+    video.mkdir(parents=True)
+    with ResultsStore(video / "results.jsonl") as store:
+        for frame_idx in (2, 5):
+            store.append(
+                {"video_path": str(sample_video), "frame_idx": frame_idx, "output_text": [""]}
+            )
+
+    cache = build_frame_cache(tmp_path / "cache", sample_video, frame_indices=[2, 5])
+    frames = list(
+        iter_video_frames(video, ResultsStore(video / "results.jsonl"), frame_cache=tmp_path / "cache")
+    )
+
+    assert [i for i, _ in frames] == [2, 5]
+    assert np.array_equal(frames[0][1], cache.get(2)[..., ::-1])
+    # 通道翻转的 memmap 视图，不是拷贝
+    assert isinstance(frames[0][1], np.memmap)
+
+
+def test_same_stem_videos_do_not_collide(sample_video, tmp_path):
+    other = tmp_path / "other" / sample_video.name
+    other.parent.mkdir()
+    writer = cv2.VideoWriter(str(other), cv2.VideoWriter_fourcc(*"mp4v"), 10.0, (64, 48))
+    for i in range(5):
+        writer.write(np.full((48, 64, 3), 200, dtype=np.uint8))
+    writer.release()
+
+    first = build_frame_cache(tmp_path / "cache", sample_video)
+    second = build_frame_cache(tmp_path / "cache", other)
+
+    assert first.dir != second.dir
+    assert FrameCache(tmp_path / "cache", sample_video).covers(range(25))
+    assert len(FrameCache(tmp_path / "cache", other)) == 5
+
+    # 原视频不在时按 index 里的路径找缓存
+    sample_video.unlink()
+    cache = FrameCache(tmp_path / "cache", sample_video)
+    assert cache.dir == first.dir and len(cache) == 25
+
+
+def test_rebuild_does_not_touch_mapped_frames(sample_video, tmp_path):
+    build_frame_cache(tmp_path / "cache", sample_video, frame_indices=[0, 1])
+    reader = FrameCache(tmp_path / "cache", sample_video)
+    old = reader.get_batch([0, 1]).copy()
+
+    cache = FrameCache(tmp_path / "cache", sample_video)
+    cache.create([0, 1, 2], (48, 64), 10.0, 25, (48, 64))
+    cache.write([0, 1, 2], np.full((3, 48, 64, 3), 255, dtype=np.uint8))
+
+    # 构建完成之前旧的 part 还在，新的 part 不算数
+    assert FrameCache(tmp_path / "cache", sample_video).frame_indices == [0, 1]
+    cache.finish()
+
+    assert np.array_equal(reader.get_batch([0, 1]), old)
+    assert FrameCache(tmp_path / "cache", sample_video).get(2).min() == 255
+
+
+def test_sizes_do_not_overwrite(sample_video, tmp_path):
+    cache_dir = tmp_path / "cache"
+    list(iter_video_frames_decord(sample_video, stride=3, width=32, frame_cache=cache_dir))
+    build_frame_cache(cache_dir, sample_video)
+
+    # 模型尺寸和原尺寸的缓存各自有效
+    assert FrameCache(cache_dir, sample_video, size=(24, 32)).covers(range(0, 25, 3))
+    full = FrameCache(cache_dir, sample_video)
+    assert full.size == (48, 64) and full.covers(range(25))
+    assert full.get(3).shape == (48, 64, 3)
+
+
+def test_shards_and_resume_write_parts(sample_video, tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+
+    # 两个 shard 各写一个 part，续跑写它解码的帧
+    list(iter_video_frames_decord(sample_video, frame_range=(0, 10), frame_cache=cache_dir))
+    list(iter_video_frames_decord(sample_video, frame_range=(10, 20), frame_cache=cache_dir))
+    list(
+        iter_video_frames_decord(
+            sample_video, frame_cache=cache_dir, skip_indices=set(range(20))
+        )
+    )
+
+    cache = FrameCache(cache_dir, sample_video)
+    assert len(cache.parts) == 3 and cache.covers(range(25))
+
+    def no_decoder(*args, **kwargs):
+        raise AssertionError("decoded again")
+
+    monkeypatch.setattr("utils.video_loader.open_decoder", no_decoder)
+    frames = list(iter_video_frames_decord(sample_video, frame_cache=cache_dir))
+
+    assert [f["frame_idx"] for f in frames] == list(range(25))
+    with open_decoder(sample_video) as vr:
+        assert np.array_equal(frames[12]["image"], vr.get_frame(12)[1])
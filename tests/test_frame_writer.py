@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_frame_writer.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 11:20:45 am
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.frame_writer import FrameWriter
+
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+@pytest.mark.parametrize("frame_format", ["jpg", "png", "webp", "npy"])
+def test_frame_writer(tmp_path, mode, frame_format):
+    frame = np.random.randint(0, 255, (16, 24, 3), dtype=np.uint8)
+
+    with FrameWriter(
+        tmp_path, frame_format=frame_format, mode=mode, num_workers=2, max_queue=2
+    ) as writer:
+        paths = [writer.submit(frame, f"frame_{i}") for i in range(5)]
+
+    assert writer.saved_count == 5
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        f"frame_{i}.{frame_format}" for i in range(5)
+    )
+
+    if frame_format == "npy":
+        np.testing.assert_array_equal(np.load(paths[0]), frame)
+    elif frame_format == "png":
+        np.testing.assert_array_equal(np.asarray(Image.open(paths[0])), frame)
+
+
+def test_frame_writer_disabled(tmp_path):
+    writer = FrameWriter(None)
+
+    assert not writer.enabled
+    assert writer.submit(np.zeros((4, 4, 3), dtype=np.uint8), "frame_0") is None
+    writer.close()
+
+
+def test_frame_writer_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        FrameWriter(tmp_path, frame_format="bmp")
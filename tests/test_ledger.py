@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_ledger.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 4:42:19 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+from utils.ledger import CompletionLedger, file_hash, prompt_hash
+from utils.video_loader import iter_video_frames_decord
+
+
+def test_file_hash(tmp_path):
+    a = tmp_path / "a.mp4"
+    b = tmp_path / "b.mp4"
+    a.write_bytes(b"video")
+    b.write_bytes(b"video")
+
+    assert file_hash(a) == file_hash(b)
+
+    b.write_bytes(b"other video")
+    assert file_hash(a) != file_hash(b)
+
+
+def test_ledger_resume(tmp_path):
+    path = tmp_path / "ledger.jsonl"
+
+    ledger = CompletionLedger(path, "Qwen/Qwen2.5-VL-7B-Instruct", "prompt")
+    ledger.mark_frames("video_a", [0, 1, 2])
+    ledger.mark_video("video_b")
+
+    # a restarted run sees the same progress
+    ledger = CompletionLedger(path, "Qwen/Qwen2.5-VL-7B-Instruct", "prompt")
+    assert ledger.done_frames("video_a") == {0, 1, 2}
+    assert ledger.is_video_done("video_b")
+    assert not ledger.is_video_done("video_a")
+
+    # another model or prompt starts from scratch
+    assert CompletionLedger(path, "Qwen/Qwen2-VL-7B-Instruct", "prompt").done_frames("video_a") == set()
+    assert CompletionLedger(path, "Qwen/Qwen2.5-VL-7B-Instruct", "new").done_frames("video_a") == set()
+
+
+def test_ledger_ignores_torn_line(tmp_path):
+    path = tmp_path / "ledger.jsonl"
+
+    ledger = CompletionLedger(path, "model", {"text": "prompt"})
+    ledger.mark_frames("video_a", [0])
+    with open(path, "a") as f:
+        f.write('{"video_hash": "video_a", "frame')
+
+    resumed = CompletionLedger(path, "model", {"text": "prompt"})
+    assert resumed.done_frames("video_a") == {0}
+    assert prompt_hash({"text": "prompt"}) == ledger.prompt_hash
+
+    # 不完整的行被截掉，新的记录不会接在它后面
+    resumed.mark_frames("video_a", [1])
+    assert CompletionLedger(path, "model", {"text": "prompt"}).done_frames("video_a") == {0, 1}
+
+
+def test_skip_finished_frames(sample_video):
+    frames = iter_video_frames_decord(sample_video, stride=5, skip_indices={0, 10})
+
+    assert [f["frame_idx"] for f in frames] == [5, 15, 20]
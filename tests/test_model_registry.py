@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_model_registry.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 9:41:02 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import time
+
+from LLM.hugging_face.qwen2_vl import Qwen2VL
+from utils.model_registry import ModelRegistry, get_registry
+from tests.conftest import make_frame_info
+
+
+def test_registry_loads_once():
+    registry = ModelRegistry()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return object()
+
+    first = registry.get("model", loader)
+    assert registry.get("model", loader) is first
+    assert registry.load_count == 1 and len(loads) == 1
+
+    registry.evict("model")
+    assert "model" not in registry
+    assert registry.get("model", loader) is not first
+    assert registry.load_count == 2
+
+
+def test_registry_evicts_idle():
+    registry = ModelRegistry(idle_timeout=10)
+    registry.get("a", object)
+    registry.get("b", object)
+
+    assert registry.evict_idle() == []
+    assert registry.evict_idle(now=time.monotonic() + 11) == ["a", "b"]
+    assert len(registry) == 0
+
+    # the background reaper does the same
+    registry = ModelRegistry(idle_timeout=0.05)
+    registry.get("a", object)
+    time.sleep(0.3)
+    assert "a" not in registry
+    registry.clear()
+
+
+def patch_loaders(monkeypatch, tiny_qwen2_vl):
+    model, processor = tiny_qwen2_vl
+    monkeypatch.setattr(Qwen2VL, "load_model", staticmethod(lambda *args: model))
+    monkeypatch.setattr(Qwen2VL, "load_processor", staticmethod(lambda *args: processor))
+
+
+def test_qwen2_vl_lazy_load_and_rebind(tiny_qwen2_vl, tmp_path, monkeypatch):
+    patch_loaders(monkeypatch, tiny_qwen2_vl)
+    registry = ModelRegistry()
+
+    qwen2_vl = Qwen2VL(
+        output_path=tmp_path / "a",
+        prompt="describe this image",
+        max_new_tokens=2,
+        lazy=True,
+        registry=registry,
+    )
+    assert registry.load_count == 0
+
+    qwen2_vl.batch_call([make_frame_info(0, video_path="a.mp4")])
+    assert registry.load_count == 1
+
+    # the next video only rebinds the output path
+    qwen2_vl.bind(tmp_path / "b")
+    qwen2_vl.batch_call([make_frame_info(0, video_path="b.mp4")])
+    qwen2_vl.results_store.close()
+
+    assert registry.load_count == 1
+    assert qwen2_vl.results_store.path == tmp_path / "b" / "results.jsonl"
+    assert qwen2_vl.results_store.videos == ["b.mp4"]
+
+    # another instance in the same process shares the weights
+    Qwen2VL(output_path=tmp_path / "c", prompt="describe this image", registry=registry)
+    assert registry.load_count == 1
+
+
+def test_registry_lease_blocks_idle_eviction():
+    registry = ModelRegistry(idle_timeout=10)
+
+    with registry.lease("a", object) as model:
+        # 正在使用的模型不会被空闲回收
+        assert registry.evict_idle(now=time.monotonic() + 11) == []
+        assert registry.get("a", object) is model
+
+    assert registry.evict_idle(now=time.monotonic() + 11) == ["a"]
+
+
+def test_get_registry_is_shared(monkeypatch):
+    monkeypatch.setattr("utils.model_registry._REGISTRY", None)
+
+    registry = get_registry(idle_timeout=30)
+    assert get_registry() is registry and registry.idle_timeout == 30
+
+
+def test_qwen2_vl_holds_lease_while_generating(tiny_qwen2_vl, tmp_path, monkeypatch):
+    patch_loaders(monkeypatch, tiny_qwen2_vl)
+    registry = ModelRegistry(idle_timeout=1000)
+
+    qwen2_vl = Qwen2VL(
+        output_path=tmp_path / "a",
+        prompt="describe this image",
+        max_new_tokens=2,
+        registry=registry,
+    )
+    generate = qwen2_vl.generate
+    evicted = []
+
+    def evicting_generate(inputs):
+        # 生成途中触发空闲回收
+        evicted.append(registry.evict_idle(now=time.monotonic() + 1e6))
+        return generate(inputs)
+
+    monkeypatch.setattr(qwen2_vl, "generate", evicting_generate)
+    qwen2_vl.batch_call([make_frame_info(0, video_path="a.mp4")])
+
+    assert evicted == [[]] and registry.load_count == 1
+    assert registry.evict_idle(now=time.monotonic() + 1e6) == [qwen2_vl._model_key]
+    registry.clear()
+
+
+def test_qwen2_vl_processor_survives_eviction(tiny_qwen2_vl, tmp_path, monkeypatch):
+    patch_loaders(monkeypatch, tiny_qwen2_vl)
+    registry = ModelRegistry(idle_timeout=1000)
+
+    qwen2_vl = Qwen2VL(
+        output_path=tmp_path / "a",
+        prompt="describe this image",
+        max_new_tokens=2,
+        registry=registry,
+    )
+    assert registry.evict_idle(now=time.monotonic() + 1e6) == [qwen2_vl._model_key]
+
+    # 模型被回收后，取 processor 不会把模型重新加载回来
+    qwen2_vl.frame_size(120, 160)
+    qwen2_vl.preprocess(
+        qwen2_vl.build_conversation(), [make_frame_info(0)["image"]], "cpu"
+    )
+    assert registry.load_count == 1 and qwen2_vl._model_key not in registry
+    registry.clear()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_pipeline.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 8:55:47 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import random
+import threading
+import time
+
+import pytest
+
+from LLM.hugging_face.qwen2_vl import iter_batches, run_video_pipeline
+from utils.ledger import CompletionLedger
+from utils.pipeline import Pipeline, Stage
+from utils.results_store import ResultsStore
+from tests.conftest import make_frame_info
+
+
+def test_pipeline_keeps_order():
+
+    def slow_square(x):
+        time.sleep(random.random() * 0.01)
+        return x * x
+
+    pipeline = Pipeline(
+        [Stage("square", slow_square, workers=4), Stage("add", lambda x: x + 1)],
+        queue_size=2,
+    )
+
+    assert list(pipeline.run(range(50))) == [x * x + 1 for x in range(50)]
+
+
+def test_pipeline_backpressure():
+    produced = []
+
+    def source():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    def fake_model(x):
+        time.sleep(0.01)
+        return x
+
+    pipeline = Pipeline([Stage("model", fake_model)], queue_size=2)
+    results = pipeline.run(source())
+
+    next(results)
+    time.sleep(0.1)
+    # the source is only read a few items ahead of the slow stage
+    assert len(produced) < 10
+
+    results.close()
+
+
+def test_pipeline_stages_overlap():
+    active, peak = set(), []
+    lock = threading.Lock()
+
+    def stage(name):
+        def fn(x):
+            with lock:
+                active.add(name)
+                peak.append(len(active))
+            time.sleep(0.01)
+            with lock:
+                active.discard(name)
+            return x
+
+        return fn
+
+    pipeline = Pipeline([Stage("a", stage("a")), Stage("b", stage("b"))])
+    list(pipeline.run(range(20)))
+
+    assert max(peak) == 2
+
+
+def test_pipeline_raises_stage_error():
+
+    def fail(x):
+        if x == 3:
+            raise ValueError("bad item")
+        return x
+
+    pipeline = Pipeline([Stage("fail", fail, workers=2)])
+
+    with pytest.raises(ValueError, match="bad item"):
+        list(pipeline.run(range(10)))
+
+
+class FakeModel:
+    """the Qwen2VL stages without a model, the answer is the frame index."""
+
+    def __init__(self, results_store):
+        self.results_store = results_store
+        self.generated = []
+
+    def prepare(self, frame_infos):
+        return {"frame_infos": frame_infos, "conversation": []}
+
+    def run_prepared(self, prepared):
+        time.sleep(0.005)
+        self.generated += [f["frame_idx"] for f in prepared["frame_infos"]]
+        return [str(f["frame_idx"]) for f in prepared["frame_infos"]]
+
+    def build_records(self, frame_infos, output_texts, conversation):
+        return [
+            {"video_path": "sample.mp4", "frame_idx": f["frame_idx"], "output_text": [t]}
+            for f, t in zip(frame_infos, output_texts)
+        ]
+
+
+def test_run_video_pipeline(tmp_path):
+    model = FakeModel(ResultsStore(tmp_path / "results.jsonl"))
+    ledger = CompletionLedger(tmp_path / "ledger.jsonl", "fake", "prompt")
+
+    frame_groups = (
+        (batch, [True] * len(batch))
+        for batch in iter_batches((make_frame_info(i) for i in range(10)), 3)
+    )
+
+    num_frames = run_video_pipeline(
+        model, frame_groups, ledger, "video", preprocess_workers=2, queue_size=2
+    )
+
+    assert num_frames == 10
+    assert model.generated == list(range(10))
+    assert model.results_store.frame_indices() == list(range(10))
+    assert ledger.done_frames("video") == set(range(10))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_qwen2_vl.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 1:12:08 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import numpy as np
+import pytest
+import torch
+
+from LLM.hugging_face.qwen2_vl import Qwen2VL, iter_batches
+from utils.response_cache import ResponseCache
+from tests.conftest import make_frame_info
+
+
+@pytest.fixture
+def qwen2_vl(tiny_qwen2_vl, tmp_path):
+    model, processor = tiny_qwen2_vl
+    return Qwen2VL(
+        output_path=tmp_path / "image_info",
+        prompt="describe this image",
+        batch_size=4,
+        max_new_tokens=4,
+        model=model,
+        processor=processor,
+        # 使用小模型 processor 自带的上下限
+        min_pixels=None,
+        max_pixels=None,
+    )
+
+
+def test_iter_batches():
+    assert list(iter_batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_batch_call_matches_single_call(qwen2_vl, tmp_path):
+    frame_infos = [make_frame_info(i) for i in range(5)]
+
+    batch_res = qwen2_vl.batch_call(frame_infos)
+    single_res = [qwen2_vl(frame_info) for frame_info in frame_infos]
+
+    assert [r["frame_idx"] for r in batch_res] == list(range(5))
+    assert [r["output_text"] for r in batch_res] == [r["output_text"] for r in single_res]
+    assert len(qwen2_vl.results_store) == 5
+
+
+def test_batch_call_numpy_frames(qwen2_vl):
+    frame_infos = [make_frame_info(i) for i in range(3)]
+    # the video loader yields RGB arrays, the processor takes them without PIL
+    array_infos = [{**f, "image": np.array(f["image"])} for f in frame_infos]
+
+    assert [r["output_text"] for r in qwen2_vl.batch_call(array_infos)] == [
+        r["output_text"] for r in qwen2_vl.batch_call(frame_infos)
+    ]
+
+
+def test_batch_call_shrinks_on_oom(qwen2_vl, monkeypatch):
+    generate = qwen2_vl.model.generate
+    batch_sizes = []
+
+    def fake_generate(**inputs):
+        batch_sizes.append(len(inputs["input_ids"]))
+        if len(inputs["input_ids"]) > 1:
+            raise torch.cuda.OutOfMemoryError("CUDA out of memory.")
+        return generate(**inputs)
+
+    monkeypatch.setattr(qwen2_vl.model, "generate", fake_generate)
+
+    res = qwen2_vl.batch_call([make_frame_info(i) for i in range(4)])
+
+    assert len(res) == 4
+    assert qwen2_vl.batch_size == 1
+    # 4 -> 2 -> 1, the rest of the frames run at the shrunk size, no retry at 2
+    assert batch_sizes == [4, 2, 1, 1, 1, 1]
+
+
+def test_preprocess_reuses_prompt_tokens(qwen2_vl):
+    conversation = qwen2_vl.build_conversation()
+    images = [make_frame_info(i)["image"] for i in range(3)]
+    images.append(make_frame_info(3, size=(112, 112))["image"])
+
+    inputs = qwen2_vl.preprocess(conversation, images, "cpu")
+
+    text_prompt = qwen2_vl.get_text_prompt(conversation)
+    expected = qwen2_vl.processor(
+        text=[text_prompt] * 4, images=images, padding=True, return_tensors="pt"
+    )
+
+    assert set(inputs.keys()) == set(expected.keys())
+    for key in expected:
+        assert torch.equal(inputs[key], expected[key]), key
+
+    # one tokenization per image resolution
+    assert len(qwen2_vl._token_cache) == 2
+
+
+def test_response_cache_keyed_by_settings(qwen2_vl, monkeypatch):
+    qwen2_vl.response_cache = ResponseCache()
+    frame_infos = [make_frame_info(i) for i in range(2)]
+
+    qwen2_vl.batch_call(frame_infos)
+    qwen2_vl.batch_call(frame_infos)
+    assert qwen2_vl.response_cache.stats["hits"] == 2
+
+    # 其他的生成设置不复用缓存的回答
+    image = frame_infos[0]["image"]
+    for name, value in [("structured", True), ("max_new_tokens", 2), ("max_pixels", 64 * 28 * 28)]:
+        with monkeypatch.context() as m:
+            m.setattr(qwen2_vl, name, value)
+            assert qwen2_vl.response_cache.get(image, qwen2_vl.cache_key) is None
+    assert qwen2_vl.response_cache.get(image, qwen2_vl.cache_key) is not None
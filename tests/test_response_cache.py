@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_response_cache.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 5:36:40 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import numpy as np
+
+from utils.response_cache import ResponseCache, dhash, hamming
+
+
+def gradient(flip=False, noise=0):
+    # horizontal gradient, different structure when flipped
+    row = np.linspace(0, 255, 64)
+    frame = np.tile(row[::-1] if flip else row, (48, 1))
+    frame = frame + np.random.default_rng(0).normal(0, noise, frame.shape)
+    return np.stack([frame.clip(0, 255).astype(np.uint8)] * 3, axis=-1)
+
+
+def test_dhash():
+    assert dhash(gradient()) == dhash(gradient())
+    assert hamming(dhash(gradient()), dhash(gradient(noise=3))) <= 4
+    assert hamming(dhash(gradient()), dhash(gradient(flip=True))) > 32
+
+
+def test_response_cache_threshold():
+    exact = ResponseCache(threshold=0)
+    exact.put(gradient(), "prompt", "heat")
+
+    assert exact.get(gradient(), "prompt") == "heat"
+    assert exact.get(gradient(), "other prompt") is None
+    assert exact.get(gradient(flip=True), "prompt") is None
+    assert exact.stats["hits"] == 1 and exact.stats["misses"] == 2
+
+    near = ResponseCache(threshold=8)
+    near.put(gradient(), "prompt", "heat")
+    assert near.get(gradient(noise=3), "prompt") == "heat"
+
+
+def test_response_cache_lru():
+    cache = ResponseCache(max_size=1)
+    cache.put(gradient(), "prompt", "heat")
+    cache.put(gradient(flip=True), "prompt", "cold")
+
+    assert len(cache) == 1
+    assert cache.get(gradient(), "prompt") is None
+
+
+def test_response_cache_resolve_and_persist(tmp_path):
+    cache = ResponseCache(threshold=4, path=tmp_path / "cache.json")
+    calls = []
+
+    def generate(images):
+        calls.append(len(images))
+        return [f"answer {len(calls)}.{i}" for i in range(len(images))]
+
+    images = [gradient(), gradient(noise=2), gradient(flip=True)]
+    responses = cache.resolve(images, "prompt", generate)
+
+    # the near duplicate in the same batch shares the first answer
+    assert calls == [2]
+    assert responses == ["answer 1.0", "answer 1.0", "answer 1.1"]
+
+    cache.save()
+    cache = ResponseCache(threshold=4, path=tmp_path / "cache.json")
+    assert cache.resolve(images[::-1], "prompt", generate) == responses[::-1]
+    assert calls == [2]
+    assert cache.stats["hit_rate"] == 1.0
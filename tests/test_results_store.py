@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_results_store.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 3:41:50 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import json
+
+import pytest
+
+from utils.results_store import ResultsStore
+
+
+def make_record(frame_idx, video_path="a.mp4", source="heat"):
+    return {
+        "video_path": video_path,
+        "frame_idx": frame_idx,
+        "second": frame_idx // 10,
+        "ms": frame_idx * 100,
+        "conversation": [],
+        "output_text": [f'{{"source": "{source}", "location": "center", "proportion": 0.{frame_idx}}}'],
+    }
+
+
+def test_results_store_append_and_get(tmp_path):
+    path = tmp_path / "results.jsonl"
+
+    with ResultsStore(path, flush_every=4) as store:
+        for i in [2, 0, 1]:
+            store.append(make_record(i))
+
+        # still buffered, get flushes first
+        assert not path.exists()
+        assert store.get(1)["ms"] == 100
+
+        store.append(make_record(1, source="cold"))
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 4
+
+    # reopen, the index is rebuilt and the latest record wins
+    store = ResultsStore(path)
+    assert len(store) == 3
+    assert store.frame_indices() == [0, 1, 2]
+    assert "cold" in store.get(1)["output_text"][0]
+
+
+def test_results_store_drops_incomplete_line(tmp_path):
+    path = tmp_path / "results.jsonl"
+    with ResultsStore(path) as store:
+        store.append(make_record(0))
+
+    with open(path, "a") as f:
+        f.write('{"frame_idx": 1, "vid')
+
+    size = path.stat().st_size
+    store = ResultsStore(path)
+    assert store.frame_indices() == [0]
+    # 只读时不改文件，第一次写入时才截掉
+    assert path.stat().st_size == size and list(store.records())
+
+    store.append(make_record(1))
+    store.close()
+    assert ResultsStore(path).frame_indices() == [0, 1]
+
+
+def test_results_store_multiple_videos(tmp_path):
+    with ResultsStore(tmp_path / "results.jsonl") as store:
+        store.extend([make_record(0, "a.mp4"), make_record(0, "b.mp4")])
+
+        with pytest.raises(ValueError):
+            store.get(0)
+
+        assert store.get(0, video_path="b.mp4")["video_path"] == "b.mp4"
+
+
+def test_results_store_export(tmp_path):
+    with ResultsStore(tmp_path / "results.jsonl") as store:
+        store.extend([make_record(1), make_record(0)])
+
+        store.export_json(tmp_path / "a.json")
+        store.export_gui_json(tmp_path / "gui" / "a.json")
+
+    assert [r["frame_idx"] for r in json.loads((tmp_path / "a.json").read_text())] == [0, 1]
+    assert json.loads((tmp_path / "gui" / "a.json").read_text())[1] == {
+        "frame_idx": 1,
+        "second": 0,
+        "ms": 100,
+        "source": "heat",
+        "proportion": 0.1,
+    }
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_scene_select.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 6:25:31 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import numpy as np
+
+from utils.scene_select import SceneChangeSelector
+
+
+def make_frames(levels, fps=10):
+    return [
+        {
+            "video_path": "a.mp4",
+            "frame_idx": i,
+            "current_ms": int(i * 1000 / fps),
+            "second": int(i / fps),
+            "image": np.full((24, 32, 3), level, dtype=np.uint8),
+        }
+        for i, level in enumerate(levels)
+    ]
+
+
+def test_selector_change_and_keep_alive():
+    # static, a cut at frame 5, then static for longer than the keep alive
+    frames = make_frames([0] * 5 + [200] * 20)
+    selector = SceneChangeSelector(threshold=0.1, keep_alive=1.0)
+
+    flags = [selector.is_selected(f) for f in frames]
+
+    assert [i for i, flag in enumerate(flags) if flag] == [0, 5, 15]
+    assert (selector.selected_count, selector.total_count) == (3, 25)
+
+
+def test_selector_batches_and_fill():
+    frames = make_frames([0] * 3 + [200] * 3 + [100] * 2)
+    selector = SceneChangeSelector(threshold=0.1, keep_alive=10)
+
+    records = []
+    for group, flags in selector.iter_batches(iter(frames), batch_size=2):
+        # the frames not selected do not keep their image
+        assert all(("image" in f) == flag for f, flag in zip(group, flags))
+
+        selected = [{"frame_idx": f["frame_idx"], "output_text": [str(f["frame_idx"])]}
+                    for f, flag in zip(group, flags) if flag]
+        records += selected + selector.fill(group, flags, selected)
+
+    records = sorted(records, key=lambda r: r["frame_idx"])
+
+    # every frame_idx has a record, aligned with the video
+    assert [r["frame_idx"] for r in records] == list(range(8))
+    assert [r["output_text"][0] for r in records] == ["0"] * 3 + ["3"] * 3 + ["6"] * 2
+    assert records[7]["inherited_from"] == 6
+    assert records[7]["ms"] == 700
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_server.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 11:58:40 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import asyncio
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+
+import omegaconf
+import pytest
+
+from LLM.server import (
+    BadRequest,
+    InferenceServer,
+    chat_completion,
+    decode_image,
+    encode_image,
+    load_backend,
+)
+from tests.conftest import make_frame_info
+
+
+class StubBackend:
+    """(images, prompt) -> texts, records the size of each call."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, images, prompt):
+        self.calls.append(len(images))
+        time.sleep(0.05)
+        return [
+            f'{{"source": "heat", "proportion": 0.5, "location": "{prompt}:{image.size[0]}"}}'
+            for image in images
+        ]
+
+
+@pytest.fixture
+def server():
+    backend = StubBackend()
+    srv = InferenceServer(
+        backend, default_prompt="describe", port=0, max_batch_size=4, max_wait_ms=100
+    )
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(srv.start(), loop).result()
+
+    yield srv, backend, f"http://127.0.0.1:{srv.port}"
+
+    asyncio.run_coroutine_threadsafe(srv.stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+def test_chat_completion_batches_requests(server):
+    srv, backend, url = server
+    images = [make_frame_info(i, size=(56, 80 + i))["image"] for i in range(8)]
+
+    with ThreadPoolExecutor(8) as pool:
+        responses = list(pool.map(lambda image: chat_completion(url, image), images))
+
+    for i, response in enumerate(responses):
+        assert response["object"] == "chat.completion"
+        content = json.loads(response["choices"][0]["message"]["content"])
+        assert content["location"] == f"describe:{80 + i}"
+        assert response["analysis"]["source"] == "heat"
+
+    # the concurrent requests share the inference calls
+    assert sum(backend.calls) == 8
+    assert max(backend.calls) > 1
+    assert max(backend.calls) <= 4
+
+
+def test_prompts_are_not_mixed(server):
+    srv, backend, url = server
+    image = make_frame_info(0)["image"]
+
+    with ThreadPoolExecutor(4) as pool:
+        responses = list(pool.map(lambda p: chat_completion(url, image, p), ["a", "b", "a", "b"]))
+
+    locations = [json.loads(r["choices"][0]["message"]["content"])["location"] for r in responses]
+    assert locations == ["a:84", "b:84", "a:84", "b:84"]
+
+
+def test_bad_requests(server):
+    srv, backend, url = server
+
+    request = urllib.request.Request(
+        f"{url}/v1/chat/completions",
+        data=json.dumps({"messages": [{"role": "user", "content": "no image"}]}).encode(),
+        method="POST",
+    )
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(request)
+    assert e.value.code == 400
+
+    with urllib.request.urlopen(f"{url}/v1/models") as response:
+        assert json.loads(response.read())["data"][0]["id"] == "qwen2-vl"
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(f"{url}/unknown")
+    assert e.value.code == 404
+
+
+
+def test_decode_image_only_allows_data_urls_and_image_dir(tmp_path):
+    image = make_frame_info(0)["image"]
+    assert decode_image(encode_image(image)).size == image.size
+
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    image.save(image_dir / "a.png")
+    (image_dir / "not_image.png").write_text("not an image")
+    (tmp_path / "secret.png").write_text("outside")
+
+    # 默认只接受 data url
+    with pytest.raises(BadRequest):
+        decode_image(str(image_dir / "a.png"))
+
+    assert decode_image(f"file://{image_dir / 'a.png'}", image_dir).size == image.size
+    assert decode_image("a.png", image_dir).size == image.size
+
+    # 目录外的文件和不存在的文件给同样的回答
+    for url in [str(tmp_path / "secret.png"), "../secret.png", "missing.png"]:
+        with pytest.raises(BadRequest, match="not found"):
+            decode_image(url, image_dir)
+
+    with pytest.raises(BadRequest, match="decode"):
+        decode_image("not_image.png", image_dir)
+
+
+@pytest.mark.parametrize(
+    "backend, version",
+    [
+        ("hf", "Qwen/Qwen2.5-VL-7B-Instruct"),
+        ("vllm", "Qwen/Qwen2.5-VL-7B-Instruct"),
+        ("deepseek", "deepseek-ai/deepseek-vl2-tiny"),
+    ],
+)
+def test_load_backend_version(backend, version, tmp_path, monkeypatch):
+    cfg = omegaconf.OmegaConf.load(Path(__file__).parents[1] / "configs" / "qwen2.yaml")
+    cfg.output_path = str(tmp_path)
+    cfg.server.backend = backend
+    versions = []
+
+    def fake_backend(*args, **kwargs):
+        versions.append(kwargs["version"])
+
+    monkeypatch.setattr(
+        "LLM.hugging_face.qwen2_vl.build_model",
+        lambda cfg, *args: fake_backend(version=cfg.version.model),
+    )
+    monkeypatch.setattr("LLM.vllm.qwen2_vl.Qwen2VL", fake_backend)
+    # deepseek_vl2 的依赖不一定装了
+    monkeypatch.setitem(
+        sys.modules, "LLM.hugging_face.deepseek_vl2", SimpleNamespace(DeepSeek=fake_backend)
+    )
+
+    load_backend(cfg)
+
+    assert versions == [version]
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_sharding.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 10:50:17 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import json
+import os
+import shutil
+
+import cv2
+import numpy as np
+from omegaconf import OmegaConf
+
+from utils.results_store import ResultsStore
+from utils.sharding import assign_shards, merge_results_stores, plan_shards, run_sharded
+
+
+def test_plan_shards_splits_long_videos():
+    shards = plan_shards(
+        ["b.mp4", "a.mp4"], max_frames=10, frame_counts={"a.mp4": 25, "b.mp4": 8}
+    )
+
+    assert [(s["video_path"], s["start"], s["end"]) for s in shards] == [
+        ("a.mp4", 0, 10),
+        ("a.mp4", 10, 20),
+        ("a.mp4", 20, 25),
+        ("b.mp4", 0, 8),
+    ]
+
+
+def test_assign_shards_is_balanced_and_deterministic():
+    shards = [{"video_path": str(i), "num_frames": n} for i, n in enumerate([9, 7, 5, 4, 3])]
+
+    assigned = assign_shards(shards, 2)
+
+    assert assigned == assign_shards(list(shards), 2)
+    assert [[s["video_path"] for s in w] for w in assigned] == [["0", "3"], ["1", "2", "4"]]
+    assert sorted(s["video_path"] for w in assigned for s in w) == ["0", "1", "2", "3", "4"]
+
+
+def visible_devices_worker(worker_id, shards, reporter):
+    reporter.shard_done()
+    return os.getpid(), os.environ.get("CUDA_VISIBLE_DEVICES")
+
+
+def test_run_sharded_pins_devices():
+    shards = [{"video_path": str(i), "num_frames": 1} for i in range(3)]
+
+    results = run_sharded(visible_devices_worker, shards, 3, devices=[0, 1])
+
+    # 每个 worker 在自己的进程里，卡在启动时指定
+    assert [device for _, device in results] == ["0", "1", "0"]
+    assert len({pid for pid, _ in results}) == 3
+
+
+def test_merge_results_stores(tmp_path):
+    for worker, frames in enumerate([[0, 1], [2, 3]]):
+        with ResultsStore(tmp_path / f"results.worker{worker}.jsonl") as store:
+            store.extend({"video_path": "a.mp4", "frame_idx": i} for i in frames)
+
+    merged = merge_results_stores(
+        sorted(tmp_path.glob("results.worker*.jsonl")), tmp_path / "results.jsonl"
+    )
+
+    assert merged.frame_indices() == [0, 1, 2, 3]
+    assert ResultsStore(tmp_path / "results.jsonl").frame_indices() == [0, 1, 2, 3]
+
+
+def test_run_sharded_videos(tiny_qwen2_vl, sample_video, tmp_path):
+    from LLM.hugging_face.qwen2_vl import run_sharded_videos
+
+    video_path = tmp_path / "videos"
+    video_path.mkdir()
+    shutil.copy(sample_video, video_path / "a.mp4")
+
+    # the ledger is keyed by the content hash, so the second video must differ
+    writer = cv2.VideoWriter(
+        str(video_path / "b.mp4"), cv2.VideoWriter_fourcc(*"mp4v"), 10.0, (64, 48)
+    )
+    for i in range(25):
+        writer.write(np.full((48, 64, 3), 250 - i * 10, dtype=np.uint8))
+    writer.release()
+
+    cfg = OmegaConf.load("configs/qwen2.yaml")
+    cfg.hydra = None
+    cfg.output_path = str(tmp_path / "out")
+    cfg.video_path = str(video_path)
+    cfg.assets_path = str(tmp_path / "assets")
+    cfg.video.stride = 5
+    cfg.video.save_frames = False
+    cfg.infer.max_new_tokens = 2
+    cfg.infer.structured = False
+    cfg.cache.enable = False
+    cfg.shard.num_workers = 2
+    cfg.shard.max_frames = 10
+    cfg.model.min_pixels = 4 * 28 * 28
+    cfg.model.max_pixels = 16 * 28 * 28
+
+    model, processor = tiny_qwen2_vl
+    merged = run_sharded_videos(cfg, model=model, processor=processor)
+
+    # 25 frames with stride 5, split into 3 frame ranges per video
+    for path in merged:
+        assert ResultsStore(path).frame_indices() == [0, 5, 10, 15, 20]
+
+    with open(tmp_path / "assets" / "a.json") as f:
+        assert [r["frame_idx"] for r in json.load(f)] == [0, 5, 10, 15, 20]
+
+    workers = sorted(p.name for p in (tmp_path / "out").glob("ledger.worker*.jsonl"))
+    assert workers == ["ledger.worker0.jsonl", "ledger.worker1.jsonl"]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_structured_output.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 7:40:21 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import json
+
+import pytest
+
+from LLM.hugging_face.qwen2_vl import Qwen2VL
+from utils.structured_output import (
+    SOURCES,
+    JSONTemplateConstraint,
+    analysis_fields,
+    parse_analysis,
+)
+from tests.conftest import make_frame_info
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('{"source": "heat", "proportion": 0.25, "location": "center"}', ("heat", 0.25, "center")),
+        ('1. yes\n{"source": "Cold source", "proportion": "40%", "location": "top"}', ("cold", 0.4, "top")),
+        ("no json here", ("none", 0.0, "none")),
+        ('{"source": "heat", broken}', ("none", 0.0, "none")),
+    ],
+)
+def test_parse_analysis(text, expected):
+    res = parse_analysis([text])
+    assert (res["source"], res["proportion"], res["location"]) == expected
+
+
+def test_analysis_fields_prefers_parsed_fields():
+    record = {
+        "output_text": ['{"source": "cold", "proportion": 0.1, "location": "left"}'],
+        "source": "heat",
+        "proportion": 0.5,
+        "location": "right",
+    }
+    assert analysis_fields(record) == {"source": "heat", "proportion": 0.5, "location": "right"}
+
+    del record["source"]
+    assert analysis_fields(record)["source"] == "cold"
+
+
+def test_constraint_follows_template(tiny_qwen2_vl):
+    tokenizer = tiny_qwen2_vl[1].tokenizer
+    constraint = JSONTemplateConstraint(tokenizer)
+
+    def allowed_text(text):
+        return {tokenizer.decode([i]) for i in constraint.allowed_tokens(text)}
+
+    assert allowed_text("") == {"{"}
+    assert allowed_text('{"source": "') == {"h", "c", "n"}
+    assert allowed_text('{"source": "he') == {"a"}
+    assert allowed_text('{"source": "heat') == {'"'}
+    assert allowed_text('{"source": "heat", "proportion": 0.') == set("0123456789")
+    assert "," in allowed_text('{"source": "heat", "proportion": 0.5')
+    assert '"' not in allowed_text('{"source": "heat", "proportion": 0.5, "location": "')
+
+    text = '{"source": "heat", "proportion": 0.5, "location": "top"}'
+    assert constraint.allowed_tokens(text) == [tokenizer.eos_token_id]
+
+
+def test_structured_generate(tiny_qwen2_vl, tmp_path):
+    model, processor = tiny_qwen2_vl
+    qwen2_vl = Qwen2VL(
+        output_path=tmp_path / "image_info",
+        prompt="describe this image",
+        batch_size=2,
+        max_new_tokens=128,
+        model=model,
+        processor=processor,
+        structured=True,
+    )
+
+    res = qwen2_vl.batch_call([make_frame_info(i) for i in range(3)])
+
+    for record in res:
+        # the random model can only produce the JSON object
+        answer = json.loads(record["output_text"][0])
+        assert set(answer) == {"source", "proportion", "location"}
+        assert answer["source"] in SOURCES
+        assert 0 <= answer["proportion"] <= 1
+        assert record["source"] == answer["source"]
+        assert record["proportion"] == answer["proportion"]
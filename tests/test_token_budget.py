@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_token_budget.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 4:18:52 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import json
+
+import cv2
+import numpy as np
+import pytest
+from omegaconf import OmegaConf
+from PIL import Image
+
+from utils.token_budget import (
+    analysis_agreement,
+    decode_size,
+    pixel_bounds,
+    select_budget,
+    visual_tokens,
+)
+from utils.video_loader import iter_video_frames_decord
+
+TOKEN = 28 * 28
+
+
+def make_video(video_path, size=(160, 120), num_frames=10):
+    writer = cv2.VideoWriter(str(video_path), cv2.VideoWriter_fourcc(*"mp4v"), 10.0, size)
+    for i in range(num_frames):
+        writer.write(np.full((size[1], size[0], 3), i * 20, dtype=np.uint8))
+    writer.release()
+    return video_path
+
+
+def test_pixel_bounds():
+    assert pixel_bounds(256 * TOKEN, 1280 * TOKEN) == (256 * TOKEN, 1280 * TOKEN)
+    # 预算比 min_pixels 小时，min_pixels 跟着降低
+    assert pixel_bounds(256 * TOKEN, 1280 * TOKEN, 64) == (64 * TOKEN, 64 * TOKEN)
+
+    with pytest.raises(ValueError):
+        pixel_bounds(256 * TOKEN, 1280 * TOKEN, 0)
+
+
+def test_decode_size_is_stable():
+    for tokens in (16, 64, 256, 1280):
+        height, width = decode_size(1080, 1920, 4 * TOKEN, tokens * TOKEN)
+
+        assert height % 28 == 0 and width % 28 == 0
+        assert height * width <= tokens * TOKEN
+        # 按这个尺寸解码的帧不会再被缩放
+        assert decode_size(height, width, 4 * TOKEN, tokens * TOKEN) == (height, width)
+        assert visual_tokens(1080, 1920, 4 * TOKEN, tokens * TOKEN) == (height // 28) * (width // 28)
+
+
+def test_select_budget():
+    measured_tokens = []
+
+    def measure(tokens):
+        measured_tokens.append(tokens)
+        return tokens * 0.01
+
+    selected, measured = select_budget(measure, [16, 4, 8], target_seconds=0.1)
+
+    assert selected == 8
+    assert measured_tokens == [4, 8, 16]
+    assert select_budget(measure, [4, 8, 16], target_fps=20)[0] == 4
+    # 最小的预算也超出目标时用最小的
+    assert select_budget(measure, [4, 8, 16], target_seconds=0.01)[0] == 4
+
+    with pytest.raises(ValueError):
+        select_budget(measure, [4], target_seconds=0.1, target_fps=10)
+
+
+def test_analysis_agreement():
+    reference = [
+        '{"source": "heat", "proportion": 0.5, "location": "left"}',
+        '{"source": "cold", "proportion": 0.2, "location": "left"}',
+    ]
+    outputs = [
+        '{"source": "heat", "proportion": 0.3, "location": "left"}',
+        '{"source": "none", "proportion": 0.2, "location": "left"}',
+    ]
+
+    res = analysis_agreement(outputs, reference)
+
+    assert res["source_accuracy"] == 0.5
+    assert res["proportion_mae"] == pytest.approx(0.1)
+
+
+def test_loader_decodes_at_size(tmp_path):
+    video_path = make_video(tmp_path / "clip.mp4")
+
+    frames = list(iter_video_frames_decord(video_path, size_fn=lambda h, w: (56, 84)))
+
+    assert len(frames) == 10
+    assert frames[0]["image"].shape == (56, 84, 3)
+
+
+def test_frame_size_matches_processor(tiny_qwen2_vl, tmp_path):
+    from LLM.hugging_face.qwen2_vl import Qwen2VL
+
+    model, processor = tiny_qwen2_vl
+    qwen2_vl = Qwen2VL(
+        tmp_path,
+        "describe this image",
+        model=model,
+        processor=processor,
+        min_pixels=4 * TOKEN,
+        max_pixels=12 * TOKEN,
+    )
+
+    height, width = qwen2_vl.frame_size(120, 160)
+    inputs = qwen2_vl.preprocess(
+        qwen2_vl.build_conversation(), [Image.new("RGB", (width, height))], "cpu"
+    )
+    _, grid_h, grid_w = inputs["image_grid_thw"][0].tolist()
+
+    assert (grid_h * 14, grid_w * 14) == (height, width)
+    assert grid_h * grid_w // 4 == visual_tokens(120, 160, 4 * TOKEN, 12 * TOKEN) <= 12
+
+
+def test_run_budget_benchmark(tiny_qwen2_vl, tmp_path):
+    from LLM.hugging_face.qwen2_vl import build_model, run_budget_benchmark
+
+    cfg = OmegaConf.load("configs/qwen2.yaml")
+    cfg.hydra = None
+    cfg.output_path = str(tmp_path / "out")
+    cfg.infer.max_new_tokens = 2
+    cfg.infer.structured = False
+    cfg.model.min_pixels = 4 * TOKEN
+    cfg.model.max_pixels = 16 * TOKEN
+    cfg.budget.clip = str(make_video(tmp_path / "clip.mp4"))
+    cfg.budget.candidates = [16, 4, 8]
+    cfg.budget.probe_frames = 3
+
+    model, processor = tiny_qwen2_vl
+    rows = run_budget_benchmark(
+        build_model(cfg, tmp_path / "out", model=model, processor=processor), cfg
+    )
+
+    assert [r["max_visual_tokens"] for r in rows] == [4, 8, 16]
+    assert all(r["visual_tokens"] <= r["max_visual_tokens"] for r in rows)
+    assert rows[0]["visual_tokens"] < rows[-1]["visual_tokens"]
+    assert all(r["frames"] == 3 and r["seconds_per_frame"] > 0 for r in rows)
+    # 最大的预算就是参照
+    assert rows[-1]["source_accuracy"] == 1.0
+
+    saved = json.loads((tmp_path / "out" / "budget_benchmark.json").read_text())
+    assert saved["rows"] == rows
+
+
+def test_hf_default_pixel_bounds(tiny_qwen2_vl, tmp_path):
+    from LLM.hugging_face.qwen2_vl import Qwen2VL
+
+    model, processor = tiny_qwen2_vl
+    qwen2_vl = Qwen2VL(tmp_path, "describe this image", model=model, processor=processor)
+
+    assert (qwen2_vl.min_pixels, qwen2_vl.max_pixels) == (256 * TOKEN, 1280 * TOKEN)
+    # 和 vllm 版的默认值一致
+    assert qwen2_vl.frame_size(120, 160) == decode_size(120, 160, 256 * TOKEN, 1280 * TOKEN)
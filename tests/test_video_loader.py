@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_video_loader.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 10:30:12 am
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+import numpy as np
+import pytest
+
+from utils.video_loader import (
+    sample_frame_indices,
+    iter_video_frames_decord,
+    split_video_and_extract_frames_decord,
+    target_size,
+)
+
+
+def test_iter_video_frames_decord(sample_video, tmp_path):
+    frames = iter_video_frames_decord(sample_video, tmp_path / "frames", prefetch=2)
+
+    first = next(frames)
+    assert first["frame_idx"] == 0
+    assert first["image"].shape == (48, 64, 3)
+
+    rest = list(frames)
+    assert [f["frame_idx"] for f in rest] == list(range(1, 25))
+    assert rest[-1]["current_ms"] == 2400
+    assert len(list((tmp_path / "frames").iterdir())) == 25
+
+
+def test_iter_video_frames_decord_early_stop(sample_video):
+    frames = iter_video_frames_decord(sample_video, prefetch=1)
+
+    assert next(frames)["frame_idx"] == 0
+    # closing the generator must stop the decode thread
+    frames.close()
+
+
+def test_split_video_and_extract_frames_decord(sample_video, tmp_path):
+    frame_list = split_video_and_extract_frames_decord(sample_video, tmp_path / "frames")
+
+    assert len(frame_list) == 25
+    assert frame_list[10]["second"] == 1
+
+
+def test_sample_frame_indices():
+    assert sample_frame_indices(10, 10.0) == list(range(10))
+    assert sample_frame_indices(90, 30.0, fps=2) == [0, 15, 30, 45, 60, 75]
+    assert sample_frame_indices(10, 10.0, stride=4) == [0, 4, 8]
+    assert sample_frame_indices(100, 10.0, timestamps=[0.0, 1.04, 50]) == [0, 10, 99]
+    # target fps above the native fps keeps every frame
+    assert sample_frame_indices(5, 10.0, fps=20) == list(range(5))
+
+    with pytest.raises(ValueError):
+        sample_frame_indices(10, 10.0, fps=1, stride=2)
+
+
+def test_iter_video_frames_decord_fps(sample_video):
+    frames = list(iter_video_frames_decord(sample_video, fps=2, batch_size=2))
+
+    assert [f["frame_idx"] for f in frames] == [0, 5, 10, 15, 20]
+    assert [f["second"] for f in frames] == [0, 0, 1, 1, 2]
+    # the gray level follows the sampled index, not the position in the batch
+    assert np.asarray(frames[2]["image"]).mean() == pytest.approx(100, abs=5)
+
+
+def test_target_size():
+    assert target_size(960, 1920) == (960, 1920)
+    assert target_size(960, 1920, target_width=640, target_height=320) == (320, 640)
+    assert target_size(960, 1920, target_width=640) == (320, 640)
+    assert target_size(960, 1920, target_height=480) == (480, 960)
+
+    height, width = target_size(960, 1920, max_pixels=200_000)
+    assert height * width <= 200_000
+    assert width / height == pytest.approx(2, rel=0.01)
+    # max_pixels 只缩小不放大
+    assert target_size(48, 64, max_pixels=200_000) == (48, 64)
+
+
+def test_iter_video_frames_decord_size(sample_video):
+    frames = list(iter_video_frames_decord(sample_video, stride=10, width=32))
+
+    assert [f["image"].shape for f in frames] == [(24, 32, 3)] * 3
+    assert frames[0]["image"].dtype == np.uint8
+
+    frames = split_video_and_extract_frames_decord(
+        sample_video, None, stride=10, max_pixels=48 * 64 // 4
+    )
+    assert frames[0]["image"].shape == (24, 32, 3)
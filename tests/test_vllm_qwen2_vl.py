@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+'''
+File: /Users/chenkaixu/Temp_Feedback/tests/test_vllm_qwen2_vl.py
+Project: /Users/chenkaixu/Temp_Feedback/tests
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 2:01:44 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+'''
+
+from types import SimpleNamespace
+
+from LLM.vllm.qwen2_vl import Qwen2VL, build_prompt
+from utils.response_cache import ResponseCache
+from tests.conftest import make_frame_info
+
+
+class StubLLM:
+    """same generate interface as vllm.LLM, echoes the image size."""
+
+    def __init__(self):
+        self.calls = []
+
+    def generate(self, inputs, sampling_params=None):
+        self.calls.append(inputs)
+        return [
+            SimpleNamespace(
+                outputs=[
+                    SimpleNamespace(text=f"{i}:{inp['multi_modal_data']['image'].size}")
+                ]
+            )
+            for i, inp in enumerate(inputs)
+        ]
+
+
+def test_build_prompt():
+    prompt = build_prompt("Describe this image.")
+
+    assert "<|vision_start|><|image_pad|><|vision_end|>Describe this image." in prompt
+    assert prompt.endswith("<|im_start|>assistant\n")
+
+    # the instruction comes first so it is a shared prefix of every request
+    prompt = build_prompt("Describe this image.", text_first=True)
+    assert "user\nDescribe this image.<|vision_start|>" in prompt
+    assert build_prompt("Describe this image.", text_first=True) is prompt
+
+
+def test_batch_call_one_generate(tmp_path):
+    llm = StubLLM()
+    qwen2_vl = Qwen2VL(tmp_path, "describe this image", llm=llm, sampling_params={})
+
+    frame_infos = [make_frame_info(i, video_path="a.mp4") for i in range(3)]
+    frame_infos += [make_frame_info(i, video_path="b.mp4") for i in range(2)]
+
+    res = qwen2_vl.batch_call(frame_infos)
+
+    # all the frames of both videos go into a single generate call
+    assert len(llm.calls) == 1
+    assert len(llm.calls[0]) == 5
+    assert [(r["video_path"], r["frame_idx"]) for r in res] == [
+        ("a.mp4", 0), ("a.mp4", 1), ("a.mp4", 2), ("b.mp4", 0), ("b.mp4", 1)
+    ]
+    assert res[3]["output_text"] == ["3:(84, 56)"]
+    assert len({inp["prompt"] for inp in llm.calls[0]}) == 1
+
+
+def test_batch_call_with_response_cache(tmp_path):
+    llm = StubLLM()
+    qwen2_vl = Qwen2VL(
+        tmp_path,
+        "describe this image",
+        llm=llm,
+        sampling_params={},
+        response_cache=ResponseCache(),
+    )
+
+    frame_infos = [make_frame_info(i % 2) for i in range(4)]
+    res = qwen2_vl.batch_call(frame_infos)
+    qwen2_vl.batch_call(frame_infos)
+
+    # two distinct frames are generated once, everything else is a cache hit
+    assert [len(inputs) for inputs in llm.calls] == [2]
+    assert [r["output_text"] for r in res] == [["0:(84, 56)"], ["1:(84, 56)"]] * 2
+    assert qwen2_vl.response_cache.stats["hits"] == 6
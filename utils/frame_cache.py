@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+File: /workspace/temp_feedback/Temp_Feedback/utils/frame_cache.py
+Project: /workspace/temp_feedback/Temp_Feedback/utils
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+The memory-mapped frame cache of the decoded videos.
+The sampled frames of one video are kept as raw RGB uint8 in
+<cache_dir>/<video stem>-<sha256[:12]>/<height>x<width>/, so two videos with
+the same name do not share a cache, and the frames decoded at the model
+resolution by the loader and at the full resolution for the overlay and the
+GUI do not overwrite each other. Each size holds one or more parts, a
+<first>-<last>-<count>.npy of the frames with a .json index of the frame
+indices, the fps and the sha256 of the video, e.g. one part per shard of a
+sharded run, or the frames decoded by a resumed run. The frame loader, the
+overlay renderer and the GUI open the parts with np.load(mmap_mode="r"),
+so frame i is a view of a mapped file, without decoding the video again
+or a JPEG round trip. A part of another video content is skipped, and it
+only counts after its index is written, which is the last step of a build,
+so an interrupted build is rebuilt. A build writes the frames to a
+temporary file and moves it in place when it is done, the readers that
+still map the old file keep reading the old frames.
+
+Raw frames are large, 6MB per 1080p frame, so the cache is meant for the
+sampled frames (video.fps) at the decode size of the model.
+
+python -m utils.frame_cache <video or dir> <cache_dir> builds the caches.
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 3:40:12 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from utils.decoders import open_decoder
+from utils.ledger import file_hash
+
+logger = logging.getLogger(__name__)
+
+
+class FrameCache:
+    """the cached frames of one video at one size.
+
+    Args:
+        cache_dir (Path): root directory of the caches.
+        video_path (Path): path to the video, the hash is checked when it exists.
+        video_hash (str, optional): sha256 of the video computed by the caller, e.g. once for all the render workers. Defaults to None, hashed here.
+        size (tuple, optional): (height, width) of the frames. Defaults to None, the source size of the video.
+    """
+
+    def __init__(
+        self, cache_dir: Path, video_path: Path, video_hash: str = None, size: tuple = None
+    ):
+
+        self.video_path = Path(video_path)
+        self.cache_dir = Path(cache_dir)
+
+        # 原视频不在时无法校验，信任已经写完的缓存
+        if video_hash is None and self.video_path.exists():
+            video_hash = file_hash(self.video_path)
+        self.video_hash = video_hash
+
+        self.dir = self._find_dir()
+
+        # 视频的元数据和尺寸无关，任何一个尺寸的 part 里都有
+        self.info = next(self._iter_indexes(self.dir.glob("*/*.json")), None)
+
+        if size is None and self.info is not None:
+            size = self.info["source_size"]
+        self.size = tuple(int(x) for x in size) if size is not None else None
+
+        self._writing = None
+        self._load_parts()
+
+    def _find_dir(self):
+
+        # 同名的视频用哈希区分
+        if self.video_hash is not None:
+            return self.cache_dir / f"{self.video_path.stem}-{self.video_hash[:12]}"
+
+        # 原视频不在时，找 index 里记录的是这个视频的缓存
+        for cache_dir in sorted(self.cache_dir.glob(f"{glob.escape(self.video_path.stem)}-*")):
+            index = next(self._iter_indexes(cache_dir.glob("*/*.json")), None)
+            if index is not None and index["video_path"] == str(self.video_path):
+                return cache_dir
+
+        return self.cache_dir / self.video_path.stem
+
+    def _iter_indexes(self, index_paths):
+        """the valid indexes of the parts, the ones of another video content are skipped."""
+
+        for index_path in sorted(index_paths):
+            if not index_path.with_suffix(".npy").exists():
+                continue
+            try:
+                index = json.loads(index_path.read_text())
+            except (OSError, json.JSONDecodeError):
+                continue
+
+            if self.video_hash is not None and index.get("video_hash") != self.video_hash:
+                logger.info(f"{self.video_path.name} changed, frame cache {index_path} is invalid")
+                continue
+
+            index["path"] = index_path.with_suffix(".npy")
+            yield index
+
+    @property
+    def size_dir(self):
+        """directory of the parts of this size, None when the size is unknown."""
+
+        if self.size is None:
+            return None
+        return self.dir / f"{self.size[0]}x{self.size[1]}"
+
+    def _load_parts(self):
+
+        # frame_idx -> (part, position)，多个 part 都有的帧用前一个
+        self.parts = []
+        self._positions = {}
+        if self.size_dir is None:
+            return
+
+        for index in self._iter_indexes(self.size_dir.glob("*.json")):
+            part = len(self.parts)
+            self.parts.append({"index": index, "frames": None})
+            for pos, idx in enumerate(index["frame_indices"]):
+                self._positions.setdefault(idx, (part, pos))
+
+    @property
+    def valid(self):
+        return bool(self.parts)
+
+    @property
+    def fps(self):
+        return self.info["fps"]
+
+    @property
+    def frame_count(self):
+        """frame count of the video, not of the cache."""
+        return self.info["frame_count"]
+
+    @property
+    def source_size(self):
+        return tuple(self.info["source_size"])
+
+    @property
+    def frame_indices(self):
+        return sorted(self._positions)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, frame_idx):
+        return int(frame_idx) in self._positions
+
+    def covers(self, frame_indices: list, size: tuple = None):
+        """whether all the frame_indices are cached, at size when it is given."""
+
+        if not self.valid:
+            return False
+        if size is not None and tuple(size) != self.size:
+            return False
+        return all(int(i) in self._positions for i in frame_indices)
+
+    def _frames(self, part: int):
+        """(N, height, width, 3) read-only memmap of one part."""
+
+        part = self.parts[part]
+        if part["frames"] is None:
+            part["frames"] = np.load(part["index"]["path"], mmap_mode="r")
+        return part["frames"]
+
+    def get(self, frame_idx: int):
+        """the cached frame, a view of the mapped file."""
+
+        part, pos = self._positions[int(frame_idx)]
+        return self._frames(part)[pos]
+
+    def get_batch(self, indices: list):
+        """the cached frames of the indices, a view when they are stored next to each other in one part."""
+
+        positions = [self._positions[int(i)] for i in indices]
+        if not positions:
+            return np.empty((0, *self.size, 3), dtype=np.uint8)
+
+        part, first = positions[0]
+        if positions == [(part, pos) for pos in range(first, first + len(positions))]:
+            return self._frames(part)[first : first + len(positions)]
+
+        return np.stack([self._frames(part)[pos] for part, pos in positions])
+
+    def iter_frames(self, indices: list = None):
+        """iterate (frame_idx, frame) of the indices, all the cached frames by default."""
+
+        for frame_idx in self.frame_indices if indices is None else indices:
+            yield frame_idx, self.get(frame_idx)
+
+    def create(self, frame_indices: list, size: tuple, fps: float, frame_count: int, source_size: tuple):
+        """start a new part of the frame_indices at size, e.g. the frames decoded by one shard.
+
+        The frames are added with write, and the part is valid after finish.
+        A part of the same frames is replaced.
+        """
+
+        self.close()
+        self.size = tuple(int(x) for x in size)
+        self._load_parts()
+        self.size_dir.mkdir(parents=True, exist_ok=True)
+
+        frame_indices = [int(i) for i in frame_indices]
+        height, width = self.size
+        name = f"{frame_indices[0]}-{frame_indices[-1]}-{len(frame_indices)}"
+        # 写到临时文件，正在读旧缓存的进程不会看到写了一半的帧，
+        # 同时写同一个视频的 shard 各自用自己的临时文件
+        self._writing = {
+            "frames": np.lib.format.open_memmap(
+                self.size_dir / f"{name}.{os.getpid()}.tmp",
+                mode="w+",
+                dtype=np.uint8,
+                shape=(len(frame_indices), height, width, 3),
+            ),
+            "path": self.size_dir / f"{name}.npy",
+            "positions": {idx: pos for pos, idx in enumerate(frame_indices)},
+            "index": {
+                "video_path": str(self.video_path),
+                "video_hash": self.video_hash,
+                "fps": float(fps),
+                "frame_count": int(frame_count),
+                "source_size": [int(x) for x in source_size],
+                "size": [int(height), int(width)],
+                "frame_indices": frame_indices,
+            },
+        }
+
+    def write(self, frame_indices: list, frames):
+        """copy the decoded RGB frames into the part being created."""
+
+        positions = [self._writing["positions"][int(i)] for i in frame_indices]
+        self._writing["frames"][positions] = frames
+
+    def finish(self):
+        """flush the frames, move them in place and write the index, the part is valid from now on."""
+
+        frames = self._writing.pop("frames")
+        frames.flush()
+        frames_tmp_path = Path(frames.filename)
+        frames_path, index = self._writing["path"], self._writing["index"]
+        # 关掉 memmap 再替换
+        del frames
+        self._writing = None
+
+        # 先删掉旧的 index，替换途中的 part 不会被当成有效的缓存
+        index_path = frames_path.with_suffix(".json")
+        index_path.unlink(missing_ok=True)
+        os.replace(frames_tmp_path, frames_path)
+
+        tmp_path = index_path.with_suffix(f".{os.getpid()}.json.tmp")
+        tmp_path.write_text(json.dumps(index))
+        os.replace(tmp_path, index_path)
+
+        self.info = self.info if self.info is not None else {**index, "path": frames_path}
+        self._load_parts()
+
+        logger.info(
+            f"Frame cache of {self.video_path.name}: {len(index['frame_indices'])} frames in {frames_path}"
+        )
+
+    def close(self):
+        # 释放 memmap，写了一半的 part 没有 index，不会被使用
+        for part in self.parts:
+            part["frames"] = None
+        self._writing = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def build_frame_cache(
+    cache_dir: Path,
+    video_path: Path,
+    frame_indices: list = None,
+    size: tuple = None,
+    decoder: str = "decord",
+    num_threads: int = 0,
+    batch_size: int = 16,
+):
+    """decode the frames of the video into the cache, unless they are cached already.
+
+    Args:
+        cache_dir (Path): root directory of the caches.
+        video_path (Path): path to the video.
+        frame_indices (list, optional): the frames to cache. Defaults to None, all the frames.
+        size (tuple, optional): (height, width) to decode at. Defaults to None, the source size.
+        decoder (str, optional): decoding backend, see utils.decoders. Defaults to "decord".
+        num_threads (int, optional): decode threads. Defaults to 0.
+        batch_size (int, optional): frames per get_batch call. Defaults to 16.
+
+    Returns:
+        FrameCache: the valid cache.
+    """
+
+    cache = FrameCache(cache_dir, video_path, size=size)
+
+    if frame_indices is not None and cache.covers(frame_indices):
+        return cache
+
+    with open_decoder(video_path, decoder, num_threads=num_threads) as vr:
+        if size is not None:
+            vr.set_size(*size)
+        elif cache.size is None:
+            # 第一次缓存这个视频，原尺寸要打开视频才知道
+            cache = FrameCache(cache_dir, video_path, cache.video_hash, vr.size)
+
+        if frame_indices is None:
+            frame_indices = range(vr.frame_count)
+            if cache.covers(frame_indices):
+                return cache
+
+        frame_indices = list(frame_indices)
+        cache.create(frame_indices, vr.size, vr.fps, vr.frame_count, vr.source_size)
+
+        for start in tqdm(range(0, len(frame_indices), batch_size), desc="frame cache", leave=False):
+            batch_indices = frame_indices[start : start + batch_size]
+            cache.write(batch_indices, vr.get_batch(batch_indices))
+
+    cache.finish()
+
+    return cache
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="build the memory-mapped frame caches")
+    parser.add_argument("video_path", type=Path, help="a video or a directory of videos")
+    parser.add_argument("cache_dir", type=Path)
+    parser.add_argument("--decoder", default="decord")
+    args = parser.parse_args()
+
+    videos = sorted(args.video_path.iterdir()) if args.video_path.is_dir() else [args.video_path]
+    for video in tqdm(videos, desc="video file"):
+        build_frame_cache(args.cache_dir, video, decoder=args.decoder)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+File: /workspace/temp_feedback/Temp_Feedback/utils/frame_writer.py
+Project: /workspace/temp_feedback/Temp_Feedback/utils
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+A background writer pool to save the decoded frames.
+The encoding and file I/O run in a thread or process pool, so the decode
+thread does not wait on them.
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 11:02:17 am
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# format -> (file suffix, PIL format name)
+FRAME_FORMATS = {
+    "jpg": (".jpg", "JPEG"),
+    "png": (".png", "PNG"),
+    "webp": (".webp", "WEBP"),
+    "npy": (".npy", None),
+}
+
+
+def write_frame(frame: np.ndarray, output_path: str, frame_format: str = "jpg", quality: int = 95):
+    """encode one RGB frame and write it to disk.
+
+    Args:
+        frame (np.ndarray): RGB frame in (H, W, 3) uint8.
+        output_path (str): path of the output file.
+        frame_format (str, optional): one of jpg, png, webp and npy. Defaults to "jpg".
+        quality (int, optional): quality for jpg and webp. Defaults to 95.
+
+    Returns:
+        str: the output path.
+    """
+
+    if frame_format == "npy":
+        np.save(output_path, frame)
+        return output_path
+
+    image = Image.fromarray(frame)
+
+    if frame_format == "png":
+        # png 是无损的，quality 没有意义，用最快的压缩等级
+        image.save(output_path, format="PNG", compress_level=1)
+    else:
+        image.save(output_path, format=FRAME_FORMATS[frame_format][1], quality=quality)
+
+    return output_path
+
+
+class FrameWriter:
+    """save frames with a bounded background pool.
+
+    Args:
+        output_dir (Path): directory to save the frames, None means not save.
+        frame_format (str, optional): one of jpg, png, webp and npy. Defaults to "jpg".
+        quality (int, optional): quality for jpg and webp. Defaults to 95.
+        mode (str, optional): "thread" or "process" pool. Defaults to "thread".
+        num_workers (int, optional): pool size, None means the cpu count. Defaults to None.
+        max_queue (int, optional): max number of frames waiting to be written. Defaults to 32.
+    """
+
+    def __init__(
+        self,
+        output_dir: Path,
+        frame_format: str = "jpg",
+        quality: int = 95,
+        mode: str = "thread",
+        num_workers: int = None,
+        max_queue: int = 32,
+    ):
+
+        if frame_format not in FRAME_FORMATS:
+            raise ValueError(
+                f"Unsupported frame format: {frame_format}. Please use one of {list(FRAME_FORMATS)}."
+            )
+
+        self.output_dir = Path(output_dir) if output_dir is not None else None
+        self.frame_format = frame_format
+        self.quality = quality
+        self.suffix = FRAME_FORMATS[frame_format][0]
+
+        self.saved_count = 0
+        self._error = None
+        self._lock = threading.Lock()
+
+        # 不保存时不启动线程池
+        if self.output_dir is None:
+            self.executor = None
+            return
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        num_workers = num_workers or os.cpu_count() or 1
+        if mode == "thread":
+            self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        elif mode == "process":
+            self.executor = ProcessPoolExecutor(max_workers=num_workers)
+        else:
+            raise ValueError(f"Unsupported writer mode: {mode}. Please use thread or process.")
+
+        # 限制排队中的帧数，避免解码比写入快时内存增长
+        self._slots = threading.BoundedSemaphore(max(1, max_queue))
+
+    @property
+    def enabled(self):
+        return self.executor is not None
+
+    def _on_done(self, future):
+
+        self._slots.release()
+
+        with self._lock:
+            if future.exception() is not None:
+                if self._error is None:
+                    self._error = future.exception()
+            else:
+                self.saved_count += 1
+                logger.debug(f"保存帧: {future.result()}")
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, frame: np.ndarray, name: str):
+        """submit one frame to write, blocks when the queue is full.
+
+        Args:
+            frame (np.ndarray): RGB frame in (H, W, 3) uint8.
+            name (str): file name without suffix.
+
+        Returns:
+            str: the output path, None when the writer is disabled.
+        """
+
+        if not self.enabled:
+            return None
+
+        self._raise_error()
+
+        output_path = str(self.output_dir / f"{name}{self.suffix}")
+
+        self._slots.acquire()
+        future = self.executor.submit(
+            write_frame, frame, output_path, self.frame_format, self.quality
+        )
+        future.add_done_callback(self._on_done)
+
+        return output_path
+
+    def close(self):
+        """wait for all the pending frames, and raise the first write error."""
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
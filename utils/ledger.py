@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+File: /workspace/temp_feedback/Temp_Feedback/utils/ledger.py
+Project: /workspace/temp_feedback/Temp_Feedback/utils
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+A completion ledger to resume the inference runs.
+Each finished frame (and each finished video) is appended as one JSON line,
+keyed by (video content hash, frame_idx, model version, prompt hash), so a
+restarted run can skip the work that is already done.
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 4:20:13 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from utils.results_store import read_complete_lines
+
+logger = logging.getLogger(__name__)
+
+# (path, size, mtime) -> content hash, avoid hashing the same file twice
+_FILE_HASH_CACHE = {}
+
+
+def file_hash(path: Path, chunk_size: int = 1 << 20):
+    """sha256 of the file content.
+
+    Args:
+        path (Path): path to the file.
+        chunk_size (int, optional): read size of each chunk. Defaults to 1MB.
+
+    Returns:
+        str: hex digest.
+    """
+
+    stat = os.stat(path)
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+
+    if key not in _FILE_HASH_CACHE:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                sha.update(chunk)
+        _FILE_HASH_CACHE[key] = sha.hexdigest()
+
+    return _FILE_HASH_CACHE[key]
+
+
+def prompt_hash(prompt):
+    """sha256 of the prompt, the prompt can be a str or a dict/list."""
+
+    if not isinstance(prompt, str):
+        prompt = json.dumps(prompt, sort_keys=True, ensure_ascii=False)
+
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class CompletionLedger:
+    """append-only ledger of the finished frames and videos.
+
+    Args:
+        path (Path): path of the ledger .jsonl file, the existing entries are loaded.
+        model_version (str): model version, part of the key.
+        prompt (str): the prompt, its hash is part of the key.
+    """
+
+    def __init__(self, path: Path, model_version: str, prompt):
+
+        self.path = Path(path)
+        self.model_version = model_version
+        self.prompt_hash = prompt_hash(prompt)
+
+        # video hash -> set of finished frame_idx
+        self._frames = {}
+        self._videos = set()
+
+        if self.path.exists():
+            self._load()
+
+    def _match(self, entry: dict):
+        return (
+            entry.get("model") == self.model_version
+            and entry.get("prompt_hash") == self.prompt_hash
+        )
+
+    def _load(self):
+
+        # 异常退出时可能留下不完整的最后一行，截掉它，新的记录从新的一行开始
+        lines, _ = read_complete_lines(self.path, truncate=True)
+
+        for _, line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+            # 其他模型或 prompt 的记录不算完成
+            if not self._match(entry):
+                continue
+
+            if entry.get("frame_idx") is None:
+                self._videos.add(entry["video_hash"])
+            else:
+                self._frames.setdefault(entry["video_hash"], set()).add(
+                    int(entry["frame_idx"])
+                )
+
+    def _append(self, entries: list):
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(self.path, "a") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _entry(self, video_hash: str, frame_idx=None):
+        return {
+            "video_hash": video_hash,
+            "frame_idx": frame_idx,
+            "model": self.model_version,
+            "prompt_hash": self.prompt_hash,
+        }
+
+    def done_frames(self, video_hash: str):
+        """the finished frame_idx of the video."""
+        return set(self._frames.get(video_hash, set()))
+
+    def is_video_done(self, video_hash: str):
+        return video_hash in self._videos
+
+    def mark_frames(self, video_hash: str, frame_indices: list):
+        """mark the frames as finished, call it after their results are persisted."""
+
+        frame_indices = [int(i) for i in frame_indices]
+        self._append([self._entry(video_hash, i) for i in frame_indices])
+        self._frames.setdefault(video_hash, set()).update(frame_indices)
+
+    def mark_video(self, video_hash: str):
+        """mark the whole video as finished."""
+
+        self._append([self._entry(video_hash)])
+        self._videos.add(video_hash)
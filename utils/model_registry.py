@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+File: /workspace/temp_feedback/Temp_Feedback/utils/model_registry.py
+Project: /workspace/temp_feedback/Temp_Feedback/utils
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+A process-wide registry of the loaded models.
+A model is loaded by its loader the first time its key is asked for, and
+is shared by all the later callers, so a run over many videos loads the
+weights once. The models not used for idle_timeout seconds can be evicted
+to free the GPU memory, they are loaded again on the next use. A model
+held with lease is never evicted as idle, so the reaper cannot unload it in
+the middle of a generate call.
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 9:20:36 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+"""
+
+import contextlib
+import gc
+import logging
+import threading
+import time
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# the default registry of the process
+_REGISTRY = None
+
+
+class ModelRegistry:
+    """load each model once and share it.
+
+    Args:
+        idle_timeout (float, optional): evict the models not used for this many seconds, None means never. Defaults to None.
+    """
+
+    def __init__(self, idle_timeout: float = None):
+
+        self.idle_timeout = idle_timeout
+
+        # key -> {"value": loaded model, "last_used": monotonic time, "leases": holders}
+        self._entries = {}
+        self._lock = threading.RLock()
+
+        self.load_count = 0
+
+        self._reaper = None
+        self._stop = threading.Event()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, loader):
+        """the model of the key, call loader() to load it the first time.
+
+        Args:
+            key (hashable): e.g. (model name, version, device).
+            loader (callable): () -> the model.
+
+        Returns:
+            the loaded model.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                logger.info(f"Loading model {key}")
+                start = time.perf_counter()
+                entry = {"value": loader(), "leases": 0}
+                logger.info(f"Loaded model {key} in {time.perf_counter() - start:.1f}s")
+
+                self._entries[key] = entry
+                self.load_count += 1
+
+            entry["last_used"] = time.monotonic()
+
+        if self.idle_timeout is not None:
+            self._start_reaper()
+
+        return entry["value"]
+
+    @contextlib.contextmanager
+    def lease(self, key, loader):
+        """hold the model of the key for a block, it is not evicted as idle until the block exits.
+
+        Args:
+            key (hashable): e.g. (model name, version, device).
+            loader (callable): () -> the model.
+
+        Yields:
+            the loaded model.
+        """
+
+        with self._lock:
+            value = self.get(key, loader)
+            entry = self._entries[key]
+            entry["leases"] += 1
+
+        try:
+            yield value
+        finally:
+            with self._lock:
+                entry["leases"] -= 1
+                entry["last_used"] = time.monotonic()
+
+    def evict(self, key):
+        """drop the model of the key and free its memory."""
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+        if entry is None:
+            return
+
+        self._free(key, entry)
+
+    @staticmethod
+    def _free(key, entry):
+
+        logger.info(f"Evict model {key}")
+
+        del entry
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def evict_idle(self, now: float = None):
+        """evict the models not used for idle_timeout seconds.
+
+        Returns:
+            list: the evicted keys.
+        """
+
+        if self.idle_timeout is None:
+            return []
+
+        now = time.monotonic() if now is None else now
+
+        # 在同一把锁里挑出并移除，挑完之后不会有新的 lease
+        with self._lock:
+            idle = {
+                key: entry
+                for key, entry in self._entries.items()
+                if entry["leases"] == 0 and now - entry["last_used"] >= self.idle_timeout
+            }
+            for key in idle:
+                del self._entries[key]
+
+        evicted = list(idle)
+        for key in evicted:
+            self._free(key, idle.pop(key))
+
+        return evicted
+
+    def clear(self):
+
+        for key in list(self._entries):
+            self.evict(key)
+
+        self._stop.set()
+
+    def _start_reaper(self):
+
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+
+        self._stop.clear()
+
+        def reap():
+            # 定期检查，直到 clear 被调用
+            while not self._stop.wait(max(self.idle_timeout / 2, 0.01)):
+                self.evict_idle()
+
+        self._reaper = threading.Thread(target=reap, name="model-reaper", daemon=True)
+        self._reaper.start()
+
+
+def get_registry(idle_timeout: float = None):
+    """the default registry shared by the whole process.
+
+    Args:
+        idle_timeout (float, optional): set the idle timeout of the registry, None keeps the current one. Defaults to None.
+    """
+
+    global _REGISTRY
+
+    if _REGISTRY is None:
+        _REGISTRY = ModelRegistry()
+
+    if idle_timeout is not None:
+        _REGISTRY.idle_timeout = idle_timeout
+
+    return _REGISTRY
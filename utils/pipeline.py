@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+File: /workspace/temp_feedback/Temp_Feedback/utils/pipeline.py
+Project: /workspace/temp_feedback/Temp_Feedback/utils
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+A staged pipeline executor, e.g. decode -> preprocess -> generate -> persist.
+The source iterator is consumed in its own thread, each stage runs in its
+own pool of worker threads, and the stages are connected by bounded queues,
+so a slow stage blocks the ones before it instead of piling up the items.
+The items leave every stage in the source order.
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 8:30:12 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+"""
+
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 上一个 stage 结束的标记
+_END = object()
+
+
+class Stage:
+    """one stage of the pipeline.
+
+    Args:
+        name (str): name of the stage, used in the logs and the timing.
+        fn (callable): item -> item, called in the worker threads.
+        workers (int, optional): number of worker threads. Defaults to 1.
+    """
+
+    def __init__(self, name: str, fn, workers: int = 1):
+
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+
+
+class Pipeline:
+    """run the items of a source iterator through the stages.
+
+    Args:
+        stages (list): the Stage list, in order.
+        queue_size (int, optional): max number of items waiting between two stages. Defaults to 4.
+    """
+
+    def __init__(self, stages: list, queue_size: int = 4):
+
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+
+        # stage name -> seconds spent in fn, summed over the workers
+        self.busy_time = {stage.name: 0.0 for stage in stages}
+
+    def _put(self, q: queue.Queue, item):
+        # 队列满时阻塞，但要能响应提前退出
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _fail(self, error: Exception):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _feed(self, source):
+
+        try:
+            for seq, item in enumerate(source):
+                if not self._put(self._queues[0], (seq, item)):
+                    return
+        except Exception as e:
+            self._fail(e)
+            return
+        finally:
+            # 提前退出时也关闭 source，例如停止视频的解码线程
+            if hasattr(source, "close"):
+                source.close()
+
+        for _ in range(self.stages[0].workers):
+            self._put(self._queues[0], _END)
+
+    def _emit(self, i: int, seq: int, item):
+        """put the result into the next queue in the source order."""
+
+        order = self._order[i]
+        with order["cond"]:
+            # 前面的结果还没出来时，限制乱序缓冲的大小
+            while seq - order["next"] >= self.queue_size and not self._stop.is_set():
+                order["cond"].wait(0.1)
+
+            order["buffer"][seq] = item
+            while order["next"] in order["buffer"]:
+                ready = order["buffer"].pop(order["next"])
+                if not self._put(self._queues[i + 1], (order["next"], ready)):
+                    return
+                order["next"] += 1
+
+            order["cond"].notify_all()
+
+    def _work(self, i: int):
+
+        stage = self.stages[i]
+
+        try:
+            while True:
+                item = self._get(self._queues[i])
+                if item is _END:
+                    break
+
+                seq, payload = item
+                start = time.perf_counter()
+                result = stage.fn(payload)
+                with self._lock:
+                    self.busy_time[stage.name] += time.perf_counter() - start
+
+                self._emit(i, seq, result)
+
+        except Exception as e:
+            logger.error(f"Stage {stage.name} failed: {e}")
+            self._fail(e)
+            return
+
+        # 最后一个退出的 worker 通知下一个 stage
+        with self._lock:
+            self._alive[i] -= 1
+            last = self._alive[i] == 0
+
+        if last:
+            next_workers = (
+                self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+            )
+            for _ in range(next_workers):
+                self._put(self._queues[i + 1], _END)
+
+    def run(self, source):
+        """iterate the results of the last stage, in the source order.
+
+        Args:
+            source (iterable): the input items, consumed in a background thread.
+
+        Yields:
+            the outputs of the last stage.
+        """
+
+        self._stop = threading.Event()
+        self._error = None
+        self._lock = threading.Lock()
+        self._queues = [
+            queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)
+        ]
+        self._order = [
+            {"cond": threading.Condition(), "next": 0, "buffer": {}} for _ in self.stages
+        ]
+        self._alive = [stage.workers for stage in self.stages]
+
+        threads = [threading.Thread(target=self._feed, args=(source,), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            threads += [
+                threading.Thread(
+                    target=self._work, args=(i,), name=f"{stage.name}-{n}", daemon=True
+                )
+                for n in range(stage.workers)
+            ]
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = self._get(self._queues[-1])
+                if item is _END:
+                    break
+                yield item[1]
+
+            if self._error is not None:
+                raise self._error
+        finally:
+            # 消费者提前退出或者出错时，通知所有的线程停止
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+        logger.info(
+            "Pipeline busy time: "
+            + ", ".join(f"{k} {v:.2f}s" for k, v in self.busy_time.items())
+        )
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+File: /workspace/temp_feedback/Temp_Feedback/utils/response_cache.py
+Project: /workspace/temp_feedback/Temp_Feedback/utils
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+A content-addressed cache of the VLM responses.
+The key is the perceptual hash (dHash) of the frame plus the prompt hash,
+the callers hash the generation settings (model, max_new_tokens, pixel
+bounds, ...) together with the prompt, so a persisted cache never answers a
+run with other settings. Frames whose hash is within the hamming distance threshold reuse the
+cached answer instead of running the generation again.
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 5:15:02 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from utils.ledger import prompt_hash
+
+logger = logging.getLogger(__name__)
+
+
+def dhash(image, hash_size: int = 8):
+    """difference hash of the image.
+
+    Args:
+        image (PIL.Image | np.ndarray): RGB image.
+        hash_size (int, optional): the hash has hash_size * hash_size bits. Defaults to 8.
+
+    Returns:
+        int: the hash.
+    """
+
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+
+    gray = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.int16)
+
+    # 相邻像素的明暗关系
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a: int, b: int):
+    return bin(a ^ b).count("1")
+
+
+class ResponseCache:
+    """LRU cache of the responses keyed by (prompt hash, frame dHash).
+
+    Args:
+        max_size (int, optional): max number of cached responses. Defaults to 4096.
+        threshold (int, optional): max hamming distance to reuse a response, 0 means exact match. Defaults to 0.
+        path (Path, optional): json file to persist the cache, loaded if it exists. Defaults to None.
+    """
+
+    def __init__(self, max_size: int = 4096, threshold: int = 0, path: Path = None):
+
+        self.max_size = max(1, max_size)
+        self.threshold = threshold
+        self.path = Path(path) if path is not None else None
+
+        # (prompt hash, image hash) -> response
+        self._entries = OrderedDict()
+        # 流水线的多个 stage 会同时读写
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+
+        if self.path is not None and self.path.exists():
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _find(self, p_hash: str, i_hash: int):
+
+        with self._lock:
+            return self._find_locked(p_hash, i_hash)
+
+    def _find_locked(self, p_hash: str, i_hash: int):
+
+        key = (p_hash, i_hash)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        if self.threshold <= 0:
+            return None
+
+        # 找同一个 prompt 下最相近的帧
+        best_key, best_dist = None, self.threshold + 1
+        for p, i in self._entries:
+            if p != p_hash:
+                continue
+            dist = hamming(i, i_hash)
+            if dist < best_dist:
+                best_key, best_dist = (p, i), dist
+
+        if best_key is None:
+            return None
+
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key]
+
+    def _put(self, p_hash: str, i_hash: int, response):
+
+        with self._lock:
+            self._entries[(p_hash, i_hash)] = response
+            self._entries.move_to_end((p_hash, i_hash))
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, image, prompt):
+        """cached response of the image, None when missed."""
+
+        response = self._find(prompt_hash(prompt), dhash(image))
+
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return response
+
+    def put(self, image, prompt, response):
+        self._put(prompt_hash(prompt), dhash(image), response)
+
+    def lookup(self, items: list, prompt, image_fn=lambda x: x):
+        """first half of resolve, find the cached responses without generating.
+
+        Args:
+            items (list): the items, e.g. images or frame_info dicts.
+            prompt: the prompt.
+            image_fn (callable, optional): item -> image. Defaults to identity.
+
+        Returns:
+            dict: the lookup state, its "pending" item indices need to be generated.
+        """
+
+        p_hash = prompt_hash(prompt)
+        hashes = [dhash(image_fn(item)) for item in items]
+
+        responses = [None] * len(items)
+        pending = []  # 需要生成的 item
+        shared = {}  # item -> 同一批里与它近似、正在生成的 item
+
+        with self._lock:
+            for i, i_hash in enumerate(hashes):
+
+                cached = self._find(p_hash, i_hash)
+                if cached is not None:
+                    responses[i] = cached
+                    self.hits += 1
+                    continue
+
+                owner = next(
+                    (j for j in pending if hamming(hashes[j], i_hash) <= self.threshold),
+                    None,
+                )
+                if owner is not None:
+                    shared[i] = owner
+                    self.hits += 1
+                    continue
+
+                pending.append(i)
+                self.misses += 1
+
+        return {
+            "prompt_hash": p_hash,
+            "hashes": hashes,
+            "responses": responses,
+            "pending": pending,
+            "shared": shared,
+        }
+
+    def complete(self, lookup: dict, generated: list):
+        """second half of resolve, cache the generated responses of the pending items.
+
+        Args:
+            lookup (dict): the state returned by lookup.
+            generated (list): responses of the pending items, in order.
+
+        Returns:
+            list: responses of all the items.
+        """
+
+        responses = list(lookup["responses"])
+
+        for i, response in zip(lookup["pending"], generated):
+            responses[i] = response
+            self._put(lookup["prompt_hash"], lookup["hashes"][i], response)
+
+        for i, owner in lookup["shared"].items():
+            responses[i] = responses[owner]
+
+        return responses
+
+    def resolve(self, items: list, prompt, generate_fn, image_fn=lambda x: x):
+        """get the responses of the items, only the missed ones are generated.
+
+        Near-duplicate items in the same call also share one generation.
+
+        Args:
+            items (list): the items, e.g. images or frame_info dicts.
+            prompt: the prompt.
+            generate_fn (callable): list of missed items -> list of responses.
+            image_fn (callable, optional): item -> image. Defaults to identity.
+
+        Returns:
+            list: responses in the same order as the items.
+        """
+
+        lookup = self.lookup(items, prompt, image_fn)
+
+        generated = []
+        if lookup["pending"]:
+            generated = generate_fn([items[i] for i in lookup["pending"]])
+
+        return self.complete(lookup, generated)
+
+    def save(self, path: Path = None):
+        """persist the cache into a json file."""
+
+        path = Path(path) if path is not None else self.path
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._lock:
+            entries = [[p, format(i, "x"), r] for (p, i), r in self._entries.items()]
+        with open(path, "w") as f:
+            json.dump({"entries": entries}, f, ensure_ascii=False)
+
+        logger.info(f"Saved {len(entries)} cached responses to {path}")
+
+    def load(self, path: Path = None):
+
+        path = Path(path) if path is not None else self.path
+        with open(path, "r") as f:
+            entries = json.load(f)["entries"]
+
+        for p, i, r in entries:
+            self._put(p, int(i, 16), r)
+
+        logger.info(f"Loaded {len(entries)} cached responses from {path}")
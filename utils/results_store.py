@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+File: /workspace/temp_feedback/Temp_Feedback/utils/results_store.py
+Project: /workspace/temp_feedback/Temp_Feedback/utils
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+An append-only JSONL store for the per-frame inference results.
+One record per line, the writes are buffered and fsync-ed in batches,
+and an in-memory index maps (video, frame_idx) to the byte offset of the
+record, so a single frame can be read back without parsing the whole file.
+The legacy JSON layouts are produced by the export functions.
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 3:10:27 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+
+from utils.structured_output import analysis_fields
+
+logger = logging.getLogger(__name__)
+
+
+def read_complete_lines(path: Path, truncate: bool = False):
+    """the complete lines of a JSONL file.
+
+    An interrupted run can leave a half written last line, it is dropped,
+    and with truncate also cut off the file, so the next record starts on a
+    new line. Only the writers truncate, the readers leave the file as it is.
+
+    Args:
+        path (Path): path of the .jsonl file.
+        truncate (bool, optional): cut the incomplete last line off the file. Defaults to False.
+
+    Returns:
+        tuple: ([(byte offset, line)], byte size of the complete lines)
+    """
+
+    path = Path(path)
+    lines = []
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                logger.warning(f"Drop the incomplete last record in {path}")
+                break
+            lines.append((offset, line))
+            offset += len(line)
+
+    if truncate and offset < path.stat().st_size:
+        os.truncate(path, offset)
+
+    return lines, offset
+
+
+class ResultsStore:
+    """append-only JSONL results store.
+
+    Args:
+        path (Path): path of the .jsonl file, the records in it are loaded into the index.
+        flush_every (int, optional): number of buffered records before a write and fsync. Defaults to 64.
+        fsync (bool, optional): fsync after each write. Defaults to True.
+    """
+
+    def __init__(self, path: Path, flush_every: int = 64, fsync: bool = True):
+
+        self.path = Path(path)
+        self.flush_every = max(1, flush_every)
+        self.fsync = fsync
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        # video_path -> {frame_idx: byte offset}
+        self._index = {}
+        self._buffer = []
+        self._buffer_size = 0
+        self._size = 0
+
+        if self.path.exists():
+            self._load_index()
+
+        # 第一次写入时再打开文件
+        self._file = None
+
+    def _load_index(self):
+
+        # 上次异常退出时可能留下不完整的最后一行，第一次写入时才截掉
+        lines, self._size = read_complete_lines(self.path)
+        for offset, line in lines:
+            self._add_index(json.loads(line), offset)
+
+    def _add_index(self, record: dict, offset: int):
+        video = str(record.get("video_path", ""))
+        self._index.setdefault(video, {})[int(record["frame_idx"])] = offset
+
+    def append(self, record: dict):
+        """append one record, it is written to disk on the next flush."""
+
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+        self._add_index(record, self._size + self._buffer_size)
+        self._buffer.append(line)
+        self._buffer_size += len(line)
+
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def extend(self, records: list):
+        for record in records:
+            self.append(record)
+
+    def flush(self):
+
+        if not self._buffer:
+            return
+
+        if self._file is None:
+            # 只在要追加时截掉不完整的最后一行，只读的使用者不改文件
+            if self.path.exists() and self.path.stat().st_size > self._size:
+                os.truncate(self.path, self._size)
+            self._file = open(self.path, "ab")
+
+        data = b"".join(self._buffer)
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+        self._size += len(data)
+        self._buffer = []
+        self._buffer_size = 0
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return sum(len(frames) for frames in self._index.values())
+
+    def __contains__(self, frame_idx):
+        return any(frame_idx in frames for frames in self._index.values())
+
+    @property
+    def videos(self):
+        return list(self._index)
+
+    def frame_indices(self, video_path=None):
+        return sorted(self._video_index(video_path))
+
+    def _video_index(self, video_path=None):
+
+        if video_path is not None:
+            return self._index.get(str(video_path), {})
+
+        if len(self._index) > 1:
+            raise ValueError(
+                f"{self.path} has results of {len(self._index)} videos, please give the video_path."
+            )
+
+        return next(iter(self._index.values()), {})
+
+    def _read_at(self, offset: int):
+
+        # 读之前先把缓冲区写入文件
+        self.flush()
+
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def get(self, frame_idx: int, video_path=None):
+        """read the record of one frame by the index.
+
+        Args:
+            frame_idx (int): index of the frame.
+            video_path (optional): the video, can be omitted when the store has one video.
+
+        Returns:
+            dict: the latest record of the frame.
+        """
+
+        return self._read_at(self._video_index(video_path)[int(frame_idx)])
+
+    def records(self, video_path=None):
+        """yield the latest record of each frame, sorted by frame_idx."""
+
+        index = self._video_index(video_path)
+        if not index:
+            return
+        self.flush()
+
+        with open(self.path, "rb") as f:
+            for frame_idx in sorted(index):
+                f.seek(index[frame_idx])
+                yield json.loads(f.readline())
+
+    def export_json(self, json_file_path: Path, video_path=None):
+        """export the records as one list, the legacy aggregate <video>.json layout."""
+
+        json_file_path = Path(json_file_path)
+        json_file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(json_file_path, "w") as f:
+            json.dump(list(self.records(video_path)), f, indent=4)
+
+    def export_gui_json(self, json_file_path: Path, video_path=None):
+        """export the parsed fields, the layout of GUI/assets/llm_res."""
+
+        res = []
+        for record in self.records(video_path):
+            _info_dict = analysis_fields(record)
+            res.append(
+                {
+                    "frame_idx": record["frame_idx"],
+                    "second": record["second"],
+                    "ms": record["ms"],
+                    "source": _info_dict["source"],
+                    "proportion": _info_dict["proportion"],
+                }
+            )
+
+        json_file_path = Path(json_file_path)
+        json_file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(json_file_path, "w") as f:
+            json.dump(res, f, indent=2)
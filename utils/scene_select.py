@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+File: /workspace/temp_feedback/Temp_Feedback/utils/scene_select.py
+Project: /workspace/temp_feedback/Temp_Feedback/utils
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+Scene-change driven frame selection before the VLM inference.
+Each frame is reduced to a small grayscale thumbnail, a frame is selected
+when its mean absolute difference to the last selected frame is over the
+threshold, or when the keep-alive interval has passed. The frames that are
+not selected inherit the result of the last selected frame, so every
+frame_idx still has a record.
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 6:02:55 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+"""
+
+import logging
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+def frame_thumbnail(image, size: int = 32):
+    """downscaled grayscale thumbnail in [0, 1], shape (size, size)."""
+
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+
+    gray = image.convert("L").resize((size, size), Image.BILINEAR)
+
+    return np.asarray(gray, dtype=np.float32) / 255.0
+
+
+class SceneChangeSelector:
+    """select the frames where the scene changes.
+
+    Args:
+        threshold (float, optional): mean absolute difference in [0, 1] to the last selected frame. Defaults to 0.05.
+        keep_alive (float, optional): select a frame at least every keep_alive seconds. Defaults to 1.0.
+        size (int, optional): thumbnail size. Defaults to 32.
+    """
+
+    def __init__(self, threshold: float = 0.05, keep_alive: float = 1.0, size: int = 32):
+
+        self.threshold = threshold
+        self.keep_alive_ms = keep_alive * 1000
+        self.size = size
+
+        self.reset()
+
+    def reset(self):
+        """call it before a new video."""
+
+        self._last_thumb = None
+        self._last_ms = None
+        self._last_record = None
+
+        self.selected_count = 0
+        self.total_count = 0
+
+    def is_selected(self, frame_info: dict):
+
+        thumb = frame_thumbnail(frame_info["image"], self.size)
+        current_ms = frame_info["current_ms"]
+
+        self.total_count += 1
+
+        selected = (
+            self._last_thumb is None
+            or current_ms - self._last_ms >= self.keep_alive_ms
+            or np.abs(thumb - self._last_thumb).mean() >= self.threshold
+        )
+
+        if selected:
+            self._last_thumb = thumb
+            self._last_ms = current_ms
+            self.selected_count += 1
+
+        return selected
+
+    def iter_batches(self, frame_stream, batch_size: int):
+        """group the frames until batch_size of them are selected.
+
+        The frames not selected only keep their timing, the image is dropped.
+
+        Args:
+            frame_stream (iterable): frame_info dicts from the video loader.
+            batch_size (int): number of selected frames per group.
+
+        Yields:
+            tuple: (group of frame_info, list of selected flags)
+        """
+
+        group, flags, num_selected = [], [], 0
+
+        for frame_info in frame_stream:
+
+            selected = self.is_selected(frame_info)
+            if selected:
+                num_selected += 1
+            else:
+                frame_info = {k: v for k, v in frame_info.items() if k != "image"}
+
+            group.append(frame_info)
+            flags.append(selected)
+
+            if num_selected == batch_size:
+                yield group, flags
+                group, flags, num_selected = [], [], 0
+
+        if group:
+            yield group, flags
+
+    def fill(self, frame_infos: list, flags: list, records: list):
+        """build the records of the frames not selected.
+
+        Args:
+            frame_infos (list): the frames of one group.
+            flags (list): selected flags of the frames.
+            records (list): results of the selected frames, in order.
+
+        Returns:
+            list: records of the other frames, copied from the last selected frame.
+        """
+
+        records = iter(records)
+        inherited = []
+
+        for frame_info, flag in zip(frame_infos, flags):
+
+            if flag:
+                self._last_record = next(records)
+                continue
+
+            record = dict(self._last_record)
+            record.update(
+                {
+                    "frame_idx": int(frame_info["frame_idx"]),
+                    "second": int(frame_info["second"]),
+                    "ms": int(frame_info["current_ms"]),
+                    "inherited_from": self._last_record["frame_idx"],
+                }
+            )
+            inherited.append(record)
+
+        return inherited
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+File: /workspace/temp_feedback/Temp_Feedback/utils/sharding.py
+Project: /workspace/temp_feedback/Temp_Feedback/utils
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+Data-parallel sharding of the videos over several worker processes.
+The videos are split into shards, a long video into several frame ranges,
+and the shards are assigned to the workers deterministically, so a rerun
+gives each worker the same shards and its ledger can resume them. Each
+worker writes its own results store, they are merged at the end, and the
+progress of all the workers is reported by one progress bar.
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 10:24:51 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+"""
+
+import contextlib
+import logging
+import multiprocessing as mp
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_EXCEPTION
+from pathlib import Path
+
+from tqdm import tqdm
+
+from utils.decoders import open_decoder
+from utils.results_store import ResultsStore
+
+logger = logging.getLogger(__name__)
+
+
+def video_frame_count(video_path: Path, decoder: str = "decord"):
+    with open_decoder(video_path, decoder) as vr:
+        return vr.frame_count
+
+
+def plan_shards(video_paths: list, max_frames: int = None, frame_counts: dict = None):
+    """split the videos into shards.
+
+    Args:
+        video_paths (list): paths to the videos.
+        max_frames (int, optional): max frames of one shard, a longer video is split into frame ranges. Defaults to None, one shard per video.
+        frame_counts (dict, optional): video path -> number of frames, read from the videos when not given. Defaults to None.
+
+    Returns:
+        list: shard dicts with video_path, start, end (exclusive) and num_frames.
+    """
+
+    shards = []
+    for video_path in sorted(str(p) for p in video_paths):
+
+        if frame_counts is not None:
+            total = frame_counts[video_path]
+        else:
+            total = video_frame_count(video_path)
+
+        step = max_frames if max_frames else max(total, 1)
+        for start in range(0, max(total, 1), step):
+            end = min(start + step, total)
+            shards.append(
+                {
+                    "video_path": video_path,
+                    "start": start,
+                    "end": end,
+                    "num_frames": end - start,
+                }
+            )
+
+    return shards
+
+
+def assign_shards(shards: list, num_workers: int):
+    """assign the shards to the workers, the longest shard first to the least loaded worker.
+
+    The assignment only depends on the shards, the ties are broken by the
+    shard order and the worker index, so it is the same on every run.
+
+    Returns:
+        list: the shards of each worker, in the original order.
+    """
+
+    num_workers = max(1, num_workers)
+    loads = [0] * num_workers
+    assigned = [[] for _ in range(num_workers)]
+
+    for i in sorted(range(len(shards)), key=lambda i: (-shards[i]["num_frames"], i)):
+        worker = min(range(num_workers), key=lambda w: (loads[w], w))
+        loads[worker] += shards[i]["num_frames"]
+        assigned[worker].append(i)
+
+    return [[shards[i] for i in sorted(indices)] for indices in assigned]
+
+
+class ProgressReporter:
+    """sent to a worker process, reports its progress to the launcher."""
+
+    def __init__(self, progress_queue, worker_id: int):
+        self.queue = progress_queue
+        self.worker_id = worker_id
+
+    def frames(self, num_frames: int):
+        self.queue.put((self.worker_id, "frames", num_frames))
+
+    def shard_done(self):
+        self.queue.put((self.worker_id, "shard", 1))
+
+
+def _pin_device(device):
+
+    # 进程的 initializer，在任何任务和 CUDA 初始化之前指定这个进程使用的卡
+    if device is not None:
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(device)
+
+
+def run_sharded(
+    worker_fn,
+    shards: list,
+    num_workers: int,
+    worker_args: tuple = (),
+    devices: list = None,
+):
+    """run the shards in num_workers spawned processes.
+
+    Args:
+        worker_fn (callable): (worker_id, shards, ProgressReporter, *worker_args) -> result, must be picklable.
+        shards (list): shards from plan_shards.
+        num_workers (int): number of worker processes.
+        worker_args (tuple, optional): extra arguments of worker_fn. Defaults to ().
+        devices (list, optional): CUDA device of each worker, used round robin. Defaults to None.
+
+    Returns:
+        list: the results of worker_fn, in worker order, the workers without shards are skipped.
+    """
+
+    assigned = assign_shards(shards, num_workers)
+    for worker_id, worker_shards in enumerate(assigned):
+        logger.info(
+            f"Worker {worker_id}: {len(worker_shards)} shards, "
+            f"{sum(s['num_frames'] for s in worker_shards)} frames"
+        )
+
+    # spawn 避免 fork 带着已经初始化的 CUDA 和线程
+    ctx = mp.get_context("spawn")
+
+    with ctx.Manager() as manager, contextlib.ExitStack() as stack:
+
+        progress_queue = manager.Queue()
+        futures = []
+        for worker_id, worker_shards in enumerate(assigned):
+            if not worker_shards:
+                continue
+
+            # 每个 worker 一个只跑一个任务的进程，卡在进程启动时就指定好，
+            # 不会被复用的进程带着另一张卡的 CUDA 上下文
+            pool = stack.enter_context(
+                ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=ctx,
+                    initializer=_pin_device,
+                    initargs=(devices[worker_id % len(devices)] if devices else None,),
+                    max_tasks_per_child=1,
+                )
+            )
+            futures.append(
+                pool.submit(
+                    worker_fn,
+                    worker_id,
+                    worker_shards,
+                    ProgressReporter(progress_queue, worker_id),
+                    *worker_args,
+                )
+            )
+
+        _report_progress(futures, progress_queue, len(shards))
+
+        return [future.result() for future in futures]
+
+
+def _report_progress(futures: list, progress_queue, num_shards: int):
+    """one progress bar of all the workers, until they are all done."""
+
+    frames = {}
+    pending = set(futures)
+
+    with tqdm(total=num_shards, desc="shards") as bar:
+        while True:
+            try:
+                worker_id, kind, value = progress_queue.get(timeout=0.2)
+            except queue.Empty:
+                pending = wait(pending, timeout=0, return_when=FIRST_EXCEPTION).not_done
+                # 全部结束或者有 worker 出错
+                if not pending or any(f.done() and f.exception() for f in futures):
+                    break
+                continue
+
+            if kind == "shard":
+                bar.update(value)
+            else:
+                frames[worker_id] = frames.get(worker_id, 0) + value
+                bar.set_postfix(frames=sum(frames.values()))
+
+    logger.info(f"Frames per worker: {dict(sorted(frames.items()))}")
+
+
+def merge_results_stores(store_paths: list, output_path: Path):
+    """merge the results stores of the workers into one store.
+
+    Args:
+        store_paths (list): the .jsonl stores to merge, a later one wins on duplicated frames.
+        output_path (Path): the merged .jsonl store, replaced if it exists.
+
+    Returns:
+        ResultsStore: the merged store, closed.
+    """
+
+    output_path = Path(output_path)
+    if output_path.exists():
+        output_path.unlink()
+
+    merged = ResultsStore(output_path)
+
+    for store_path in store_paths:
+        store = ResultsStore(store_path)
+        for video in store.videos:
+            merged.extend(store.records(video))
+
+    merged.close()
+
+    return merged
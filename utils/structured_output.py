@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+File: /workspace/temp_feedback/Temp_Feedback/utils/structured_output.py
+Project: /workspace/temp_feedback/Temp_Feedback/utils
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+The {source, proportion, location} answer of the temperature analysis.
+The schema is used by the vllm guided decoding, and JSONTemplateConstraint
+does the same for the huggingface generate, it only allows the tokens that
+keep the output inside the JSON template and ends it at the closing brace.
+parse_analysis turns an answer into the parsed fields of the results record.
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 7:12:40 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+"""
+
+import json
+import logging
+import re
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ("heat", "cold", "none")
+ANALYSIS_FIELDS = ("source", "proportion", "location")
+
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "source": {"type": "string", "enum": list(SOURCES)},
+        "proportion": {"type": "number", "minimum": 0, "maximum": 1},
+        "location": {"type": "string", "maxLength": 32},
+    },
+    "required": list(ANALYSIS_FIELDS),
+    "additionalProperties": False,
+}
+
+# the JSON template of the constrained decoding, (kind, argument)
+ANALYSIS_TEMPLATE = (
+    ("literal", '{"source": "'),
+    ("enum", SOURCES),
+    ("literal", '", "proportion": '),
+    ("number", None),
+    ("literal", ', "location": "'),
+    ("string", 32),
+    ("literal", '"}'),
+)
+
+# proportion in [0, 1], at most 4 decimals
+_NUMBER = re.compile(r"0|1|0\.\d{1,4}|1\.0{1,4}")
+_NUMBER_PREFIX = re.compile(r"|0|1|0\.\d{0,4}|1\.0{0,4}")
+
+# the characters a token in the location string can not have
+_STRING_STOP = set('"\\\n\r\t{}\ufffd')
+
+
+def convert_str_dict(llm_res):
+    """parse the first {...} in the llm output text."""
+
+    match = re.search(r"\{.*?\}", llm_res[0], re.DOTALL)
+    if match:
+        try:
+            return json.loads(match.group(0))
+        except json.JSONDecodeError:
+            pass
+    return {"source": "none", "proportion": "none", "location": "none"}
+
+
+def parse_analysis(output_text):
+    """parse and normalise the answer into the record fields.
+
+    Args:
+        output_text (str | list): the generated text, or the output_text list of a record.
+
+    Returns:
+        dict: source in SOURCES, proportion as a float in [0, 1], location as a str.
+    """
+
+    if isinstance(output_text, str):
+        output_text = [output_text]
+
+    res = convert_str_dict(output_text)
+
+    source = str(res.get("source", "none")).strip().lower()
+    if source not in SOURCES:
+        # e.g. "heat source"
+        source = next((s for s in SOURCES if source.startswith(s)), "none")
+
+    try:
+        proportion = float(str(res.get("proportion", 0)).rstrip("%"))
+    except ValueError:
+        proportion = 0.0
+    if proportion > 1:
+        # the answer is in percent
+        proportion /= 100
+    proportion = min(max(proportion, 0.0), 1.0)
+
+    return {
+        "source": source,
+        "proportion": proportion,
+        "location": str(res.get("location", "none")),
+    }
+
+
+def analysis_fields(record: dict):
+    """the parsed fields of a record, parse the output_text for the old records."""
+
+    if all(k in record for k in ANALYSIS_FIELDS):
+        return {k: record[k] for k in ANALYSIS_FIELDS}
+
+    return parse_analysis(record["output_text"])
+
+
+class JSONTemplateConstraint:
+    """restrict the generate to the ANALYSIS_TEMPLATE.
+
+    The generated text is matched against the template at each step, the
+    literal parts are forced token by token, and the free parts only allow
+    the tokens of an enum value, a number or a short string. The end of
+    sequence token is the only one allowed after the closing brace.
+
+    Args:
+        tokenizer: the huggingface tokenizer.
+        template (tuple, optional): the JSON template. Defaults to ANALYSIS_TEMPLATE.
+    """
+
+    def __init__(self, tokenizer, template: tuple = ANALYSIS_TEMPLATE):
+
+        self.tokenizer = tokenizer
+        self.template = template
+        self.eos_token_id = tokenizer.eos_token_id
+
+        special_ids = set(tokenizer.all_special_ids)
+        token_texts = tokenizer.batch_decode([[i] for i in range(len(tokenizer))])
+
+        # 数字和小数点组成的 token
+        self._number_tokens = [
+            (i, t)
+            for i, t in enumerate(token_texts)
+            if i not in special_ids and t and re.fullmatch(r"[0-9.]+", t)
+        ]
+
+        # 可以出现在字符串里的 token，以及它们的长度
+        string_tokens = [
+            (i, len(t))
+            for i, t in enumerate(token_texts)
+            if i not in special_ids
+            and t
+            and t.isprintable()
+            and not _STRING_STOP.intersection(t)
+        ]
+        self._string_ids = torch.tensor([i for i, _ in string_tokens], dtype=torch.long)
+        self._string_lens = torch.tensor([n for _, n in string_tokens], dtype=torch.long)
+
+        self._first_token_cache = {}
+
+    def _first_token(self, text: str):
+
+        if text not in self._first_token_cache:
+            self._first_token_cache[text] = self.tokenizer.encode(
+                text, add_special_tokens=False
+            )[0]
+
+        return self._first_token_cache[text]
+
+    def _state(self, text: str):
+        """the template part the text is in, and the text of that part so far."""
+
+        pos = 0
+        for i, (kind, arg) in enumerate(self.template):
+            rest = text[pos:]
+
+            if kind == "literal":
+                if not rest.startswith(arg):
+                    return i, rest
+                pos += len(arg)
+
+            elif kind == "enum":
+                # 后面已经接上了下一段，这个值就结束了
+                value = next(
+                    (v for v in arg if rest.startswith(v) and len(rest) > len(v)), None
+                )
+                if value is None:
+                    return i, rest
+                pos += len(value)
+
+            elif kind == "number":
+                end = re.match(r"[0-9.]*", rest).end()
+                if end == len(rest):
+                    return i, rest
+                pos += end
+
+            elif kind == "string":
+                end = rest.find('"')
+                if end < 0:
+                    return i, rest
+                pos += end
+
+        return len(self.template), text[pos:]
+
+    def allowed_tokens(self, text: str):
+        """the token ids that can follow the generated text."""
+
+        i, partial = self._state(text)
+        if i == len(self.template):
+            return [self.eos_token_id]
+
+        kind, arg = self.template[i]
+
+        if kind == "literal":
+            if not arg.startswith(partial):
+                # 已经偏离了模板，直接结束
+                return [self.eos_token_id]
+            return [self._first_token(arg[len(partial) :])]
+
+        # 自由的部分后面总是 literal，它的第一个 token 结束当前这一部分
+        closing = self._first_token(self.template[i + 1][1])
+
+        if kind == "enum":
+            allowed = {
+                self._first_token(v[len(partial) :])
+                for v in arg
+                if v.startswith(partial) and v != partial
+            }
+            if partial in arg:
+                allowed.add(closing)
+
+        elif kind == "number":
+            allowed = {
+                token_id
+                for token_id, t in self._number_tokens
+                if _NUMBER_PREFIX.fullmatch(partial + t)
+            }
+            if _NUMBER.fullmatch(partial):
+                allowed.add(closing)
+
+        else:
+            allowed = self._string_ids[self._string_lens <= arg - len(partial)]
+            if partial:
+                allowed = torch.cat([allowed, torch.tensor([closing])])
+            return allowed
+
+        return sorted(allowed) if allowed else [self.eos_token_id]
+
+    def prefix_allowed_tokens_fn(self, prompt_len: int):
+        """the prefix_allowed_tokens_fn of generate for a batch of prompt_len tokens."""
+
+        def fn(batch_id, input_ids):
+            text = self.tokenizer.decode(input_ids[prompt_len:], skip_special_tokens=True)
+            return self.allowed_tokens(text)
+
+        return fn
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+File: /workspace/temp_feedback/Temp_Feedback/utils/token_budget.py
+Project: /workspace/temp_feedback/Temp_Feedback/utils
+Created Date: Sunday October 18th 2026
+Author: Kaixu Chen
+-----
+Comment:
+The visual token budget of Qwen2-VL frames.
+Qwen2-VL resizes an image to multiples of 28 pixels inside [min_pixels,
+max_pixels], and every 28x28 block becomes one visual token, so the pixel
+bounds decide the cost of a frame. A budget of max_visual_tokens per frame
+gives max_pixels, and decode_size gives the size the processor would resize
+to, so the frames can be decoded at that size by decord directly. The
+budget can also be picked automatically from candidates, by measuring the
+seconds per frame of each one against a target latency or throughput,
+and the answers of each budget can be compared with the largest one.
+
+Have a good code time :)
+-----
+Last Modified: Sunday October 18th 2026 3:26:10 pm
+Modified By: the developer formerly known as Kaixu Chen at <chenkaixusan@gmail.com>
+-----
+Copyright (c) 2026 The University of Tsukuba
+-----
+HISTORY:
+Date      	By	Comments
+----------	---	---------------------------------------------------------
+"""
+
+import logging
+
+from transformers.models.qwen2_vl.image_processing_qwen2_vl import smart_resize
+
+from utils.structured_output import parse_analysis
+
+logger = logging.getLogger(__name__)
+
+# patch_size 14 * spatial_merge_size 2，一个视觉 token 对应的边长
+TOKEN_PIXELS = 28
+
+
+def pixel_bounds(min_pixels: int, max_pixels: int, max_visual_tokens: int = None):
+    """the (min_pixels, max_pixels) of the processor under the token budget.
+
+    Args:
+        min_pixels (int): lower bound of the resized image.
+        max_pixels (int): upper bound of the resized image.
+        max_visual_tokens (int, optional): visual tokens per frame, replaces max_pixels. Defaults to None.
+
+    Returns:
+        tuple: (min_pixels, max_pixels), min_pixels is lowered to max_pixels when it is larger.
+    """
+
+    if max_visual_tokens is not None:
+        if max_visual_tokens <= 0:
+            raise ValueError(f"max_visual_tokens should be positive, but got {max_visual_tokens}.")
+        max_pixels = max_visual_tokens * TOKEN_PIXELS * TOKEN_PIXELS
+
+    return min(int(min_pixels), int(max_pixels)), int(max_pixels)
+
+
+def decode_size(height: int, width: int, min_pixels: int, max_pixels: int):
+    """the (height, width) the processor resizes a height x width frame to.
+
+    A frame decoded at this size is not resized again by the processor.
+    """
+
+    return smart_resize(
+        height, width, factor=TOKEN_PIXELS, min_pixels=min_pixels, max_pixels=max_pixels
+    )
+
+
+def visual_tokens(height: int, width: int, min_pixels: int, max_pixels: int):
+    """number of visual tokens of a height x width frame."""
+
+    h, w = decode_size(height, width, min_pixels, max_pixels)
+
+    return (h // TOKEN_PIXELS) * (w // TOKEN_PIXELS)
+
+
+def select_budget(
+    measure_fn,
+    candidates: list,
+    target_seconds: float = None,
+    target_fps: float = None,
+):
+    """pick the largest token budget whose seconds per frame meet the target.
+
+    The candidates are measured from the smallest up, and the measuring stops
+    at the first one over the target, as the larger ones are only slower.
+
+    Args:
+        measure_fn (callable): max_visual_tokens -> seconds per frame.
+        candidates (list): max_visual_tokens to try.
+        target_seconds (float, optional): max seconds per frame. Defaults to None.
+        target_fps (float, optional): min frames per second, the same as target_seconds = 1 / target_fps. Defaults to None.
+
+    Returns:
+        tuple: (the selected max_visual_tokens, {max_visual_tokens: seconds per frame})
+    """
+
+    if (target_seconds is None) == (target_fps is None):
+        raise ValueError("Exactly one of target_seconds and target_fps should be set.")
+
+    if target_fps is not None:
+        target_seconds = 1.0 / target_fps
+
+    candidates = sorted(candidates)
+    measured = {}
+    selected = candidates[0]
+
+    for tokens in candidates:
+        measured[tokens] = measure_fn(tokens)
+        logger.info(f"Budget {tokens} tokens: {measured[tokens]:.3f}s per frame")
+
+        if measured[tokens] > target_seconds:
+            break
+        selected = tokens
+
+    if measured[candidates[0]] > target_seconds:
+        logger.warning(
+            f"Even {candidates[0]} tokens takes {measured[candidates[0]]:.3f}s per frame, "
+            f"over the target {target_seconds:.3f}s"
+        )
+
+    logger.info(f"Selected budget: {selected} visual tokens per frame")
+
+    return selected, measured
+
+
+def analysis_agreement(outputs: list, reference: list):
+    """how close the answers are to the reference answers, e.g. of the largest budget.
+
+    Returns:
+        dict: source_accuracy, the fraction of the same source, and proportion_mae.
+    """
+
+    parsed = [(parse_analysis(o), parse_analysis(r)) for o, r in zip(outputs, reference)]
+    if not parsed:
+        return {"source_accuracy": 0.0, "proportion_mae": 0.0}
+
+    return {
+        "source_accuracy": sum(a["source"] == b["source"] for a, b in parsed) / len(parsed),
+        "proportion_mae": sum(abs(a["proportion"] - b["proportion"]) for a, b in parsed)
+        / len(parsed),
+    }
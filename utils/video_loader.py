@@ -19,66 +19,401 @@ HISTORY:
 Date      	By	Comments
 ----------	---	---------------------------------------------------------
 """
-from decord import VideoReader, cpu
 import logging
-import os
+import math
+import queue
+import threading
 import numpy as np
 from pathlib import Path
-from PIL import Image
+
+from utils.decoders import open_decoder
+from utils.frame_cache import FrameCache
+from utils.frame_writer import FrameWriter
 
 logger = logging.getLogger(__name__)
 
+# 解码线程结束的标记
+_END = object()
 
-def split_video_and_extract_frames_decord(video_path: Path, output_dir: Path):
 
-    # 创建输出目录
-    if not output_dir.exists():
-        output_dir.mkdir(parents=True, exist_ok=True)
+def sample_frame_indices(
+    total_frames: int,
+    video_fps: float,
+    fps: float = None,
+    stride: int = None,
+    timestamps: list = None,
+):
+    """select the frame indices to decode.
 
-    total_frame_list = []
+    Only one of fps, stride and timestamps can be given, when none of them is
+    given, all the frames are selected.
 
-    # 使用 Decord 加载视频
-    vr = VideoReader(str(video_path), ctx=cpu())
-    video_fps = vr.get_avg_fps()  # 视频原始帧率
-    total_frames = len(vr)  # 视频总帧数
-    duration = total_frames / video_fps  # 视频时长（秒）
+    Args:
+        total_frames (int): total frame number of the video.
+        video_fps (float): native fps of the video.
+        fps (float, optional): target fps of the sampled frames. Defaults to None.
+        stride (int, optional): sample one frame every stride frames. Defaults to None.
+        timestamps (list, optional): timestamps in seconds to sample. Defaults to None.
 
-    print(
-        f"视频帧率: {video_fps:.2f} FPS, 总帧数: {total_frames}, 时长: {duration:.2f} 秒"
-    )
+    Returns:
+        list: sorted frame indices.
+    """
 
-    current_second = 0  # 当前秒计数器
-    saved_count = 0  # 记录已保存帧数
-
-    # 遍历所有帧
-    for frame_idx in range(total_frames):
-        # 当前帧对应的秒
-        current_second = int(frame_idx / video_fps)
-        current_ms = int(frame_idx * 1000 / video_fps)
-
-        # 提取帧并转换为 NumPy 数组
-        frame = vr[frame_idx].asnumpy()
-        # 转换为 PIL.Image
-        image = Image.fromarray(frame)
-
-        frame_info = {
-            "video_path": video_path,
-            "frame_idx": frame_idx,
-            "current_ms": current_ms,
-            "second": current_second,
-            "image": image,
+    if sum(x is not None for x in (fps, stride, timestamps)) > 1:
+        raise ValueError("Only one of fps, stride and timestamps can be set.")
+
+    if timestamps is not None:
+        indices = {
+            min(max(int(round(t * video_fps)), 0), total_frames - 1)
+            for t in timestamps
         }
+        return sorted(indices)
+
+    if fps is not None:
+        if fps <= 0:
+            raise ValueError(f"fps should be positive, but got {fps}.")
+        if fps >= video_fps:
+            return list(range(total_frames))
+        # 按目标帧率计算每个采样点对应的原始帧
+        step = video_fps / fps
+        num = int(np.ceil(total_frames / step))
+        indices = np.floor(np.arange(num) * step).astype(int)
+        return sorted(set(indices[indices < total_frames].tolist()))
+
+    if stride is not None:
+        if stride <= 0:
+            raise ValueError(f"stride should be positive, but got {stride}.")
+        return list(range(0, total_frames, stride))
+
+    return list(range(total_frames))
+
+
+def target_size(
+    height: int,
+    width: int,
+    target_width: int = None,
+    target_height: int = None,
+    max_pixels: int = None,
+):
+    """the (height, width) to decode a height x width video at.
+
+    Args:
+        height (int): height of the video.
+        width (int): width of the video.
+        target_width (int, optional): decode width, the height follows the aspect ratio when target_height is None. Defaults to None.
+        target_height (int, optional): decode height, the width follows the aspect ratio when target_width is None. Defaults to None.
+        max_pixels (int, optional): downscale, keeping the aspect ratio, until height * width <= max_pixels. Defaults to None.
+
+    Returns:
+        tuple: (height, width)
+    """
+
+    if target_width is not None and target_height is not None:
+        return int(target_height), int(target_width)
+    if target_width is not None:
+        return max(1, round(height * target_width / width)), int(target_width)
+    if target_height is not None:
+        return int(target_height), max(1, round(width * target_height / height))
+
+    if max_pixels is not None and height * width > max_pixels:
+        # 只缩小，不放大
+        scale = math.sqrt(max_pixels / (height * width))
+        return max(1, math.floor(height * scale)), max(1, math.floor(width * scale))
+
+    return height, width
 
-        total_frame_list.append(frame_info)
 
-        # 保存帧到输出目录
-        output_path = os.path.join(
-            output_dir, f"frame_{frame_idx}_second_{current_second}_ms_{current_ms}.jpg"
+def _decode_frames(
+    video_path: Path,
+    writer: FrameWriter,
+    frame_queue: queue.Queue,
+    stop_event: threading.Event,
+    sample_kwargs: dict,
+    batch_size: int,
+    skip_indices: set = None,
+    frame_range: tuple = None,
+    size_fn=None,
+    decoder: str = "decord",
+    num_threads: int = 0,
+    frame_cache: Path = None,
+):
+    """decode the frames in a background thread, and put the frame_info into the queue.
+
+    Args:
+        video_path (Path): path to the video.
+        writer (FrameWriter): background writer to save the frames.
+        frame_queue (queue.Queue): bounded queue shared with the consumer.
+        stop_event (threading.Event): set by the consumer when it stops early.
+        sample_kwargs (dict): fps, stride or timestamps for sample_frame_indices.
+        batch_size (int): number of frames fetched by one get_batch call.
+        skip_indices (set, optional): frame indices not to decode, e.g. already finished. Defaults to None.
+        frame_range (tuple, optional): only the sampled frames in [start, end), e.g. one shard of a long video. Defaults to None.
+        size_fn (callable, optional): (height, width) of the video -> (height, width) to decode at. Defaults to None, the source size.
+        decoder (str, optional): decoding backend, see utils.decoders.open_decoder. Defaults to "decord".
+        num_threads (int, optional): decode threads, 0 lets the backend decide. Defaults to 0.
+        frame_cache (Path, optional): root directory of the memory-mapped frame caches, see utils.frame_cache. Defaults to None, no cache.
+    """
+
+    def _put(item):
+        # 队列满时阻塞，但要能响应消费者的提前退出
+        while not stop_event.is_set():
+            try:
+                frame_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    vr = None
+    cache = None
+    try:
+        if frame_cache is not None:
+            cache = FrameCache(frame_cache, video_path)
+
+        # 任何尺寸的缓存里都有视频的元数据，不用打开视频
+        info = cache if cache is not None and cache.info is not None else None
+        if info is None:
+            vr = open_decoder(video_path, decoder, num_threads=num_threads)
+            info = vr
+
+        size = size_fn(*info.source_size) if size_fn is not None else info.source_size
+        if cache is not None and cache.size != tuple(size):
+            # 每个解码尺寸有自己的缓存
+            cache = FrameCache(frame_cache, video_path, cache.video_hash, size)
+
+        video_fps = info.fps  # 视频原始帧率
+        total_frames = info.frame_count  # 视频总帧数
+        duration = total_frames / video_fps  # 视频时长（秒）
+
+        sampled_indices = sample_frame_indices(total_frames, video_fps, **sample_kwargs)
+        frame_indices = sampled_indices
+        if frame_range is not None:
+            range_start, range_end = frame_range
+            frame_indices = [
+                i
+                for i in frame_indices
+                if i >= range_start and (range_end is None or i < range_end)
+            ]
+        if skip_indices:
+            frame_indices = [i for i in frame_indices if i not in skip_indices]
+
+        if cache is not None and cache.covers(frame_indices):
+            # 从 memmap 读帧，不再解码
+            source, cache = cache, None
+        else:
+            if vr is None:
+                vr = open_decoder(video_path, decoder, num_threads=num_threads)
+            if size != vr.source_size:
+                # 解码时直接缩放，不先解码完整分辨率再 resize
+                vr.set_size(*size)
+            source = vr
+
+            # 解码的帧写成缓存的一个 part，shard 和续跑也会留下它们解码的帧
+            if cache is not None and frame_indices:
+                cache.create(frame_indices, size, video_fps, total_frames, vr.source_size)
+            else:
+                cache = None
+
+        print(
+            f"视频帧率: {video_fps:.2f} FPS, 总帧数: {total_frames}, 时长: {duration:.2f} 秒, 采样帧数: {len(frame_indices)}"
         )
-        image.save(output_path)
-        print(f"保存帧: {output_path}")
-        saved_count += 1
 
-    print(f"视频分割和帧提取完成，共保存 {saved_count} 帧！")
+        # 按批次读取采样的帧
+        for start in range(0, len(frame_indices), batch_size):
+            if stop_event.is_set():
+                return
+
+            batch_indices = frame_indices[start : start + batch_size]
+            # 提取帧，RGB 的 NumPy 数组
+            batch_frames = source.get_batch(batch_indices)
+            if cache is not None:
+                cache.write(batch_indices, batch_frames)
+
+            for frame_idx, frame in zip(batch_indices, batch_frames):
+                # 当前帧对应的秒
+                current_second = int(frame_idx / video_fps)
+                current_ms = int(frame_idx * 1000 / video_fps)
+
+                # 保持 RGB 的 NumPy 数组，需要 PIL.Image 的地方再转换
+                frame_info = {
+                    "video_path": video_path,
+                    "frame_idx": frame_idx,
+                    "current_ms": current_ms,
+                    "second": current_second,
+                    "image": frame,
+                }
+
+                # 交给后台线程池保存帧，解码线程不等待编码和写盘
+                writer.submit(
+                    frame, f"frame_{frame_idx}_second_{current_second}_ms_{current_ms}"
+                )
+
+                if not _put(frame_info):
+                    return
+
+        if cache is not None:
+            cache.finish()
+
+        _put(_END)
+
+    except Exception as e:
+        # 把异常交给消费者线程重新抛出
+        _put(e)
+    finally:
+        if vr is not None:
+            vr.close()
+
+
+def iter_video_frames_decord(
+    video_path: Path,
+    output_dir: Path = None,
+    prefetch: int = 8,
+    fps: float = None,
+    stride: int = None,
+    timestamps: list = None,
+    batch_size: int = 16,
+    frame_format: str = "jpg",
+    quality: int = 95,
+    writer_mode: str = "thread",
+    num_writers: int = None,
+    skip_indices: set = None,
+    frame_range: tuple = None,
+    size_fn=None,
+    width: int = None,
+    height: int = None,
+    max_pixels: int = None,
+    decoder: str = "decord",
+    num_threads: int = 0,
+    frame_cache: Path = None,
+):
+    """iterate the frames of the video lazily.
+
+    The frames are decoded in a background thread and handed over through a
+    bounded queue, so at most ``prefetch`` frames are held in memory, and the
+    consumer can start on frame 0 while the later frames are still decoding.
+    The frames can be subsampled by fps, stride or timestamps, the selected
+    frames are fetched with the get_batch of the decoder (decord, PyAV or
+    OpenCV, see utils.decoders), and saved by a background FrameWriter pool.
+    The decoder decodes the frames at the requested size directly, and the
+    frames are yielded as RGB NumPy arrays. With frame_cache, the decoded
+    frames are also written into the memory-mapped frame cache, one part per
+    shard or resumed run, and the later runs read them from it, the frames
+    are then read-only views of the mapped file.
+
+    Args:
+        video_path (Path): path to the video.
+        output_dir (Path, optional): directory to save the frames. Defaults to None, not save.
+        prefetch (int, optional): max number of decoded frames waiting in the queue. Defaults to 8.
+        fps (float, optional): target fps of the sampled frames. Defaults to None.
+        stride (int, optional): sample one frame every stride frames. Defaults to None.
+        timestamps (list, optional): timestamps in seconds to sample. Defaults to None.
+        batch_size (int, optional): number of frames fetched by one get_batch call. Defaults to 16.
+        frame_format (str, optional): one of jpg, png, webp and npy. Defaults to "jpg".
+        quality (int, optional): quality for jpg and webp. Defaults to 95.
+        writer_mode (str, optional): "thread" or "process" writer pool. Defaults to "thread".
+        num_writers (int, optional): writer pool size, None means the cpu count. Defaults to None.
+        skip_indices (set, optional): frame indices not to decode, e.g. already finished. Defaults to None.
+        frame_range (tuple, optional): (start, end) frame indices to decode, end is exclusive, None means to the end. Defaults to None.
+        size_fn (callable, optional): (height, width) of the video -> (height, width) to decode at, e.g. the model resolution. Defaults to None, the source size.
+        width (int, optional): decode width, used when size_fn is None, see target_size. Defaults to None.
+        height (int, optional): decode height, used when size_fn is None, see target_size. Defaults to None.
+        max_pixels (int, optional): max decoded pixels per frame, used when size_fn is None, see target_size. Defaults to None.
+        decoder (str, optional): "decord", "pyav", "opencv" or "auto", the fastest one on this video. Defaults to "decord".
+        num_threads (int, optional): decode threads, 0 lets the backend decide. Defaults to 0.
+        frame_cache (Path, optional): root directory of the memory-mapped frame caches. Defaults to None, no cache.
+
+    Yields:
+        dict: frame_info with video_path, frame_idx, current_ms, second and image, an RGB (height, width, 3) uint8 array.
+    """
+
+    if size_fn is None and any(x is not None for x in (width, height, max_pixels)):
+        size_fn = lambda h, w: target_size(h, w, width, height, max_pixels)
+
+    # output_dir 为 None 时不保存帧
+    writer = FrameWriter(
+        output_dir,
+        frame_format=frame_format,
+        quality=quality,
+        mode=writer_mode,
+        num_workers=num_writers,
+        max_queue=max(1, prefetch) * 2,
+    )
+
+    frame_queue = queue.Queue(maxsize=max(1, prefetch))
+    stop_event = threading.Event()
+
+    decode_thread = threading.Thread(
+        target=_decode_frames,
+        args=(
+            video_path,
+            writer,
+            frame_queue,
+            stop_event,
+            {"fps": fps, "stride": stride, "timestamps": timestamps},
+            max(1, batch_size),
+            skip_indices,
+            frame_range,
+            size_fn,
+            decoder,
+            num_threads,
+            frame_cache,
+        ),
+        daemon=True,
+    )
+    decode_thread.start()
+
+    try:
+        while True:
+            item = frame_queue.get()
+
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            yield item
+    finally:
+        # 消费者提前退出时通知解码线程停止
+        stop_event.set()
+        decode_thread.join()
+        # 等待剩余的帧写完
+        writer.close()
+
+
+def split_video_and_extract_frames_decord(
+    video_path: Path,
+    output_dir: Path,
+    fps: float = None,
+    stride: int = None,
+    timestamps: list = None,
+    frame_format: str = "jpg",
+    quality: int = 95,
+    width: int = None,
+    height: int = None,
+    max_pixels: int = None,
+    decoder: str = "decord",
+    num_threads: int = 0,
+    frame_cache: Path = None,
+):
+
+    total_frame_list = list(
+        iter_video_frames_decord(
+            video_path,
+            output_dir,
+            fps=fps,
+            stride=stride,
+            timestamps=timestamps,
+            frame_format=frame_format,
+            quality=quality,
+            width=width,
+            height=height,
+            max_pixels=max_pixels,
+            decoder=decoder,
+            num_threads=num_threads,
+            frame_cache=frame_cache,
+        )
+    )
+
+    print(f"视频分割和帧提取完成，共保存 {len(total_frame_list)} 帧！")
 
     return total_frame_list